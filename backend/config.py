@@ -6,13 +6,123 @@ load_dotenv()
 class Config:
     MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
     MONGO_DB = os.getenv("MONGO_DB", "GuardDB")
+    # Connection pool of the per-process MongoClient (db.get_db_client); 0 = no limit
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
     SECRET_KEY = os.getenv("APP_SECRET", "super-secret-key")
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "jwt-super-secret-key")
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
     
     # Face recognition settings
     FACE_DISTANCE_THRESHOLD = 0.45
+    DUPLICATE_AUDIT_THRESHOLD = float(os.getenv("DUPLICATE_AUDIT_THRESHOLD", "0.4"))
+    EMBEDDING_MODEL_VERSION = os.getenv("EMBEDDING_MODEL_VERSION", "dlib-resnet-v1")
+    MAX_ENCODINGS_PER_REQUEST = 256
+    
+    # Face pipeline: detector backend (hog | cnn | haar | dnn), fallback when it finds nothing
+    FACE_DETECTOR = os.getenv("FACE_DETECTOR", "hog")
+    FACE_DETECTOR_FALLBACK = os.getenv("FACE_DETECTOR_FALLBACK", "cnn")
+    FACE_ENCODING_MODEL = "large"
+    FACE_ENCODING_JITTERS = 1
+    OPENCV_HAAR_CASCADE = os.getenv("OPENCV_HAAR_CASCADE", "")  # default: cv2.data bundled cascade
+    OPENCV_DNN_FACE_MODEL = os.getenv("OPENCV_DNN_FACE_MODEL", "")
+    
+    # Tiled detection for high-resolution match captures (longer side of the
+    # frame as uploaded, in pixels). The overlap should cover the largest face
+    # expected in a crowd frame; larger faces come from a downscaled whole-frame
+    # pass. Enrolment photos are never tiled.
+    TILED_DETECTION_MIN_SIDE = int(os.getenv("TILED_DETECTION_MIN_SIDE", "2000"))
+    TILED_DETECTION_TILE_SIZE = int(os.getenv("TILED_DETECTION_TILE_SIZE", "1024"))
+    TILED_DETECTION_OVERLAP = int(os.getenv("TILED_DETECTION_OVERLAP", "512"))  # at most half a tile
+    TILED_DETECTION_WORKERS = int(os.getenv("TILED_DETECTION_WORKERS", "0"))  # 0 = all cores
+    TILED_DETECTION_EXECUTOR = os.getenv("TILED_DETECTION_EXECUTOR", "process")  # process | thread
+    
+    # Scatter-gather matching: number of local matcher processes (0 = in-process gallery).
+    # Started per web worker, each worker holding its own copy of the gallery
+    MATCH_SHARDS = int(os.getenv("MATCH_SHARDS", "0"))
+    MATCH_SHARD_START_METHOD = os.getenv("MATCH_SHARD_START_METHOD", "spawn")
+    
+    # Seconds between gallery version checks in each worker
+    GALLERY_REFRESH_SECONDS = float(os.getenv("GALLERY_REFRESH_SECONDS", "2"))
+    
+    # Gallery snapshot published by scripts/export_gallery_snapshot.py and mapped
+    # read-only by every worker, "" = disabled. A tmpfs path such as
+    # /dev/shm/guard_gallery keeps it out of disk writeback.
+    GALLERY_SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", "storage/gallery_snapshot")
+    GALLERY_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("GALLERY_SNAPSHOT_INTERVAL_SECONDS", "2"))
+    
+    # Bulk registration from archive uploads: one import at a time per host, each
+    # with this many encoder processes next to the web workers
+    BULK_IMPORT_WORKERS = max(int(os.getenv("BULK_IMPORT_WORKERS", "2")), 1)
+    BULK_IMPORT_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+    
+    # utils/training_watcher.py: quiet period before a changed folder is enrolled,
+    # and rescan interval when inotify is unavailable
+    TRAINING_WATCH_DEBOUNCE_SECONDS = float(os.getenv("TRAINING_WATCH_DEBOUNCE_SECONDS", "2"))
+    TRAINING_WATCH_POLL_SECONDS = float(os.getenv("TRAINING_WATCH_POLL_SECONDS", "5"))
+    
+    # Background re-embedding (scripts/reembed.py): images encoded per second, 0 = unthrottled
+    REEMBED_IMAGES_PER_SECOND = float(os.getenv("REEMBED_IMAGES_PER_SECOND", "5"))
     
     # Storage settings
     STORAGE_TRAINING = "storage/training"
     STORAGE_UPLOADS = "storage/uploads"
+    STORAGE_CAPTURES = os.getenv("STORAGE_CAPTURES", "storage/captures")
+    EMBEDDING_CHECKPOINT_PATH = "storage/.embedding_checkpoint.json"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "storage/.embedding_cache.sqlite")
+    # How long a cache write waits for another process's transaction before
+    # the cache is skipped for the rest of that job or request
+    EMBEDDING_CACHE_BUSY_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_CACHE_BUSY_TIMEOUT_SECONDS", "10"))
+    STORAGE_THUMBNAILS = os.getenv("STORAGE_THUMBNAILS", "storage/thumbnails")
+    
+    # Shared image store (services/blob_store.py): local | gridfs | s3. Keys
+    # are "training/..." and "captures/..." whatever STORAGE_TRAINING and
+    # STORAGE_CAPTURES point at. Remote backends read through a local cache
+    # in those directories, capped at
+    # BLOB_CACHE_MAX_BYTES (0 = unbounded) by scripts/compact_captures.py
+    BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+    BLOB_GRIDFS_BUCKET = os.getenv("BLOB_GRIDFS_BUCKET", "blobs")
+    BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET", "")
+    BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "")
+    BLOB_S3_ENDPOINT_URL = os.getenv("BLOB_S3_ENDPOINT_URL", "")  # e.g. a local MinIO
+    BLOB_S3_REGION = os.getenv("BLOB_S3_REGION", "")
+    BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", "0"))
+    
+    # Match/verify captures (scripts/compact_captures.py): unmatched ones are cut
+    # down to face crops after CAPTURE_CROP_AFTER_DAYS, and every capture is
+    # dropped CAPTURE_RETENTION_DAYS after it was last uploaded
+    CAPTURE_CROP_AFTER_DAYS = float(os.getenv("CAPTURE_CROP_AFTER_DAYS", "7"))
+    CAPTURE_RETENTION_DAYS = float(os.getenv("CAPTURE_RETENTION_DAYS", "90"))
+    CAPTURE_COMPACTION_FILES_PER_SECOND = float(os.getenv("CAPTURE_COMPACTION_FILES_PER_SECOND", "20"))
+    CAPTURE_COMPACTION_INTERVAL_SECONDS = float(os.getenv("CAPTURE_COMPACTION_INTERVAL_SECONDS", "3600"))
+    
+    # Student photo derivatives: longest side in px, and how long browsers may
+    # reuse one before revalidating with its ETag
+    THUMBNAIL_SIZES = (64, 160, 480)
+    THUMBNAIL_MAX_AGE_SECONDS = int(os.getenv("THUMBNAIL_MAX_AGE_SECONDS", "3600"))
+    MAX_AVATARS_PER_REQUEST = 500
+    
+    # GET /api/students/ pages, and how long filtered totals are reused
+    STUDENTS_PAGE_SIZE = 100
+    STUDENTS_MAX_PAGE_SIZE = 1000
+    STUDENT_COUNT_CACHE_SECONDS = float(os.getenv("STUDENT_COUNT_CACHE_SECONDS", "30"))
+    
+    # GET /api/violations/ pages
+    VIOLATIONS_PAGE_SIZE = 50
+    VIOLATIONS_MAX_PAGE_SIZE = 1000
+    
+    # Resolved profile photos (roll_no -> path, content hash) kept per process
+    PROFILE_IMAGE_CACHE_SIZE = int(os.getenv("PROFILE_IMAGE_CACHE_SIZE", "4096"))
+    
+    # Hand image bodies to the front server instead of streaming them from a
+    # worker: "x-accel" for nginx (an internal location IMAGE_ACCEL_PREFIX
+    # aliased to IMAGE_ACCEL_ROOT), "x-sendfile" for Apache/lighttpd, "" = off
+    IMAGE_SENDFILE = os.getenv("IMAGE_SENDFILE", "")
+    USE_X_SENDFILE = IMAGE_SENDFILE == "x-sendfile"
+    IMAGE_ACCEL_ROOT = os.getenv("IMAGE_ACCEL_ROOT", "storage")
+    IMAGE_ACCEL_PREFIX = os.getenv("IMAGE_ACCEL_PREFIX", "/protected-storage/")
@@ -1,9 +1,157 @@
-from pymongo import MongoClient, ASCENDING
+import atexit
+import os
+import threading
+import time
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
 from config import Config
 
+# One client (and connection pool) per process, see get_db_client()
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Connection pool counters for this process, fed by pymongo's CMAP events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.pool_clears = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": round(1000 * self.wait_seconds_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(1000 * self.wait_seconds_max, 3),
+                "pool_clears": self.pool_clears,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            # duration: time spent waiting for the connection (pymongo >= 4.7)
+            waited = getattr(event, "duration", 0.0)
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+pool_stats = PoolStats()
+
+
+def _ms_or_none(value):
+    return value or None
+
+
 def get_db_client():
-    client = MongoClient(Config.MONGO_URL)
-    return client
+    """
+    This process's MongoClient, created on first use. A forked child (a
+    gunicorn worker of a --preload master, a fork-started pool process) must
+    not share its parent's sockets or monitor threads, so it gets a fresh
+    client the first time it asks; the inherited one is left alone.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                if _client_pid != pid:
+                    pool_stats.reset()
+                _client = MongoClient(
+                    Config.MONGO_URL,
+                    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=_ms_or_none(Config.MONGO_MAX_IDLE_TIME_MS),
+                    waitQueueTimeoutMS=_ms_or_none(Config.MONGO_WAIT_QUEUE_TIMEOUT_MS),
+                    connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=_ms_or_none(Config.MONGO_SOCKET_TIMEOUT_MS),
+                    event_listeners=[pool_stats],
+                )
+                _client_pid = pid
+    return _client
+
+
+def close_db_client():
+    """
+    Close this process's client, if it created one. Registered with atexit;
+    call it from a gunicorn worker_exit hook for a prompt shutdown.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+atexit.register(close_db_client)
+
+
+def db_pool_stats():
+    """
+    Pool counters and settings of this worker process.
+    """
+    return {
+        "pid": os.getpid(),
+        "connected": _client is not None and _client_pid == os.getpid(),
+        "max_pool_size": Config.MONGO_MAX_POOL_SIZE,
+        "min_pool_size": Config.MONGO_MIN_POOL_SIZE,
+        **pool_stats.snapshot(),
+        "sampled_at": time.time(),
+    }
 
 def get_db():
     client = get_db_client()
@@ -25,6 +173,10 @@ def init_db():
     db.students.create_index([("roll_no", ASCENDING)], unique=True)
     db.students.create_index([("department", ASCENDING)])
     db.students.create_index([("section", ASCENDING)])
+    # Gallery snapshot deltas: students changed since the last export
+    db.students.create_index([("updated_at", ASCENDING)])
+    # Filtered keyset pages of GET /api/students/
+    db.students.create_index([("department", ASCENDING), ("section", ASCENDING), ("roll_no", ASCENDING)])
     
     # Violations Indexes
     db.violations.create_index([("student_id", ASCENDING)])
@@ -32,6 +184,16 @@ def init_db():
     db.violations.create_index([("location", ASCENDING)])
     db.violations.create_index([("timestamp", ASCENDING)])
     db.violations.create_index([("status", ASCENDING)])
+    # Idempotency key for violations replayed from offline edge matchers
+    db.violations.create_index([("client_event_id", ASCENDING)], unique=True, sparse=True)
+    # Keyset pages of GET /api/violations/, newest first, alone or after an equality filter
+    db.violations.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+    for field in ("roll_no", "type", "location", "status", "department"):
+        db.violations.create_index([(field, ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    
+    # Capture store: TTL retention and the compaction job's scan
+    db.captures.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    db.captures.create_index([("matched", ASCENDING), ("compacted", ASCENDING), ("last_seen", ASCENDING)])
     
     print(f"Initialized Database: {Config.MONGO_DB} with indexes.")
 
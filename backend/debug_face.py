@@ -20,8 +20,8 @@ from pathlib import Path
 old_stderr = sys.stderr
 sys.stderr = io.StringIO()
 try:
-    import face_recognition
     import numpy as np
+    from services.face_pipeline import get_pipeline
 finally:
     sys.stderr = old_stderr
 
@@ -43,16 +43,18 @@ def debug_face_extraction(image_path):
     
     try:
         # Step 1: Load image
+        pipeline = get_pipeline()
+        timings = {}
         print("Step 1: Loading image...")
-        image = face_recognition.load_image_file(image_path)
-        print(f"  ✓ Image loaded")
+        image = pipeline.load(image_path, timings)
+        print(f"  ✓ Image loaded ({timings['load_ms']:.1f} ms)")
         print(f"  ✓ Image shape: {image.shape} (height, width, channels)\n")
         
         # Step 2: Detect faces
         print("Step 2: Detecting faces...")
-        face_locations = face_recognition.face_locations(image)
+        face_locations = pipeline.detect(image, timings)
         num_faces = len(face_locations)
-        print(f"  ✓ Faces detected: {num_faces}\n")
+        print(f"  ✓ Faces detected: {num_faces} ({timings['detector']}, {timings['detect_ms']:.1f} ms)\n")
         
         if num_faces == 0:
             print("❌ PROBLEM: No faces detected!")
@@ -71,9 +73,9 @@ def debug_face_extraction(image_path):
         
         # Step 3: Extract encodings
         print("Step 3: Extracting face encodings...")
-        encodings = face_recognition.face_encodings(image)
+        encodings = pipeline.encode(image, face_locations, timings)
         num_encodings = len(encodings)
-        print(f"  ✓ Encodings extracted: {num_encodings}\n")
+        print(f"  ✓ Encodings extracted: {num_encodings} ({timings['encode_ms']:.1f} ms)\n")
         
         if num_encodings == 0:
             print("❌ PROBLEM: Face detected but encoding failed!")
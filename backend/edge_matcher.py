@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Offline edge matcher for checkpoints with poor connectivity.
+
+Commands:
+    export  Package a department's gallery into a bundle (needs MongoDB)
+    match   Match one image against a bundle
+    record  Queue a confirmed violation on disk
+    sync    Replay queued violations into the backend database in batches
+    serve   Run a small local HTTP matcher on top of a bundle. Every
+            request needs "Authorization: Bearer <token>" with the token
+            printed by export (--token or EDGE_API_TOKEN to choose one)
+
+Examples:
+    python edge_matcher.py export --department CSE --out bundles/CSE
+    python edge_matcher.py match --bundle bundles/CSE capture.jpg
+    python edge_matcher.py record --bundle bundles/CSE --roll-no 23BQ1A0566 \\
+        --section A --type Bunk --location "A Block" --remarks "Left campus"
+    python edge_matcher.py sync --bundle bundles/CSE
+    python edge_matcher.py serve --bundle bundles/CSE --port 8081
+    curl -H "Authorization: Bearer $TOKEN" -F image=@capture.jpg \\
+        http://127.0.0.1:8081/api/detection/match
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from services.edge_service import EdgeMatcher, export_bundle
+
+
+def cmd_export(args):
+    token = args.token or os.getenv("EDGE_API_TOKEN")
+    result = export_bundle(args.department, args.out, token)
+    print(f"Exported {result['students']} students of {result['department']} "
+          f"(gallery v{result['gallery_version']}) to {args.out}")
+    if not token:
+        print(f"API token for serve (shown once): {result['token']}")
+
+
+def cmd_match(args):
+    matcher = EdgeMatcher(args.bundle)
+    print(json.dumps(matcher.match_face(args.image, args.section), indent=2))
+
+
+def cmd_record(args):
+    matcher = EdgeMatcher(args.bundle)
+    try:
+        event_id = matcher.record_violation({
+            "roll_no": args.roll_no,
+            "section": args.section,
+            "type": args.type,
+            "location": args.location,
+            "remarks": args.remarks,
+        })
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"Queued violation {event_id} ({matcher.queue.pending_count()} pending)")
+
+
+def cmd_sync(args):
+    matcher = EdgeMatcher(args.bundle)
+    pending = matcher.queue.pending_count()
+    print(f"Syncing {pending} queued violation(s)...")
+    result = matcher.sync(args.batch_size)
+    print(f"Sent {result['sent']}: {result['inserted']} inserted, "
+          f"{result['duplicates']} already on server, {len(result['errors'])} rejected")
+    for error in result["errors"]:
+        print(f"  ✗ {error}")
+
+
+def create_app(matcher, batch_size=100):
+    """
+    The local HTTP API of a bundle; every route needs the bundle's token.
+    """
+    from flask import Flask, request, jsonify
+
+    app = Flask(__name__)
+
+    @app.before_request
+    def authenticate():
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not matcher.check_token(token.strip()):
+            return jsonify({"success": False, "error": "Missing or invalid edge API token"}), 401
+
+    @app.route("/api/detection/match", methods=["POST"])
+    def match():
+        if 'image' not in request.files:
+            return jsonify({"error": "No image uploaded"}), 400
+        fd, path = tempfile.mkstemp(suffix=".jpg")
+        os.close(fd)
+        try:
+            request.files['image'].save(path)
+            return jsonify(matcher.match_face(path, request.form.get("section"))), 200
+        finally:
+            os.remove(path)
+
+    @app.route("/api/violations/", methods=["POST"])
+    def record():
+        try:
+            event_id = matcher.record_violation(request.get_json(silent=True) or {})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, "id": event_id, "queued": True}), 202
+
+    @app.route("/sync", methods=["POST"])
+    def sync():
+        try:
+            return jsonify({"success": True, **matcher.sync(batch_size)}), 200
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 503
+
+    return app
+
+
+def cmd_serve(args):
+    matcher = EdgeMatcher(args.bundle)
+    if not matcher.manifest.get("api_token_sha256"):
+        print("✗ This bundle has no API token; export it again before serving it")
+        return 1
+    create_app(matcher, args.batch_size).run(host=args.host, port=args.port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export")
+    p.add_argument("--department", required=True)
+    p.add_argument("--out", required=True)
+    p.add_argument("--token", help="API token for serve (default: EDGE_API_TOKEN, else a random one)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("match")
+    p.add_argument("--bundle", required=True)
+    p.add_argument("--section")
+    p.add_argument("image")
+    p.set_defaults(func=cmd_match)
+
+    p = sub.add_parser("record")
+    p.add_argument("--bundle", required=True)
+    p.add_argument("--roll-no", required=True)
+    p.add_argument("--section", required=True)
+    p.add_argument("--type", required=True)
+    p.add_argument("--location", required=True)
+    p.add_argument("--remarks", required=True)
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser("sync")
+    p.add_argument("--bundle", required=True)
+    p.add_argument("--batch-size", type=int, default=100)
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("serve")
+    p.add_argument("--bundle", required=True)
+    # Listen on other interfaces only deliberately, e.g. --host 0.0.0.0
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--batch-size", type=int, default=100)
+    p.set_defaults(func=cmd_serve)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
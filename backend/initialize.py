@@ -25,7 +25,8 @@ from werkzeug.security import generate_password_hash
 old_stderr = sys.stderr
 sys.stderr = io.StringIO()
 try:
-    import face_recognition
+    from services.embedding_cache import EmbeddingCache
+    from services.face_pipeline import get_pipeline
 finally:
     sys.stderr = old_stderr
 
@@ -80,7 +81,7 @@ def load_student_image(student_id):
         student_id: Student ID (e.g., "23BQ1A0566")
     
     Returns:
-        (image_array, embedding) or (None, None) if not found
+        (image_path, embedding) or (None, None) if not found
     """
     image_path = STORAGE_TRAINING / f"{student_id}.png"
     
@@ -91,14 +92,23 @@ def load_student_image(student_id):
             return None, None
     
     try:
-        image = face_recognition.load_image_file(str(image_path))
-        embedding = extract_embedding(image)
-        return image, embedding
+        embedding = extract_embedding(image_path)
+        return image_path, embedding
     except Exception as e:
         print(f"  ⚠ Failed to load {image_path.name}: {e}")
         return None, None
 
 
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
 def extract_embedding(image_path_or_array):
     """
     Extract 128-dimensional embedding using face_recognition.
@@ -119,12 +129,11 @@ def extract_embedding(image_path_or_array):
         List of 128 floats (embedding) or None if no face detected
     """
     try:
-        if isinstance(image_path_or_array, str):
-            img = face_recognition.load_image_file(image_path_or_array)
+        if isinstance(image_path_or_array, np.ndarray):
+            encodings = get_pipeline().process(image_path_or_array).encodings
         else:
-            img = image_path_or_array
-        
-        encodings = face_recognition.face_encodings(img)
+            # Paths go through the content-hash cache; unchanged images aren't re-encoded
+            encodings = get_embedding_cache().process(image_path_or_array).encodings
         
         if len(encodings) == 0:
             return None  # No face detected
@@ -221,6 +230,8 @@ def init_db():
         }
         db.students.insert_one(student_doc)
     
+    if _embedding_cache is not None:
+        _embedding_cache.close()
     print(f"\n✓ {students_initialized}/{len(DEMO_STUDENTS)} students initialized with embeddings")
     
     print("\n✅ Database initialization complete!")
@@ -6,8 +6,10 @@ embeddings using face_recognition and upserting into MongoDB.
 Requirements implemented:
 - Reads files: storage/training/<student_id>.(jpg|jpeg|png)
 - Extracts student_id from filename (stem)
-- Loads image with face_recognition.load_image_file()
-- Extracts face encoding via face_recognition.face_encodings()
+- Loads, detects and encodes through the shared FacePipeline
+  (services/face_pipeline.py), the same settings used for matching
+- Results are cached per image content hash (services/embedding_cache.py),
+  so re-runs only encode new or modified images
 - Ensures exactly one face per image; otherwise skips
 - Upserts student document into MongoDB with embedding (128 floats)
 - Adds debug prints for processing, success, and failures
@@ -32,9 +34,9 @@ from datetime import datetime
 old_stderr = sys.stderr
 sys.stderr = io.StringIO()
 try:
-    import face_recognition
     import numpy as np
     from pymongo import MongoClient
+    from services.embedding_cache import EmbeddingCache
 finally:
     sys.stderr = old_stderr
 
@@ -50,7 +52,7 @@ def is_image_file(p: Path):
     return p.suffix.lower() in ALLOWED_EXT
 
 
-def process_image_file(path: Path, db):
+def process_image_file(path: Path, db, cache: EmbeddingCache):
     """Process a single image file and upsert student in DB.
 
     Returns True if registration (upsert) occurred with a valid embedding,
@@ -61,15 +63,11 @@ def process_image_file(path: Path, db):
     print(f"Processing: {path.name} -> student_id={student_id}")
 
     try:
-        image = face_recognition.load_image_file(str(path))
+        encodings = cache.process(path).encodings
     except Exception as e:
         print(f"  ⚠ Failed to load image: {e}")
         return False
 
-    # detect faces
-    locations = face_recognition.face_locations(image)
-    encodings = face_recognition.face_encodings(image, locations)
-
     if len(encodings) == 0:
         print("  ✗ No face detected — skipping")
         return False
@@ -138,16 +136,19 @@ def main():
     total = 0
     success = 0
     skipped = 0
+    cache = EmbeddingCache()
 
     for p in files:
         total += 1
-        ok = process_image_file(p, db)
+        ok = process_image_file(p, db, cache)
         if ok:
             success += 1
         else:
             skipped += 1
 
+    cache.close()
     print(f"\nDone. Processed {total} files: {success} registered, {skipped} skipped")
+    print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
 
     return 0
 
@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required
-from utils.auth_decorators import role_required
-from db import get_db
+from utils.auth_decorators import role_required, admin_required
+from db import get_db, db_pool_stats
 from datetime import datetime, time
 
 dashboard_bp = Blueprint("dashboard", __name__)
@@ -164,3 +164,14 @@ def get_dashboard_kpis():
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@dashboard_bp.route("/db-pool", methods=["GET"])
+@jwt_required()
+@admin_required()
+def get_db_pool_stats():
+    """
+    MongoDB connection pool usage of the worker that answers (each worker
+    process has its own pool; the pid tells them apart).
+    """
+    return jsonify({"success": True, **db_pool_stats()}), 200
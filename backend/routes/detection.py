@@ -1,10 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from services.detection_service import DetectionService
+from services.gallery_service import GalleryService
+from services.capture_store import CaptureStore
 from config import Config
-from pathlib import Path
-import datetime
-import os
+from utils.embedding_codec import decode_binary_encodings, decode_base64_encoding
 
 detection_bp = Blueprint("detection", __name__)
 
@@ -18,19 +18,94 @@ def match_student():
     dept = request.form.get("department")
     section = request.form.get("section")
     
-    # Save capture for audit
-    os.makedirs(Config.STORAGE_UPLOADS, exist_ok=True)
-    filename = f"capture_{datetime.datetime.now().timestamp()}.jpg"
-    save_path = Path(Config.STORAGE_UPLOADS) / filename
-    file.save(save_path)
-    
     try:
+        # Save capture for audit
+        capture_hash, save_path = CaptureStore.save(file.stream, "match")
+
         result = DetectionService.match_face(str(save_path), dept, section)
+        CaptureStore.record_result(capture_hash, result)
         
         # Inject the captured filename so the frontend can render it back
         if type(result) is dict:
-            result["captured_filename"] = filename
+            result["captured_filename"] = CaptureStore.name_for(capture_hash)
             
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+@detection_bp.route("/verify", methods=["POST"])
+@jwt_required()
+def verify_student():
+    if 'image' not in request.files:
+        return jsonify({"error": "No image uploaded"}), 400
+    roll_no = (request.form.get("roll_no") or "").strip()
+    if not roll_no:
+        return jsonify({"success": False, "error": "roll_no is required"}), 400
+
+    file = request.files['image']
+
+    try:
+        # Save capture for audit
+        capture_hash, save_path = CaptureStore.save(file.stream, "verify")
+
+        result = DetectionService.verify_face(str(save_path), roll_no)
+        CaptureStore.record_result(capture_hash, result)
+        result["captured_filename"] = CaptureStore.name_for(capture_hash)
+        status = 404 if result.get("error", "").startswith("Student not found") else 200
+        return jsonify(result), status
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@detection_bp.route("/match-embedding", methods=["POST"])
+@jwt_required()
+def match_embedding():
+    """
+    1:N search for encodings computed on the client.
+
+    Accepts either a raw application/octet-stream body of packed float32
+    rows (model_version/department/section as query args) or JSON with a
+    base64 "encoding" or a list of "encodings".
+    """
+    try:
+        if request.mimetype == "application/octet-stream":
+            params = request.args
+            encodings = decode_binary_encodings(request.get_data())
+            single = len(encodings) == 1
+        else:
+            params = request.get_json(silent=True) or {}
+            if params.get("encodings") is not None:
+                payload = params["encodings"]
+                if not isinstance(payload, list) or not payload:
+                    return jsonify({"success": False, "error": "encodings must be a non-empty list"}), 400
+                single = False
+            elif params.get("encoding") is not None:
+                payload = [params["encoding"]]
+                single = True
+            else:
+                return jsonify({"success": False, "error": "No encoding supplied"}), 400
+            encodings = [row for value in payload for row in decode_base64_encoding(value)]
+            single = single and len(encodings) == 1
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    model_version = params.get("model_version") or request.headers.get("X-Model-Version")
+    live_model_version = GalleryService.live_pipeline().model_version
+    if model_version != live_model_version:
+        return jsonify({
+            "success": False,
+            "error": f"Unsupported model_version {model_version!r}, expected {live_model_version!r}"
+        }), 409
+
+    if len(encodings) > Config.MAX_ENCODINGS_PER_REQUEST:
+        return jsonify({
+            "success": False,
+            "error": f"At most {Config.MAX_ENCODINGS_PER_REQUEST} encodings per request"
+        }), 413
+
+    try:
+        results = DetectionService.match_encodings(encodings, params.get("department"), params.get("section"))
+        if single:
+            return jsonify(results[0]), 200
+        return jsonify({"success": True, "results": results}), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
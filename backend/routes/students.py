@@ -1,11 +1,20 @@
-from flask import Blueprint, request, jsonify, send_file
+import base64
+import io
+import json
+import tempfile
+from urllib.parse import quote
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from flask_jwt_extended import jwt_required
-from services.student_service import StudentService
+from services.student_service import LIST_EXTRA_FIELDS, LIST_FIELDS, StudentService
+from services.bulk_import_service import BulkImportService
+from services.embedding_cache import EmbeddingCache
+from services.thumbnail_service import THUMBNAIL_FORMATS, ThumbnailService
+from services.blob_store import get_blob_store
 from utils.auth_decorators import role_required
 import os
 import uuid
 import shutil
-import face_recognition
+from services.gallery_service import GalleryService
 from pathlib import Path
 from config import Config
 from pymongo.errors import DuplicateKeyError
@@ -13,6 +22,27 @@ from db import get_db
 
 students_bp = Blueprint("students", __name__)
 
+
+def _send_image(path, mimetype, max_age, **kwargs):
+    """
+    Response for an image on disk. With IMAGE_SENDFILE=x-accel only the
+    headers are produced here and nginx streams the body, e.g.
+
+        location /protected-storage/ { internal; alias /app/backend/storage/; }
+
+    x-sendfile is handled by send_file itself (USE_X_SENDFILE).
+    """
+    if Config.IMAGE_SENDFILE == "x-accel":
+        root = os.path.abspath(Config.IMAGE_ACCEL_ROOT)
+        if os.path.commonpath([root, path]) == root:
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            response = Response(mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = Config.IMAGE_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative)
+            response.cache_control.max_age = max_age
+            return response
+    return send_file(path, mimetype=mimetype, max_age=max_age, **kwargs)
+
+
 @students_bp.route("/", methods=["POST"])
 @jwt_required()
 @role_required("staff")
@@ -82,70 +112,380 @@ def register_student():
     file.save(image_path)
     
     try:
-        # Load and encode face
-        image = face_recognition.load_image_file(str(image_path))
-        face_locations = face_recognition.face_locations(image)
-        if not face_locations:
+        # Detect, align and encode once; the box, landmarks and aligned face
+        # chip are kept in the embedding cache for later re-embedding
+        pipeline = GalleryService.live_pipeline()
+        cache = EmbeddingCache(pipeline=pipeline, commit_every=1)
+        try:
+            result = cache.process(str(image_path))
+        finally:
+            cache.close()
+        if not result.locations:
             shutil.rmtree(storage_dir, ignore_errors=True)
             return jsonify({"success": False, "error": "No face detected in image"}), 400
             
-        encodings = face_recognition.face_encodings(image)
+        encodings = result.encodings
         if not encodings:
             shutil.rmtree(storage_dir, ignore_errors=True)
             return jsonify({"success": False, "error": "Could not extract face encoding"}), 400
             
-        data["face"] = {
-            "image_filenames": [image_filename],
-            "embedding": encodings[0].tolist(),
-            "status": "active"
-        }
+        data["face"] = StudentService.face_document([image_filename], [encodings[0]], pipeline.version)
         
+        get_blob_store().put_file(image_path)
         StudentService.create_student(data)
+        try:
+            ThumbnailService.generate_all(image_path)
+        except Exception as e:
+            # Served lazily on first request instead
+            print(f"Thumbnail generation failed for {roll_no}: {e}")
         return jsonify({"success": True, "roll_no": roll_no, "message": "Student registered successfully"}), 201
         
     except DuplicateKeyError:
         # Race condition fallback
-        shutil.rmtree(storage_dir, ignore_errors=True)
+        _discard_registration(storage_dir, image_path)
         return jsonify({"success": False, "error": f"Student with Roll Number {roll_no} is already registered."}), 409
     except Exception as e:
-        shutil.rmtree(storage_dir, ignore_errors=True)
+        _discard_registration(storage_dir, image_path)
         return jsonify({"success": False, "error": str(e)}), 400
 
+
+def _discard_registration(storage_dir, image_path):
+    """
+    Remove the photo of a failed registration, locally and from the blob
+    store if it was already uploaded.
+    """
+    shutil.rmtree(storage_dir, ignore_errors=True)
+    try:
+        get_blob_store().delete_file(image_path)
+    except Exception as e:
+        print(f"Could not delete {image_path} from the blob store: {e}")
+
+@students_bp.route("/bulk", methods=["POST"])
+@jwt_required()
+@role_required("staff")
+def bulk_register_students():
+    """
+    Register students from a ZIP/tar archive with a CSV manifest and photos.
+    Accepts a multipart 'archive' file or the raw archive as the request body
+    (?filename=students.tar.gz). Progress is streamed back as NDJSON.
+    """
+    if 'archive' in request.files:
+        upload = request.files['archive']
+        fileobj, filename = upload.stream, upload.filename or ""
+        # Take ownership of the spooled upload: Flask closes request.files when
+        # the view returns, before the streamed response has read the archive
+        upload.stream = io.BytesIO()
+    elif request.content_length:
+        filename = request.args.get("filename", "")
+        if not filename:
+            filename = "upload.zip" if request.mimetype in ("application/zip", "application/x-zip-compressed") else "upload.tar"
+        fileobj = request.stream
+    else:
+        return jsonify({"success": False, "error": "No archive uploaded"}), 400
+
+    try:
+        workers = int(request.args.get("workers", 0)) or None
+        batch_size = max(int(request.args.get("batch_size", 100)), 1)
+    except ValueError:
+        return jsonify({"success": False, "error": "workers and batch_size must be integers"}), 400
+
+    # Encoding an archive is CPU-heavy and runs beside the web workers
+    import_lock = BulkImportService.try_lock()
+    if import_lock is None:
+        if fileobj is not request.stream:
+            fileobj.close()
+        return jsonify({"success": False, "error": "Another bulk import is running, try again later"}), 409
+
+    try:
+        if filename.lower().endswith(".zip") and not getattr(fileobj, "seekable", lambda: False)():
+            # ZIP reading needs random access; spool the body to disk, not memory
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(fileobj, spooled, 1 << 20)
+            spooled.seek(0)
+            if fileobj is not request.stream:
+                fileobj.close()
+            fileobj = spooled
+    except Exception:
+        import_lock.close()
+        raise
+
+    def generate():
+        try:
+            for event in BulkImportService.import_archive(fileobj, filename, workers, batch_size):
+                yield json.dumps(event) + "\n"
+        finally:
+            if fileobj is not request.stream:
+                fileobj.close()
+            import_lock.close()
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    # Also released if the client goes away before the stream starts
+    response.call_on_close(import_lock.close)
+    return response
+
 @students_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_students():
+    """
+    Students in roll_no order, one page at a time.
+
+    ?limit= (default STUDENTS_PAGE_SIZE) and ?after=<next_cursor> page
+    through the list; ?department=&section=&year= filter it, and
+    ?roll_prefix=23BQ,24BQ5A keeps roll numbers starting with any prefix.
+    ?fields=a,b picks fields from LIST_FIELDS and LIST_EXTRA_FIELDS
+    (embeddings are never included). ?count=estimate|exact adds "total",
+    ?summary=1 the violation counters summed over the whole filtered list.
+    """
     try:
-        students = StudentService.get_students()
-        return jsonify(students), 200
+        limit = int(request.args.get("limit", Config.STUDENTS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    if not 1 <= limit <= Config.STUDENTS_MAX_PAGE_SIZE:
+        return jsonify({"success": False, "error": f"limit must be 1-{Config.STUDENTS_MAX_PAGE_SIZE}"}), 400
+
+    fields = None
+    if request.args.get("fields"):
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in LIST_FIELDS and f not in LIST_EXTRA_FIELDS]
+        if unknown:
+            return jsonify({"success": False, "error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    count = request.args.get("count")
+    if count not in (None, "estimate", "exact"):
+        return jsonify({"success": False, "error": "count must be estimate or exact"}), 400
+
+    try:
+        roll_prefixes = [p for p in (request.args.get("roll_prefix") or "").split(",") if p.strip()]
+        query = StudentService.list_filter(
+            request.args.get("department"), request.args.get("section"), request.args.get("year"), roll_prefixes
+        )
+        after = (request.args.get("after") or "").strip().upper() or None
+        students, next_cursor = StudentService.list_students(query, after, limit, fields)
+        response = {"success": True, "students": students, "next_cursor": next_cursor}
+        if count:
+            response["total"] = StudentService.count_students(query, exact=count == "exact")
+        if request.args.get("summary") in ("1", "true"):
+            response["summary"] = StudentService.summarize_students(query)
+        return jsonify(response), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@students_bp.route("/avatars", methods=["GET"])
+@jwt_required()
+def get_student_avatars():
+    """
+    Avatars for a whole list page in one request:
+    ?roll_nos=A,B,C&size=64. Paths are resolved with one $in query and
+    tiles come from the cached derivatives.
+
+    layout=sprite (default): JSON with one square-tiled sprite sheet as a
+    data URI and the {roll_no: [x, y]} offset of each tile.
+    layout=ndjson: a header line, then one line per student with its
+    derivative as base64.
+    """
+    roll_nos = list(dict.fromkeys(
+        r.strip().upper() for r in request.args.get("roll_nos", "").split(",") if r.strip()
+    ))
+    if not roll_nos:
+        return jsonify({"success": False, "error": "roll_nos is required"}), 400
+    if len(roll_nos) > Config.MAX_AVATARS_PER_REQUEST:
+        return jsonify({"success": False, "error": f"At most {Config.MAX_AVATARS_PER_REQUEST} roll_nos per request"}), 413
+    try:
+        size = ThumbnailService.pick_size(int(request.args.get("size", 64)))
+    except ValueError:
+        return jsonify({"success": False, "error": "size must be an integer"}), 400
+    layout = request.args.get("layout", "sprite")
+    if layout not in ("sprite", "ndjson"):
+        return jsonify({"success": False, "error": "layout must be sprite or ndjson"}), 400
+    fmt = request.args.get("format") or ("webp" if "image/webp" in request.headers.get("Accept", "") else "jpeg")
+    if fmt not in THUMBNAIL_FORMATS:
+        return jsonify({"success": False, "error": f"format must be one of {list(THUMBNAIL_FORMATS)}"}), 400
+
+    paths = {}
+    store = get_blob_store()
+    for roll_no, path in StudentService.profile_image_paths(roll_nos).items():
+        try:
+            paths[roll_no] = store.ensure_local(path)
+        except FileNotFoundError:
+            continue
+    ordered = {roll_no: paths[roll_no] for roll_no in roll_nos if roll_no in paths}
+    missing = [roll_no for roll_no in roll_nos if roll_no not in paths]
+
+    etags = [f"{roll_no}:{ThumbnailService.etag(path, size, fmt)}" for roll_no, path in ordered.items()]
+    etag = ThumbnailService.bundle_etag(etags, layout, size, fmt, *missing)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif layout == "sprite":
+        data, mimetype, columns, offsets = ThumbnailService.sprite(ordered, size, fmt)
+        response = jsonify({
+            "success": True,
+            "size": size,
+            "columns": columns,
+            "sprite": f"data:{mimetype};base64,{base64.b64encode(data).decode()}",
+            "offsets": {roll_no: list(xy) for roll_no, xy in offsets.items()},
+            "missing": missing + [r for r in ordered if r not in offsets],
+        })
+    else:
+        def generate():
+            yield json.dumps({"size": size, "format": fmt, "count": len(ordered), "missing": missing}) + "\n"
+            for roll_no, path in ordered.items():
+                try:
+                    variant_path, variant_etag, mimetype = ThumbnailService.variant(path, size, fmt)
+                    line = {"roll_no": roll_no, "etag": variant_etag, "mimetype": mimetype,
+                            "data": base64.b64encode(variant_path.read_bytes()).decode()}
+                except (OSError, ValueError) as e:
+                    line = {"roll_no": roll_no, "error": str(e)}
+                yield json.dumps(line) + "\n"
+        response = Response(generate(), mimetype="application/x-ndjson")
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = Config.THUMBNAIL_MAX_AGE_SECONDS
+    response.vary.add("Accept")
+    response.vary.add("Authorization")
+    return response
+
 @students_bp.route("/<roll_no>/image", methods=["GET"])
 def get_student_image(roll_no):
-    from db import get_db
-    db = get_db()
-    student = db.students.find_one({"roll_no": roll_no.upper()})
-    
+    """
+    Profile photo. With ?size=64|160|480 a resized derivative is served
+    instead (WebP when the browser accepts it, or ?format=webp|jpeg), with
+    a strong ETag so repeat loads are answered 304.
+
+    The path and ETag come from StudentService.profile_image(), so a warm
+    request touches neither Mongo nor the disk before the body is sent.
+    """
+    size = fmt = None
+    if request.args.get("size"):
+        try:
+            size = ThumbnailService.pick_size(int(request.args["size"]))
+        except ValueError:
+            return jsonify({"success": False, "error": "size must be an integer"}), 400
+        fmt = request.args.get("format")
+        if fmt is None:
+            fmt = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpeg"
+        if fmt not in THUMBNAIL_FORMATS:
+            return jsonify({"success": False, "error": f"format must be one of {list(THUMBNAIL_FORMATS)}"}), 400
+
+    for _ in range(2):
+        image = StudentService.profile_image(roll_no)
+        if "error" in image:
+            return jsonify({"success": False, "error": image["error"]}), 404
+        try:
+            return _profile_image_response(image, size, fmt)
+        except FileNotFoundError:
+            # Removed behind our back, or evicted from the blob cache: resolve it again
+            StudentService.forget_profile_image(roll_no)
+    return jsonify({"success": False, "error": "Image not found on server"}), 404
+
+
+def _profile_image_response(image, size=None, fmt=None):
+    image_path = image["path"]
+    if size is None:
+        return _send_image(image_path, "image/jpeg", 31536000)
+
+    etag = ThumbnailService.etag(image_path, size, fmt, image["hash"])
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        if (size, fmt) not in image["variants"]:
+            image["variants"][(size, fmt)] = ThumbnailService.variant(image_path, size, fmt, image["hash"])
+        variant_path, etag, mimetype = image["variants"][(size, fmt)]
+        response = _send_image(os.path.abspath(variant_path), mimetype, Config.THUMBNAIL_MAX_AGE_SECONDS,
+                               etag=False, conditional=False)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.THUMBNAIL_MAX_AGE_SECONDS
+    response.vary.add("Accept")
+    return response
+
+@students_bp.route("/<roll_no>/images", methods=["POST"])
+@jwt_required()
+@role_required("staff")
+def add_student_images(roll_no):
+    """
+    Append face images to an existing student. Only the new images are
+    encoded; each is folded into the stored running mean.
+    """
+    roll_no = roll_no.strip().upper()
+    files = request.files.getlist("images") + request.files.getlist("image")
+    if not files:
+        return jsonify({"success": False, "error": "No image uploaded"}), 400
+
+    student = get_db().students.find_one({"roll_no": roll_no}, {"department": 1, "section": 1})
     if not student:
         return jsonify({"success": False, "error": "Student not found"}), 404
-        
-    dept = student.get("department")
-    section = student.get("section")
-    
-    face_data = student.get("face", {})
-    image_filenames = face_data.get("image_filenames", [])
-    
-    if not dept or not section or not image_filenames:
-        return jsonify({"success": False, "error": "Image profile incomplete"}), 404
-        
-    target_filename = image_filenames[-1]    
-    image_path = Path(Config.STORAGE_TRAINING) / dept / section / roll_no.upper() / target_filename
-    
-    if not os.path.exists(image_path):
-        # Fallback to check if image is pending or simply not located whereexpected
-        return jsonify({"success": False, "error": "Image not found on server"}), 404
-        
-    return send_file(image_path, mimetype='image/jpeg', max_age=31536000)
+
+    storage_dir = Path(Config.STORAGE_TRAINING) / student.get("department", "CSE") / student.get("section", "A") / roll_no
+    storage_dir.mkdir(parents=True, exist_ok=True)
+    pipeline = GalleryService.live_pipeline()
+    cache = EmbeddingCache(pipeline=pipeline, commit_every=1)
+
+    added = []
+    errors = []
+    image_count = None
+    for file in files:
+        image_filename = f"{uuid.uuid4().hex}.jpeg"
+        image_path = storage_dir / image_filename
+        file.save(image_path)
+        try:
+            encodings = cache.process(str(image_path)).encodings
+            if len(encodings) != 1:
+                raise ValueError("No face detected in image" if not encodings
+                                 else f"Multiple faces detected ({len(encodings)})")
+            get_blob_store().put_file(image_path)
+            image_count = StudentService.add_face_image(roll_no, image_filename, encodings[0], pipeline.version)
+            added.append(image_filename)
+        except Exception as e:
+            get_blob_store().delete_file(image_path)
+            errors.append({"filename": file.filename, "error": str(e)})
+    cache.close()
+    if added:
+        try:
+            # The last image is the profile photo
+            ThumbnailService.generate_all(storage_dir / added[-1])
+        except Exception as e:
+            print(f"Thumbnail generation failed for {roll_no}: {e}")
+
+    status = 200 if added else 400
+    return jsonify({"success": bool(added), "roll_no": roll_no, "added": added,
+                    "errors": errors, "image_count": image_count}), status
+
+@students_bp.route("/<roll_no>/images/<image_filename>", methods=["DELETE"])
+@jwt_required()
+@role_required("staff")
+def remove_student_image(roll_no, image_filename):
+    """
+    Remove one face image and subtract it from the student's running mean.
+    """
+    roll_no = roll_no.strip().upper()
+    student = get_db().students.find_one(
+        {"roll_no": roll_no, "face.image_filenames": image_filename}, {"department": 1, "section": 1}
+    )
+    if not student:
+        return jsonify({"success": False, "error": "Image not found for student"}), 404
+    image_path = Path(Config.STORAGE_TRAINING) / student.get("department", "CSE") / student.get("section", "A") / roll_no / image_filename
+
+    try:
+        try:
+            image_count = StudentService.remove_face_image(roll_no, image_filename)
+        except ValueError as no_encoding:
+            # Enrolled before per-image encodings were stored: re-encode it once
+            try:
+                image_path = get_blob_store().ensure_local(image_path)
+            except FileNotFoundError:
+                raise no_encoding
+            result = GalleryService.live_pipeline().process(str(image_path))
+            if not result.encodings:
+                raise
+            image_count = StudentService.remove_face_image(roll_no, image_filename, result.encodings[0])
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+
+    if image_count is None:
+        return jsonify({"success": False, "error": "Image not found for student"}), 404
+    get_blob_store().delete_file(image_path)
+    return jsonify({"success": True, "roll_no": roll_no, "image_count": image_count}), 200
 
 @students_bp.route("/debug/db-state", methods=["GET"])
 def debug_db_state():
@@ -1,10 +1,19 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from services.violation_service import ViolationService
+from bson.errors import InvalidId
+from config import Config
+from services.violation_service import STATS_GROUPS, ViolationService
 from utils.auth_decorators import role_required, admin_required
 
 violations_bp = Blueprint("violations", __name__)
 
+
+def _list_filter(args):
+    return ViolationService.list_filter(
+        args.get("from"), args.get("to"), args.get("type"), args.get("location"), args.get("status"),
+        args.get("department"), args.get("section"), args.get("roll_no")
+    )
+
 @violations_bp.route("/", methods=["POST"])
 @jwt_required()
 @role_required("staff")
@@ -21,9 +30,49 @@ def create_violation():
 @violations_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_violations():
+    """
+    Violations newest first, one page at a time: ?limit= and
+    ?after=<next_cursor>, filtered by ?from=&to= (ISO dates), type,
+    location, status, department, section and roll_no.
+    """
+    try:
+        limit = int(request.args.get("limit", Config.VIOLATIONS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    if not 1 <= limit <= Config.VIOLATIONS_MAX_PAGE_SIZE:
+        return jsonify({"success": False, "error": f"limit must be 1-{Config.VIOLATIONS_MAX_PAGE_SIZE}"}), 400
+
+    args = request.args
+    try:
+        query = _list_filter(args)
+        if args.get("after"):
+            ViolationService.decode_cursor(args["after"])
+    except (ValueError, InvalidId) as e:
+        return jsonify({"success": False, "error": f"Invalid filter or cursor: {e}"}), 400
+
+    try:
+        violations, next_cursor = ViolationService.list_violations(query, args.get("after"), limit)
+        return jsonify({"success": True, "violations": violations, "next_cursor": next_cursor}), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@violations_bp.route("/stats", methods=["GET"])
+@jwt_required()
+def get_violation_stats():
+    """
+    Counts (total, today, this_month) for the same filters as the listing,
+    and with ?group_by=type|location the count per type or location.
+    """
+    group_by = request.args.get("group_by")
+    if group_by and group_by not in STATS_GROUPS:
+        return jsonify({"success": False, "error": f"group_by must be one of {', '.join(STATS_GROUPS)}"}), 400
+    try:
+        query = _list_filter(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid filter: {e}"}), 400
+
     try:
-        violations = ViolationService.get_violations()
-        return jsonify(violations), 200
+        return jsonify({"success": True, **ViolationService.violation_stats(query, group_by)}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -0,0 +1,58 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.audit_service import DuplicateAuditService
+
+CSV_FIELDS = ["distance"] + [f"{side}_{field}" for side in ("a", "b")
+                             for field in ("roll_no", "name", "department", "section", "image_count", "created_at")]
+
+
+def audit_duplicates(threshold=None, since=None, incremental=False, block_size=4096, output=None):
+    if incremental:
+        since = DuplicateAuditService.last_run()
+        if since is None:
+            print("No previous audit recorded, scanning the whole gallery")
+    report = DuplicateAuditService.run(threshold, since, block_size)
+
+    scope = f"students created since {report['since']}" if report["since"] else "whole gallery"
+    print(f"Scanned {report['scanned']} of {report['gallery_size']} embeddings ({scope}) "
+          f"in {report['seconds']}s, threshold {report['threshold']}")
+    print(f"Possible duplicate identities: {len(report['pairs'])}")
+    for pair in report["pairs"]:
+        a, b = pair["a"], pair["b"]
+        print(f"  {pair['distance']:.4f}  {a['roll_no']} ({a['name']}, {a['department']}/{a['section']})"
+              f"  <->  {b['roll_no']} ({b['name']}, {b['department']}/{b['section']})")
+
+    if output:
+        if output.endswith(".csv"):
+            with open(output, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                for pair in report["pairs"]:
+                    row = {"distance": pair["distance"]}
+                    for side in ("a", "b"):
+                        row.update({f"{side}_{k}": v for k, v in pair[side].items()})
+                    writer.writerow(row)
+        else:
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find students whose embeddings are suspiciously close")
+    parser.add_argument("--threshold", type=float, default=None, help="Report pairs closer than this distance")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                        help="Only check students created at/after this ISO date against everyone")
+    parser.add_argument("--incremental", action="store_true", help="Only check students created since the last audit")
+    parser.add_argument("--block-size", type=int, default=4096, help="Rows per distance block (memory ~ block^2 * 4 bytes)")
+    parser.add_argument("--output", help="Write the report to a .json or .csv file")
+    args = parser.parse_args()
+    audit_duplicates(args.threshold, args.since, args.incremental, args.block_size, args.output)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from services.capture_store import CaptureStore
+
+
+def compaction_loop(rate=None, interval=None, once=False):
+    """
+    Run a capture retention pass every `interval` seconds.
+    """
+    interval = Config.CAPTURE_COMPACTION_INTERVAL_SECONDS if interval is None else interval
+    while True:
+        start = time.monotonic()
+        result = CaptureStore.compact(rate)
+        print(f"Imported {result['imported']} legacy capture(s), cropped {result['cropped']} unmatched, "
+              f"deleted {result['deleted']} expired file(s), evicted {result['evicted']} cached blob(s) in {time.monotonic() - start:.1f}s", flush=True)
+        if once:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crop old unmatched captures and delete expired ones")
+    parser.add_argument("--rate", type=float, default=None, help="Files per second, 0 = unthrottled")
+    parser.add_argument("--interval", type=float, default=None, help="Seconds between passes")
+    parser.add_argument("--once", action="store_true", help="Run one pass and exit")
+    parser.add_argument("--nice", type=int, default=10, help="Lower the process priority by this much")
+    args = parser.parse_args()
+    if args.nice:
+        os.nice(args.nice)
+    try:
+        compaction_loop(args.rate, args.interval, args.once)
+    except KeyboardInterrupt:
+        print("Stopping compaction")
@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from services.gallery_service import GalleryService
+from services.gallery_snapshot import export_snapshot
+
+
+def export_loop(snapshot_dir=None, interval=None, once=False):
+    """
+    Re-export the gallery snapshot whenever the gallery version has moved,
+    checking every `interval` seconds.
+    """
+    interval = Config.GALLERY_SNAPSHOT_INTERVAL_SECONDS if interval is None else interval
+    exported_version = None
+    while True:
+        version = GalleryService.current_version()
+        if version != exported_version:
+            start = time.monotonic()
+            result = export_snapshot(snapshot_dir)
+            exported_version = result["version"]
+            print(f"Exported gallery v{result['version']} ({result['rows']} rows) "
+                  f"as generation {result['generation']} in {time.monotonic() - start:.2f}s", flush=True)
+        if once:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish the shared gallery snapshot workers map")
+    parser.add_argument("--dir", default=None, help="Snapshot directory (default: GALLERY_SNAPSHOT_DIR)")
+    parser.add_argument("--interval", type=float, default=None, help="Seconds between version checks")
+    parser.add_argument("--once", action="store_true", help="Export once and exit")
+    args = parser.parse_args()
+    try:
+        export_loop(args.dir, args.interval, args.once)
+    except KeyboardInterrupt:
+        print("Stopping exporter")
@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.reembed_service import ReembedService
+
+
+def _target_spec(args):
+    spec = {
+        "model_version": args.model_version,
+        "detector": args.detector,
+        "fallback": args.fallback,
+        "encoding_model": args.encoding_model,
+        "num_jitters": args.jitters,
+    }
+    return {k: v for k, v in spec.items() if v is not None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed the gallery with a new pipeline and switch over atomically")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start = commands.add_parser("start", help="Record the target pipeline")
+    start.add_argument("--model-version", help="Label for the new embeddings (default: EMBEDDING_MODEL_VERSION)")
+    start.add_argument("--detector", help="hog | cnn | haar | dnn")
+    start.add_argument("--fallback", help="Fallback detector, '' for none")
+    start.add_argument("--encoding-model", help="small | large")
+    start.add_argument("--jitters", type=int, help="num_jitters for encoding")
+
+    commands.add_parser("status", help="Show coverage of the running job")
+
+    run = commands.add_parser("run", help="Re-encode students in the background")
+    run.add_argument("--rate", type=float, default=None, help="Images per second, 0 = unthrottled")
+    run.add_argument("--batch-size", type=int, default=50, help="Students per bulk_write")
+    run.add_argument("--no-switch", action="store_true", help="Don't switch over when coverage reaches 100%%")
+    run.add_argument("--nice", type=int, default=10, help="Lower the process priority by this much")
+
+    switch = commands.add_parser("switch", help="Make the target pipeline live now")
+    switch.add_argument("--force", action="store_true", help="Switch even if some students aren't re-embedded")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "start":
+            job = ReembedService.start(_target_spec(args))
+            print(f"Re-embedding {job['from_version']} -> {job['target_version']}")
+        elif args.command == "status":
+            print(json.dumps(ReembedService.status(), indent=2))
+        elif args.command == "run":
+            if args.nice:
+                os.nice(args.nice)
+            ReembedService.run(args.rate, args.batch_size, auto_switch=not args.no_switch)
+        elif args.command == "switch":
+            ReembedService.switch(force=args.force)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,133 @@
+from datetime import datetime
+import numpy as np
+from db import get_db
+from config import Config
+from services.gallery_service import GalleryService
+
+AUDIT_META_ID = "duplicate_audit"
+
+
+def close_pairs(matrix, threshold, query_rows=None, block_size=4096):
+    """
+    All (i, j, distance) with ||matrix[i] - matrix[j]|| < threshold, i < j.
+
+    Distances are computed block by block as ||a||^2 - 2 a.b + ||b||^2, so
+    peak memory is one block_size x block_size float32 tile regardless of
+    gallery size. With query_rows, only pairs involving those rows are
+    checked (each against the whole matrix).
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    n = len(matrix)
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    sq_threshold = threshold * threshold
+
+    if query_rows is None:
+        row_ids = np.arange(n)
+    else:
+        row_ids = np.unique(np.asarray(query_rows, dtype=np.int64))
+    is_query = np.zeros(n, dtype=bool)
+    is_query[row_ids] = True
+
+    pairs = []
+    for r0 in range(0, len(row_ids), block_size):
+        rows = row_ids[r0:r0 + block_size]
+        a = matrix[rows]
+        # Full scans only need the upper triangle: start at this block's first row
+        c_start = int(rows[0]) if query_rows is None else 0
+        for c0 in range(c_start, n, block_size):
+            cols = np.arange(c0, min(c0 + block_size, n))
+            sq_dist = sq_norms[rows, None] - 2.0 * (a @ matrix[cols].T) + sq_norms[None, cols]
+            hit_r, hit_c = np.nonzero(sq_dist < sq_threshold)
+            if not len(hit_r):
+                continue
+            i = rows[hit_r]
+            j = cols[hit_c]
+            # Report each pair once: i < j, except query-vs-other pairs where
+            # the other row is never scanned as a query itself
+            keep = (i < j) | ((i > j) & ~is_query[j])
+            for ii, jj, rr, cc in zip(i[keep], j[keep], hit_r[keep], hit_c[keep]):
+                d = float(np.sqrt(max(sq_dist[rr, cc], 0.0)))
+                pairs.append((min(ii, jj), max(ii, jj), d))
+    pairs.sort(key=lambda p: p[2])
+    return pairs
+
+
+class DuplicateAuditService:
+    """
+    Offline search for students registered twice under different roll_nos:
+    pairs of gallery embeddings closer than the audit threshold.
+    """
+
+    @staticmethod
+    def _student_summary(student, extra):
+        info = extra.get(student["roll_no"], {})
+        return {
+            "roll_no": student["roll_no"],
+            "name": student.get("name"),
+            "department": student.get("department"),
+            "section": student.get("section"),
+            "image_count": len((info.get("face") or {}).get("image_filenames") or []),
+            "created_at": info["created_at"].isoformat() if info.get("created_at") else None,
+        }
+
+    @staticmethod
+    def last_run():
+        doc = get_db().meta.find_one({"_id": AUDIT_META_ID})
+        return doc.get("last_run") if doc else None
+
+    @staticmethod
+    def run(threshold=None, since=None, block_size=4096, record_run=True):
+        """
+        Audit the whole gallery, or only students created at/after `since`
+        (each compared against everyone). Returns a report dict with pairs
+        sorted by distance.
+        """
+        threshold = Config.DUPLICATE_AUDIT_THRESHOLD if threshold is None else threshold
+        started = datetime.utcnow()
+        db = get_db()
+        version, spec = GalleryService._meta()
+        gallery = GalleryService._load(version, pipeline_spec=spec)
+
+        query_rows = None
+        if since is not None:
+            new_rolls = {
+                doc["roll_no"] for doc in db.students.find(
+                    {"created_at": {"$gte": since}, "face.embedding": {"$exists": True, "$ne": []}},
+                    {"_id": 0, "roll_no": 1}
+                )
+            }
+            query_rows = [gallery.roll_index[r] for r in new_rolls if r in gallery.roll_index]
+
+        pairs = []
+        if len(gallery) > 1 and (query_rows is None or query_rows):
+            pairs = close_pairs(gallery.matrix, threshold, query_rows, block_size)
+
+        involved = {gallery.students[i]["roll_no"] for p in pairs for i in p[:2]}
+        extra = {
+            doc["roll_no"]: doc for doc in db.students.find(
+                {"roll_no": {"$in": list(involved)}},
+                {"_id": 0, "roll_no": 1, "created_at": 1, "face.image_filenames": 1}
+            )
+        }
+        report = {
+            "threshold": threshold,
+            "gallery_size": len(gallery),
+            "scanned": len(gallery) if query_rows is None else len(query_rows),
+            "since": since.isoformat() if since else None,
+            "seconds": round((datetime.utcnow() - started).total_seconds(), 2),
+            "pairs": [
+                {
+                    "distance": round(d, 4),
+                    "a": DuplicateAuditService._student_summary(gallery.students[i], extra),
+                    "b": DuplicateAuditService._student_summary(gallery.students[j], extra),
+                }
+                for i, j, d in pairs
+            ],
+        }
+        if record_run:
+            db.meta.update_one(
+                {"_id": AUDIT_META_ID},
+                {"$set": {"last_run": started, "last_pairs": len(pairs), "threshold": threshold}},
+                upsert=True
+            )
+        return report
@@ -0,0 +1,371 @@
+import os
+import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from config import Config
+
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def blob_dirs():
+    """
+    Local directory of each key prefix. Each is configured on its own
+    (STORAGE_CAPTURES can live on another disk), so keys are made per prefix.
+    """
+    return {"training": Config.STORAGE_TRAINING, "captures": Config.STORAGE_CAPTURES}
+
+
+def blob_key(path):
+    """
+    Store key of a file under one of the blob_dirs(), e.g.
+    storage/training/CSE/A/X/1.jpeg -> training/CSE/A/X/1.jpeg.
+    """
+    path = os.path.abspath(path)
+    for prefix, directory in blob_dirs().items():
+        relative = os.path.relpath(path, os.path.abspath(directory))
+        if relative == ".":
+            return prefix
+        if relative != ".." and not relative.startswith(".." + os.sep):
+            return f"{prefix}/{relative.replace(os.sep, '/')}"
+    raise ValueError(f"{path} is outside STORAGE_TRAINING and STORAGE_CAPTURES")
+
+
+def blob_path(key, root=None):
+    """
+    Local path of a key: under root if given, else in its prefix's directory.
+    """
+    if root is not None:
+        return Path(root) / key
+    prefix, _, rest = key.partition("/")
+    directories = blob_dirs()
+    if prefix not in directories:
+        raise ValueError(f"Unknown blob key prefix: {key}")
+    return Path(directories[prefix]) / rest
+
+
+def _write_atomic(path, stream):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(stream, f, COPY_CHUNK_SIZE)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class BlobStore:
+    """
+    Where training photos and captures live. Keys are a prefix plus the path
+    within its directory ("training/CSE/A/<roll_no>/<file>",
+    "captures/ab/cd/<hash>.jpg"), so files keep their familiar local layout
+    whichever backend holds them.
+
+    Face detection, OpenCV and send_file need real files, so readers ask
+    for local_path(key). Remote backends serve that from a read-through
+    cache in the same directories, downloading on a miss, which means the
+    existing Path(Config.STORAGE_TRAINING) / ... paths stay valid once
+    fetched.
+    """
+
+    def open(self, key):
+        """
+        Binary stream of a blob. Raises FileNotFoundError if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def put(self, key, stream):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """
+        (key, modified unix time) of every blob whose key starts with prefix.
+        """
+        raise NotImplementedError
+
+    def local_path(self, key):
+        raise NotImplementedError
+
+    def put_file(self, path):
+        """
+        Store a local file from one of the blob_dirs() at its own key.
+        """
+        with open(path, "rb") as f:
+            self.put(blob_key(path), f)
+
+    def ensure_local(self, path):
+        """
+        Local path of the blob behind path, fetching it if this node hasn't
+        yet. Raises FileNotFoundError if the store doesn't have it either.
+        """
+        return self.local_path(blob_key(path))
+
+    def delete_file(self, path):
+        self.delete(blob_key(path))
+
+    def prune_cache(self, max_bytes=None):
+        return 0
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Files on this host's filesystem, the single-node default.
+    """
+
+    def __init__(self, root=None):
+        # None: each prefix in its configured directory
+        self.root = Path(root) if root else None
+
+    def _key(self, path):
+        if self.root is None:
+            return blob_key(path)
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def open(self, key):
+        return open(blob_path(key, self.root), "rb")
+
+    def put(self, key, stream):
+        _write_atomic(blob_path(key, self.root), stream)
+
+    def put_file(self, path):
+        target = blob_path(blob_key(path), self.root)
+        if os.path.abspath(path) != os.path.abspath(target):
+            with open(path, "rb") as f:
+                self.put(blob_key(path), f)
+
+    def delete(self, key):
+        blob_path(key, self.root).unlink(missing_ok=True)
+
+    def exists(self, key):
+        return blob_path(key, self.root).is_file()
+
+    def list(self, prefix):
+        base = blob_path(prefix, self.root)
+        # "training/CSE/A/X/" lists a folder; "captures/ab" is a key prefix
+        top = base if prefix.endswith("/") else base.parent
+        for dirpath, _, filenames in os.walk(top):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                key = self._key(path)
+                if key.startswith(prefix) and not name.startswith("."):
+                    try:
+                        yield key, os.stat(path).st_mtime
+                    except FileNotFoundError:
+                        continue
+
+    def local_path(self, key):
+        path = blob_path(key, self.root)
+        if not path.is_file():
+            raise FileNotFoundError(str(path))
+        return path
+
+
+class CachedBlobStore(BlobStore):
+    """
+    Base for remote backends: blobs are read through a local cache rooted
+    at cache_root, by default the blob_dirs() themselves. Keys are immutable - photos are named by
+    uuid and captures by content hash - so cached copies never go stale;
+    only deletes made through this store drop them.
+    """
+
+    def __init__(self, cache_root=None):
+        self.cache_root = Path(cache_root) if cache_root else None
+
+    def _open_remote(self, key):
+        raise NotImplementedError
+
+    def _put_remote(self, key, stream):
+        raise NotImplementedError
+
+    def _delete_remote(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        cached = blob_path(key, self.cache_root)
+        if cached.is_file():
+            return open(cached, "rb")
+        return self._open_remote(key)
+
+    def put(self, key, stream):
+        self._put_remote(key, stream)
+
+    def put_file(self, path):
+        with open(path, "rb") as f:
+            self._put_remote(blob_key(path), f)
+        # The file is already where the cache would put it, or copy it there
+        cached = blob_path(blob_key(path), self.cache_root)
+        if os.path.abspath(path) != os.path.abspath(cached) and not cached.exists():
+            with open(path, "rb") as f:
+                _write_atomic(cached, f)
+
+    def delete(self, key):
+        self._delete_remote(key)
+        blob_path(key, self.cache_root).unlink(missing_ok=True)
+
+    def local_path(self, key):
+        cached = blob_path(key, self.cache_root)
+        if cached.is_file():
+            return cached
+        stream = self._open_remote(key)
+        try:
+            _write_atomic(cached, stream)
+        finally:
+            stream.close()
+        return cached
+
+    def prune_cache(self, max_bytes=None):
+        """
+        Evict the least recently read cached blobs until the cache holds at
+        most max_bytes (BLOB_CACHE_MAX_BYTES, 0 = unbounded). Only the blob
+        directories are touched.
+        """
+        max_bytes = Config.BLOB_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        if not max_bytes:
+            return 0
+        files = []
+        for prefix in blob_dirs():
+            for dirpath, _, filenames in os.walk(blob_path(prefix, self.cache_root)):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_atime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+
+class GridFSBlobStore(CachedBlobStore):
+    """
+    Blobs in a GridFS bucket of the app's own database, so nodes that share
+    MongoDB share images without any other service.
+    """
+
+    def __init__(self, bucket=None, cache_root=None):
+        super().__init__(cache_root)
+        import gridfs
+        from db import get_db
+        db = get_db()
+        self.bucket_name = bucket or Config.BLOB_GRIDFS_BUCKET
+        self.files = db[f"{self.bucket_name}.files"]
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=self.bucket_name)
+        self._no_file = gridfs.errors.NoFile
+
+    def _open_remote(self, key):
+        try:
+            return self.bucket.open_download_stream_by_name(key)
+        except self._no_file:
+            raise FileNotFoundError(key)
+
+    def _put_remote(self, key, stream):
+        file_id = self.bucket.upload_from_stream(key, stream, chunk_size_bytes=COPY_CHUNK_SIZE // 4)
+        # Keep only the newest revision
+        for doc in self.files.find({"filename": key, "_id": {"$ne": file_id}}, {"_id": 1}):
+            self.bucket.delete(doc["_id"])
+
+    def _delete_remote(self, key):
+        for doc in self.files.find({"filename": key}, {"_id": 1}):
+            self.bucket.delete(doc["_id"])
+
+    def exists(self, key):
+        return self.files.count_documents({"filename": key}, limit=1) > 0
+
+    def list(self, prefix):
+        cursor = self.files.find({"filename": {"$regex": f"^{re.escape(prefix)}"}}, {"filename": 1, "uploadDate": 1})
+        for doc in cursor:
+            yield doc["filename"], doc["uploadDate"].timestamp()
+
+
+class S3BlobStore(CachedBlobStore):
+    """
+    Blobs in an S3-compatible bucket. BLOB_S3_ENDPOINT_URL points it at
+    MinIO or another local stand-in. Needs boto3.
+    """
+
+    def __init__(self, bucket=None, prefix=None, endpoint_url=None, cache_root=None):
+        super().__init__(cache_root)
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("BLOB_BACKEND=s3 needs boto3 (pip install boto3)")
+        self.bucket = bucket or Config.BLOB_S3_BUCKET
+        if not self.bucket:
+            raise RuntimeError("BLOB_BACKEND=s3 needs BLOB_S3_BUCKET")
+        self.prefix = Config.BLOB_S3_PREFIX if prefix is None else prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or Config.BLOB_S3_ENDPOINT_URL or None,
+                                   region_name=Config.BLOB_S3_REGION or None)
+        self._client_error = ClientError
+
+    def _missing(self, error):
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def _open_remote(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    def _put_remote(self, key, stream):
+        # Multipart upload for large streams, without reading them into memory
+        self.client.upload_fileobj(stream, self.bucket, self.prefix + key)
+
+    def _delete_remote(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self._client_error as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):], obj["LastModified"].timestamp()
+
+
+BLOB_BACKENDS = {
+    "local": LocalBlobStore,
+    "gridfs": GridFSBlobStore,
+    "s3": S3BlobStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """
+    This process's store for BLOB_BACKEND (local | gridfs | s3).
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.BLOB_BACKEND not in BLOB_BACKENDS:
+                    raise ValueError(f"BLOB_BACKEND must be one of {list(BLOB_BACKENDS)}")
+                _store = BLOB_BACKENDS[Config.BLOB_BACKEND]()
+    return _store
@@ -0,0 +1,402 @@
+import csv
+import fcntl
+import io
+import shutil
+import tarfile
+import uuid
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+from config import Config
+from services.blob_store import get_blob_store
+from services.embedding_cache import EmbeddingCache
+from services.embedding_service import _encode_image, _init_worker
+from services.gallery_service import GalleryService
+from services.student_service import StudentService
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+MANIFEST_FIELDS = ("roll_no", "name", "department", "section", "year", "phone", "email", "threshold")
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class _ImportRow:
+    def __init__(self, number, data, image_names):
+        self.number = number
+        self.data = data
+        self.image_names = image_names  # explicit archive paths, or None to match by roll_no
+        self.images = []                # [(archive_name, staged_path, future)]
+        self.error = None
+
+
+class BulkImportService:
+    """
+    Registers students from an archive holding a CSV manifest and their photos.
+
+    The archive is read entry by entry: each photo is copied to a staging
+    file and handed to a process pool for detection/encoding straight away,
+    so decoding overlaps with the upload being read. Rows whose photos are
+    all encoded are inserted in insert_many batches. import_archive() is a
+    generator of progress events for the route to stream as NDJSON.
+
+    Manifest columns: roll_no, name, department, section, year, phone, email,
+    threshold, and optionally image (archive paths separated by ';'). Without
+    an image column, photos named <roll_no>.jpg or stored under a <roll_no>/
+    folder are used. A student's photos must then sit together in the
+    archive: the row is built once the archive moves past them, and a photo
+    for that roll_no arriving later is skipped.
+
+    Imports run inside a web worker, so only one runs per host at a time
+    (try_lock) with at most BULK_IMPORT_WORKERS encoder processes.
+    """
+
+    @staticmethod
+    def try_lock():
+        """
+        Take the host-wide import slot, an flock on a file under
+        STORAGE_UPLOADS shared by every gunicorn worker. Returns the open
+        lock file (close it to release the slot), or None if another import
+        holds it.
+        """
+        lock_dir = Path(Config.STORAGE_UPLOADS) / "imports"
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        lock_file = open(lock_dir / ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    @staticmethod
+    def _entries(fileobj, filename):
+        """
+        Yield (name, file-like) for every regular file in a ZIP or tar archive.
+        Tar archives (optionally compressed) are read as a forward-only stream.
+        """
+        if filename.lower().endswith(".zip"):
+            # ZIP needs its central directory at the end, so the upload must be
+            # seekable (werkzeug spools large uploads to a temporary file)
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as f:
+                            yield info.filename, f
+        else:
+            with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member)
+
+    @staticmethod
+    def _parse_manifest(f):
+        # Manifests are small; read it whole rather than wrapping a forward-only stream
+        reader = csv.DictReader(io.StringIO(f.read().decode("utf-8-sig"), newline=""))
+        rows = []
+        for number, record in enumerate(reader, start=2):  # line 1 is the header
+            record = {(k or "").strip().lower(): (v or "").strip() for k, v in record.items()}
+            data = {field: record.get(field) or None for field in MANIFEST_FIELDS}
+            data["department"] = (data["department"] or "CSE").upper()
+            data["section"] = (data["section"] or "A").upper()
+            data["roll_no"] = (data["roll_no"] or "").upper()
+            image_names = None
+            if record.get("image"):
+                image_names = [
+                    str(PurePosixPath(name.strip()))
+                    for name in record["image"].split(";") if name.strip()
+                ]
+            rows.append(_ImportRow(number, data, image_names))
+        return rows
+
+    @staticmethod
+    def _roll_no_for(archive_name):
+        """
+        roll_no implied by an image path: <roll_no>.jpg or <roll_no>/<anything>.jpg
+        """
+        path = PurePosixPath(archive_name)
+        if len(path.parts) > 1:
+            return path.parent.name.upper(), path.stem.upper()
+        return None, path.stem.upper()
+
+    @staticmethod
+    def _validate_rows(rows):
+        seen = set()
+        for row in rows:
+            roll_no = row.data["roll_no"]
+            if not roll_no or not row.data["name"]:
+                row.error = "Missing required fields"
+            elif roll_no in seen:
+                row.error = f"Duplicate roll_no {roll_no} in manifest"
+            else:
+                try:
+                    if row.data["threshold"] is not None:
+                        row.data["threshold"] = float(row.data["threshold"])
+                except ValueError:
+                    row.error = f"Invalid threshold {row.data['threshold']!r}"
+            seen.add(roll_no)
+
+    @staticmethod
+    def _build_student(row, cache):
+        """
+        Student document for a row whose images are all encoded, moving its
+        photos into storage/training and recording their detections and
+        face chips in the cache. Sets row.error instead on failure.
+        """
+        encodings = []
+        results = []
+        for archive_name, _, future in row.images:
+            faces, error = future.result()
+            if error:
+                row.error = f"{archive_name}: {error}"
+                return None
+            encodings_in_image = faces[2]
+            if not encodings_in_image:
+                row.error = f"{archive_name}: No face detected in image"
+                return None
+            if len(encodings_in_image) > 1:
+                row.error = f"{archive_name}: Multiple faces detected ({len(encodings_in_image)})"
+                return None
+            encodings.append(encodings_in_image[0])
+            results.append(faces)
+
+        data = row.data
+        storage_dir = Path(Config.STORAGE_TRAINING) / data["department"] / data["section"] / data["roll_no"]
+        storage_dir.mkdir(parents=True, exist_ok=True)
+        filenames = []
+        for (archive_name, staged_path, _), faces in zip(row.images, results):
+            filename = f"{uuid.uuid4().hex}{Path(archive_name).suffix.lower()}"
+            shutil.move(staged_path, storage_dir / filename)
+            get_blob_store().put_file(storage_dir / filename)
+            cache.put(cache.content_hash(storage_dir / filename), *faces)
+            filenames.append(filename)
+
+        student = dict(data)
+        student["face"] = StudentService.face_document(filenames, encodings, cache.version)
+        return StudentService.prepare_student(student)
+
+    @staticmethod
+    def _discard_photos(student):
+        # Only remove the photos this import moved in, not an existing student's
+        storage_dir = Path(Config.STORAGE_TRAINING) / student["department"] / student["section"] / student["roll_no"]
+        for filename in student["face"]["image_filenames"]:
+            get_blob_store().delete_file(storage_dir / filename)
+
+    @staticmethod
+    def _insert_batch(students):
+        try:
+            inserted, errors = StudentService.create_students_bulk(students)
+        except Exception:
+            for student in students:
+                BulkImportService._discard_photos(student)
+            raise
+        for student in students:
+            if student["roll_no"] in errors:
+                BulkImportService._discard_photos(student)
+        return inserted, errors
+
+    @staticmethod
+    def _copy_image(src, dst):
+        """
+        Copy an archive entry to a staging file, giving up once it is larger
+        than BULK_IMPORT_MAX_IMAGE_BYTES. False if it was too large.
+        """
+        limit = Config.BULK_IMPORT_MAX_IMAGE_BYTES
+        copied = 0
+        with open(dst, "wb") as out:
+            while copied <= limit:
+                chunk = src.read(min(COPY_CHUNK_SIZE, limit + 1 - copied))
+                if not chunk:
+                    return True
+                out.write(chunk)
+                copied += len(chunk)
+        return False
+
+    @staticmethod
+    def import_archive(fileobj, filename, workers=None, batch_size=100):
+        """
+        Generator of progress events (dicts) for one archive import. workers
+        can lower, but not raise, BULK_IMPORT_WORKERS.
+        """
+        staging_dir = Path(Config.STORAGE_UPLOADS) / "imports" / uuid.uuid4().hex
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        workers = min(workers or Config.BULK_IMPORT_WORKERS, Config.BULK_IMPORT_WORKERS)
+        pipeline = GalleryService.live_pipeline()
+        cache = EmbeddingCache(pipeline=pipeline, commit_every=1)
+
+        rows = None
+        images = {}           # archive name -> (staged path, future), until its row is built
+        by_roll = {}          # roll_no an image path implies -> archive names
+        closed = set()        # implied roll_nos whose images have all been read
+        last_rolls = set()    # roll_nos the previous image could belong to
+        implicit = {}         # roll_no -> pending row matched by image path
+        explicit = Counter()  # archive name -> pending rows listing it
+        done_rolls = set()    # roll_nos of implicit rows already built
+        pending = []  # rows waiting on their images
+        ready = []    # prepared student documents waiting to be inserted
+        totals = {"rows": 0, "images": 0, "registered": 0, "failed": 0}
+
+        def implied_rolls(name):
+            return {roll_no for roll_no in BulkImportService._roll_no_for(name) if roll_no}
+
+        def discard_image(name):
+            staged_path, future = images.pop(name)
+            future.cancel()
+            Path(staged_path).unlink(missing_ok=True)
+
+        def release_unclaimed(roll_nos):
+            """
+            Drop images of finished roll_nos that no pending row will use.
+            Until the manifest is read every image might still be wanted.
+            """
+            if rows is None:
+                return
+            for roll_no in roll_nos:
+                if roll_no in implicit:
+                    continue
+                for name in by_roll.pop(roll_no, []):
+                    if name in images and explicit[name] <= 0 and not implied_rolls(name) & implicit.keys():
+                        discard_image(name)
+
+        def finish_row(row):
+            if row.image_names is None:
+                if implicit.get(row.data["roll_no"]) is row:
+                    del implicit[row.data["roll_no"]]
+                    done_rolls.add(row.data["roll_no"])
+            else:
+                explicit.subtract(row.image_names)
+            # Built rows have moved their photos and cached the chips; drop the
+            # futures so their results (chips included) are not held any longer
+            for name, _, _ in row.images:
+                if name in images:
+                    discard_image(name)
+            row.images = []
+
+        def row_event(row, status, error=None):
+            event = {"event": "row", "row": row.number, "roll_no": row.data["roll_no"], "status": status}
+            if error:
+                event["error"] = error
+                totals["failed"] += 1
+            else:
+                totals["registered"] += 1
+            return event
+
+        def attach_images(row, archive_done):
+            """
+            Resolve a row's archive images; False if some are still to come.
+            """
+            if row.image_names is not None:
+                if not all(name in images for name in row.image_names):
+                    if archive_done:
+                        missing = [n for n in row.image_names if n not in images]
+                        row.error = f"Image not found in archive: {', '.join(missing)}"
+                    return archive_done
+                names = row.image_names
+            else:
+                # A <roll_no>.jpg or <roll_no>/ group is complete once the
+                # archive moves on to another one
+                roll_no = row.data["roll_no"]
+                if not archive_done and roll_no not in closed:
+                    return False
+                names = sorted(n for n in by_roll.get(roll_no, []) if n in images)
+                if not names:
+                    row.error = f"No image for {roll_no} in archive"
+                    return True
+            row.images = [(name, *images[name]) for name in names]
+            return True
+
+        def drain(archive_done, wait):
+            events = []
+            still_pending = []
+            for row in pending:
+                if row.error is None and not attach_images(row, archive_done):
+                    still_pending.append(row)
+                    continue
+                if row.error is None and not wait and not all(f.done() for _, _, f in row.images):
+                    still_pending.append(row)
+                    continue
+                student = None
+                if row.error is None:
+                    try:
+                        student = BulkImportService._build_student(row, cache)
+                    except Exception as e:
+                        row.error = str(e)
+                finish_row(row)
+                if student is None:
+                    events.append(row_event(row, "error", row.error))
+                else:
+                    ready.append((row, student))
+            pending[:] = still_pending
+
+            if ready and (len(ready) >= batch_size or archive_done):
+                batch = ready[:]
+                ready.clear()
+                _, errors = BulkImportService._insert_batch([student for _, student in batch])
+                for row, student in batch:
+                    error = errors.get(student["roll_no"])
+                    events.append(row_event(row, "error" if error else "registered", error))
+            return events
+
+        yield {"event": "start", "filename": filename}
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(pipeline.spec,)) as pool:
+                for name, f in BulkImportService._entries(fileobj, filename):
+                    name = str(PurePosixPath(name))
+                    suffix = PurePosixPath(name).suffix.lower()
+                    if suffix == ".csv" and rows is None:
+                        rows = BulkImportService._parse_manifest(f)
+                        BulkImportService._validate_rows(rows)
+                        totals["rows"] = len(rows)
+                        pending.extend(rows)
+                        for row in rows:
+                            if row.image_names is not None:
+                                explicit.update(row.image_names)
+                            elif row.error is None:
+                                implicit[row.data["roll_no"]] = row
+                        release_unclaimed(closed)
+                        yield {"event": "manifest", "rows": len(rows)}
+                    elif suffix in IMAGE_EXTENSIONS:
+                        rolls = implied_rolls(name)
+                        finished, last_rolls = last_rolls - rolls, rolls
+                        closed.update(finished)
+                        release_unclaimed(finished)
+                        if (rows is not None and rolls & done_rolls and explicit[name] <= 0
+                                and not rolls & implicit.keys()):
+                            yield {"event": "skipped", "entry": name,
+                                   "error": "Image arrived after its student was registered"}
+                            continue
+                        closed.difference_update(rolls)
+                        # Staged under a generated name; archive paths never touch the filesystem
+                        staged_path = staging_dir / f"{totals['images']}{suffix}"
+                        if not BulkImportService._copy_image(f, staged_path):
+                            staged_path.unlink()
+                            yield {"event": "skipped", "entry": name, "error": "Image too large"}
+                            continue
+                        images[name] = (str(staged_path), pool.submit(_encode_image, str(staged_path)))
+                        for roll_no in rolls:
+                            by_roll.setdefault(roll_no, []).append(name)
+                        totals["images"] += 1
+                    else:
+                        continue
+
+                    for event in drain(archive_done=False, wait=False):
+                        yield event
+                    if suffix in IMAGE_EXTENSIONS and totals["images"] % batch_size == 0:
+                        yield {"event": "progress", **totals}
+
+                if rows is None:
+                    yield {"event": "error", "error": "No CSV manifest found in archive"}
+                    return
+                for event in drain(archive_done=True, wait=True):
+                    yield event
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            yield {"event": "error", "error": f"Unreadable archive: {e}"}
+            return
+        except Exception as e:
+            yield {"event": "error", "error": str(e), **totals}
+            return
+        finally:
+            cache.close()
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        yield {"event": "done", **totals}
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+import cv2
+from db import get_db
+from config import Config
+from services.blob_store import blob_key, get_blob_store
+from services.embedding_cache import HASH_CHUNK_SIZE
+from services.face_pipeline import FacePipeline
+from services.gallery_service import GalleryService
+
+CAPTURE_HASH_LENGTH = 40  # blake2b, 20 bytes, as file_content_hash
+# Margin kept around a face box when an unmatched capture is cut down
+CROP_MARGIN = 0.3
+# Captures looked up per $in query when sweeping files whose document expired
+SWEEP_BATCH_SIZE = 500
+# Files younger than this are never swept: save() writes the file before
+# upserting its document
+SWEEP_MIN_AGE_SECONDS = 3600
+
+
+class CaptureStore:
+    """
+    Content-addressed store for the images posted to /match and /verify.
+
+    A capture lives at STORAGE_CAPTURES/<h[:2]>/<h[2:4]>/<hash>.jpg (in the
+    blob store, and cached locally where it was posted or read), so
+    the same bytes posted twice share one file, and no directory grows past
+    a few hundred entries. The `captures` collection has one document per
+    hash, covering when it was seen and whether it matched anyone. A TTL
+    index on expires_at drops the document CAPTURE_RETENTION_DAYS after the
+    last upload.
+
+    compact() is the background half: it imports legacy flat-directory
+    captures and cuts unmatched captures older than CAPTURE_CROP_AFTER_DAYS
+    down to their face crops. It also deletes files whose document has
+    expired.
+    """
+
+    @staticmethod
+    def path_for(capture_hash, suffix=""):
+        return (Path(Config.STORAGE_CAPTURES) / capture_hash[:2] / capture_hash[2:4]
+                / f"{capture_hash}{suffix}.jpg")
+
+    @staticmethod
+    def name_for(capture_hash):
+        """
+        Path of a capture relative to STORAGE_CAPTURES, as returned to clients.
+        """
+        return f"{capture_hash[:2]}/{capture_hash[2:4]}/{capture_hash}.jpg"
+
+    @staticmethod
+    def save(stream, kind, seen_at=None):
+        """
+        Store a capture from a binary stream (an upload's .stream or an open
+        file). Returns (hash, path). An identical capture already stored is
+        not written again; its document just records another sighting.
+        """
+        root = Path(Config.STORAGE_CAPTURES)
+        root.mkdir(parents=True, exist_ok=True)
+        tmp_path = root / f".{uuid.uuid4().hex}.tmp"
+        digest = hashlib.blake2b(digest_size=20)
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            capture_hash = digest.hexdigest()
+            path = CaptureStore.path_for(capture_hash)
+            if path.exists():
+                tmp_path.unlink()
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        store = get_blob_store()
+        if not store.exists(blob_key(path)):
+            store.put_file(path)
+
+        seen_at = seen_at or datetime.utcnow()
+        get_db().captures.update_one(
+            {"_id": capture_hash},
+            {
+                "$setOnInsert": {"kind": kind, "size": size, "first_seen": seen_at, "matched": False},
+                # A re-upload of a compacted capture restored the original
+                "$set": {"last_seen": seen_at, "compacted": False,
+                         "expires_at": seen_at + timedelta(days=Config.CAPTURE_RETENTION_DAYS)},
+                "$inc": {"count": 1},
+            },
+            upsert=True
+        )
+        return capture_hash, path
+
+    @staticmethod
+    def record_result(capture_hash, result):
+        """
+        Note the outcome of matching a capture. A capture that ever matched
+        is kept whole until it expires.
+        """
+        if not isinstance(result, dict):
+            return
+        roll_no = (result.get("student") or {}).get("roll_no") or result.get("roll_no")
+        update = {"distance": result.get("distance")}
+        if result.get("matched") or result.get("verified"):
+            update.update({"matched": True, "roll_no": roll_no})
+        get_db().captures.update_one({"_id": capture_hash}, {"$set": update})
+
+    @staticmethod
+    def compact(files_per_second=None, batch_size=100):
+        """
+        One retention pass, touching at most files_per_second files a second
+        (0 = unthrottled). Returns counts of what was done.
+        """
+        rate = Config.CAPTURE_COMPACTION_FILES_PER_SECOND if files_per_second is None else files_per_second
+        started = time.monotonic()
+        files = 0
+
+        def throttle():
+            nonlocal files
+            files += 1
+            if rate > 0:
+                delay = started + files / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+        return {
+            "imported": CaptureStore._import_legacy(throttle),
+            "cropped": CaptureStore._crop_unmatched(throttle, batch_size),
+            "deleted": CaptureStore._sweep_expired(throttle),
+            # Remote blob stores: keep this node's read-through cache bounded
+            "evicted": get_blob_store().prune_cache(),
+        }
+
+    @staticmethod
+    def _import_legacy(throttle):
+        """
+        Move capture_<timestamp>.jpg files from the old flat upload directory
+        into the store, keeping their upload time.
+        """
+        imported = 0
+        uploads = Path(Config.STORAGE_UPLOADS)
+        if not uploads.is_dir():
+            return 0
+        with os.scandir(uploads) as entries:
+            for entry in entries:
+                if not (entry.is_file() and entry.name.startswith("capture_") and entry.name.endswith(".jpg")):
+                    continue
+                throttle()
+                seen_at = datetime.utcfromtimestamp(entry.stat().st_mtime)
+                with open(entry.path, "rb") as f:
+                    CaptureStore.save(f, "legacy", seen_at)
+                os.unlink(entry.path)
+                imported += 1
+        return imported
+
+    @staticmethod
+    def _crop_unmatched(throttle, batch_size):
+        db = get_db()
+        cutoff = datetime.utcnow() - timedelta(days=Config.CAPTURE_CROP_AFTER_DAYS)
+        pipeline = GalleryService.live_pipeline()
+        store = get_blob_store()
+        cropped = 0
+        cursor = db.captures.find(
+            {"matched": False, "compacted": False, "last_seen": {"$lt": cutoff}},
+            {"last_seen": 1}
+        ).batch_size(batch_size)
+        for doc in cursor:
+            throttle()
+            capture_hash = doc["_id"]
+            path = CaptureStore.path_for(capture_hash)
+            faces = 0
+            try:
+                image = FacePipeline.load(str(store.ensure_local(path)))
+            except Exception as e:
+                print(f"Error loading capture {capture_hash}: {e}")
+                image = None
+            if image is not None:
+                height, width = image.shape[:2]
+                bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+                for top, right, bottom, left in pipeline.detect(image):
+                    margin_y = int((bottom - top) * CROP_MARGIN)
+                    margin_x = int((right - left) * CROP_MARGIN)
+                    crop = bgr[max(top - margin_y, 0):min(bottom + margin_y, height),
+                               max(left - margin_x, 0):min(right + margin_x, width)]
+                    crop_path = CaptureStore.path_for(capture_hash, f"-face{faces}")
+                    if crop.size and cv2.imwrite(str(crop_path), crop, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+                        store.put_file(crop_path)
+                        faces += 1
+
+            # Unless it was uploaded again (or matched) meanwhile
+            result = db.captures.update_one(
+                {"_id": capture_hash, "last_seen": doc["last_seen"], "matched": False},
+                {"$set": {"compacted": True, "faces": faces, "compacted_at": datetime.utcnow()}}
+            )
+            if result.modified_count:
+                store.delete_file(path)
+                cropped += 1
+        return cropped
+
+    @staticmethod
+    def _sweep_expired(throttle):
+        """
+        Delete blobs (originals and crops) whose document the TTL index has
+        removed.
+        """
+        store = get_blob_store()
+        deleted = 0
+        pending = {}
+
+        def flush():
+            nonlocal deleted
+            live = {doc["_id"] for doc in get_db().captures.find({"_id": {"$in": list(pending)}}, {"_id": 1})}
+            for capture_hash, keys in pending.items():
+                if capture_hash in live:
+                    continue
+                for key in keys:
+                    throttle()
+                    store.delete(key)
+                    deleted += 1
+            pending.clear()
+
+        too_new = time.time() - SWEEP_MIN_AGE_SECONDS
+        for key, modified in store.list(blob_key(Config.STORAGE_CAPTURES) + "/"):
+            name = key.rsplit("/", 1)[-1]
+            if name.endswith(".jpg") and len(name) > CAPTURE_HASH_LENGTH and modified < too_new:
+                pending.setdefault(name[:CAPTURE_HASH_LENGTH], []).append(key)
+                if len(pending) >= SWEEP_BATCH_SIZE:
+                    flush()
+        if pending:
+            flush()
+        return deleted
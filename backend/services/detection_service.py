@@ -1,8 +1,10 @@
 import numpy as np
-import face_recognition
 import cv2
 from services.student_service import StudentService
+from services.gallery_service import GalleryService
+from services.shard_service import ShardCoordinator
 from config import Config
+from services.face_pipeline import FacePipeline, get_pipeline
 
 class DetectionService:
     # Tunable thresholds
@@ -32,21 +34,21 @@ class DetectionService:
             return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(image)
 
     @staticmethod
-    def match_face(image_path, department=None, section=None):
+    def _encode_capture(image_path, pipeline=None):
         """
-        Match a captured face with blur handling, scale handling, and strict thresholds.
+        Load a capture and extract its single face encoding with blur and
+        small-face handling. Returns (captured_encoding, image, error_response).
         """
         # 1. Load image
         try:
-            image = face_recognition.load_image_file(image_path)
-            original_h, original_w = image.shape[:2]
+            image = FacePipeline.load(image_path)
         except Exception as e:
-            return {"success": False, "matched": False, "error": f"Failed to load image: {str(e)}"}
+            return None, None, {"success": False, "matched": False, "error": f"Failed to load image: {str(e)}"}
 
         # 2. Blur Handling
         blur_val = DetectionService._calculate_blur(image)
         if blur_val < DetectionService.BLUR_THRESHOLD_SEVERE:
-            return {
+            return None, None, {
                 "success": True, "matched": False, "error": "Image extremely blurry",
                 "reason": f"Blur variance {blur_val:.2f} < {DetectionService.BLUR_THRESHOLD_SEVERE}"
             }
@@ -56,22 +58,22 @@ class DetectionService:
 
         # 3. Small/Far Face Handling: Upscale 1.5x before detection
         h, w = image.shape[:2]
+        # Tile frames that are large as captured, not because of the upscale
+        tiled = max(h, w) >= Config.TILED_DETECTION_MIN_SIDE
         upscale_w = int(w * DetectionService.UPSCALE_FACTOR)
         upscale_h = int(h * DetectionService.UPSCALE_FACTOR)
         upscaled_image = cv2.resize(image, (upscale_w, upscale_h), interpolation=cv2.INTER_CUBIC)
 
-        locations = face_recognition.face_locations(upscaled_image, model="hog")
-        if not locations:
-            # Fallback to CNN if HOG fails
-            locations = face_recognition.face_locations(upscaled_image, model="cnn")
+        pipeline = pipeline or get_pipeline()
+        locations = pipeline.detect(upscaled_image, tiled=tiled)
 
         if len(locations) == 0:
-            return {
+            return None, None, {
                 "success": True, "matched": False, "error": "No face detected",
                 "reason": "Detection failed on upscaled image"
             }
         if len(locations) > 1:
-            return {
+            return None, None, {
                 "success": True, "matched": False, "error": "Multiple faces detected",
                 "reason": f"Found {len(locations)} faces"
             }
@@ -81,66 +83,199 @@ class DetectionService:
         face_width_original = face_width_upscaled / DetectionService.UPSCALE_FACTOR
 
         if face_width_original < DetectionService.MIN_FACE_WIDTH:
-            return {
+            return None, None, {
                 "success": True, "matched": False, "error": "Face too small",
                 "reason": f"Face width {face_width_original:.1f}px < {DetectionService.MIN_FACE_WIDTH}px minimum"
             }
 
-        # Encode face using 'large' model
-        encodings = face_recognition.face_encodings(upscaled_image, known_face_locations=locations, model="large")
+        encodings = pipeline.encode(upscaled_image, locations)
         if not encodings:
-            return {
+            return None, None, {
                 "success": True, "matched": False, "error": "Failed to extract encoding",
                 "reason": "Encoding failed after valid detection"
             }
         
-        captured_encoding = encodings[0]
+        return encodings[0], image, None
+
+    @staticmethod
+    def _encode_downscaled(image, pipeline=None):
+        """
+        Second-pass encoding on a downscaled copy, used when the first pass
+        lands above the threshold. Returns None unless exactly one face is found.
+        """
+        h, w = image.shape[:2]
+        downscale_w = int(w * DetectionService.DOWNSCALE_FACTOR)
+        downscale_h = int(h * DetectionService.DOWNSCALE_FACTOR)
+        downscaled_image = cv2.resize(image, (downscale_w, downscale_h), interpolation=cv2.INTER_AREA)
+
+        pipeline = pipeline or get_pipeline()
+        downscaled_locations = pipeline.detect(
+            downscaled_image, tiled=max(h, w) >= Config.TILED_DETECTION_MIN_SIDE
+        )
+        
+        if len(downscaled_locations) == 1:
+            down_encodings = pipeline.encode(downscaled_image, downscaled_locations)
+            if down_encodings:
+                return down_encodings[0]
+        return None
+
+    @staticmethod
+    def match_face(image_path, department=None, section=None, search=None, threshold=None, violation_counts=None,
+                   pipeline=None):
+        """
+        Match a captured face with blur handling, scale handling, and strict thresholds.
+
+        search/threshold/violation_counts/pipeline let an offline matcher run
+        the same logic against its own gallery instead of the live one.
+        """
+        if search is None:
+            search = DetectionService._search
+            pipeline = DetectionService._live_pipeline()
+        captured_encoding, image, error = DetectionService._encode_capture(image_path, pipeline)
+        if error:
+            return error
 
         # 4. Candidates Selection
-        candidates = StudentService.get_students_for_matching(department, section)
-        if not candidates:
+        best_match, best_distance = search([captured_encoding], department, section)[0]
+        if best_match is None:
+            return DetectionService._no_candidates_response()
+
+        if threshold is None:
+            threshold = getattr(Config, 'FACE_DISTANCE_THRESHOLD', 0.5)
+
+        # 5. Matching Logic: Multi-pass fallback strategy
+        if best_distance >= threshold:
+            down_encoding = DetectionService._encode_downscaled(image, pipeline)
+            if down_encoding is not None:
+                retry_match, retry_distance = search([down_encoding], department, section)[0]
+                if retry_distance < best_distance:
+                    best_distance = retry_distance
+                    best_match = retry_match
+
+        return DetectionService._build_match_response(best_match, best_distance, threshold, violation_counts)
+
+    @staticmethod
+    def verify_face(image_path, roll_no):
+        """
+        1:1 verification of a capture against one claimed student, using that
+        student's own threshold when one is set.
+        """
+        roll_no = str(roll_no).strip().upper()
+        gallery = GalleryService.get_gallery()
+        pipeline = get_pipeline(gallery.pipeline_spec)
+        student, stored_embedding = gallery.get(roll_no)
+        if student is None:
+            # Not in this worker's gallery yet (e.g. registered seconds ago)
+            student, stored_embedding = StudentService.get_student_for_matching(roll_no, pipeline.version)
+        if student is None:
             return {
-                "success": True, "matched": False, "error": "No candidates",
-                "reason": "No registered students in chosen area"
+                "success": False, "verified": False, "roll_no": roll_no,
+                "error": "Student not found or has no active face embedding"
+            }
+
+        captured_encoding, image, error = DetectionService._encode_capture(image_path, pipeline)
+        if error:
+            error.pop("matched", None)
+            return {**error, "verified": False, "roll_no": roll_no}
+
+        threshold = DetectionService._student_threshold(student)
+        stored = np.asarray(stored_embedding, dtype=np.float32)
+        distance = float(np.linalg.norm(stored - np.asarray(captured_encoding, dtype=np.float32)))
+
+        if distance >= threshold:
+            down_encoding = DetectionService._encode_downscaled(image, pipeline)
+            if down_encoding is not None:
+                distance = min(distance, float(np.linalg.norm(stored - np.asarray(down_encoding, dtype=np.float32))))
+
+        verified = bool(distance < threshold)
+        return {
+            "success": True,
+            "verified": verified,
+            "roll_no": roll_no,
+            "confidence": round((1 - distance) * 100, 2),
+            "distance": distance,
+            "threshold": float(threshold),
+            "reason": "Identity confirmed" if verified else "Distance above student threshold",
+            "student": {
+                "roll_no": roll_no,
+                "name": student.get("name"),
+                "department": student.get("department", "CSE"),
+                "section": student.get("section", "A")
             }
+        }
+
+    @staticmethod
+    def _student_threshold(student):
+        """
+        Per-student threshold from registration, falling back to the global one.
+        """
+        try:
+            threshold = float(student.get("threshold"))
+        except (TypeError, ValueError):
+            threshold = 0.0
+        if 0.0 < threshold < 1.0:
+            return threshold
+        return getattr(Config, 'FACE_DISTANCE_THRESHOLD', 0.5)
 
+    @staticmethod
+    def match_encodings(encodings, department=None, section=None):
+        """
+        Gallery search and threshold logic of match_face for precomputed
+        128-d encodings (edge clients that run the dlib encoder locally).
+        """
         threshold = getattr(Config, 'FACE_DISTANCE_THRESHOLD', 0.5)
+        matches = DetectionService._search(encodings, department, section)
 
-        def find_best_match(target_encoding):
-            b_match = None
-            b_dist = float('inf')
-            for student in candidates:
-                stored_embedding = student.get("face", {}).get("embedding")
-                if not stored_embedding:
-                    continue
-                dist = np.linalg.norm(np.array(target_encoding) - np.array(stored_embedding))
-                if dist < b_dist:
-                    b_dist = dist
-                    b_match = student
-            return b_match, b_dist
-
-        best_match, best_distance = find_best_match(captured_encoding)
+        # Counters change with every violation, so they are read live for matches only
+        matched_rolls = [m["roll_no"] for m, d in matches if m is not None and d < threshold]
+        counts = StudentService.get_violation_counts(matched_rolls) if matched_rolls else {}
 
-        # 5. Matching Logic: Multi-pass fallback strategy
-        if best_distance >= threshold:
-            # Downscale original image and retry processing
-            downscale_w = int(original_w * DetectionService.DOWNSCALE_FACTOR)
-            downscale_h = int(original_h * DetectionService.DOWNSCALE_FACTOR)
-            downscaled_image = cv2.resize(image, (downscale_w, downscale_h), interpolation=cv2.INTER_AREA)
-
-            downscaled_locations = face_recognition.face_locations(downscaled_image, model="hog")
-            if not downscaled_locations:
-                downscaled_locations = face_recognition.face_locations(downscaled_image, model="cnn")
-            
-            if len(downscaled_locations) == 1:
-                down_encodings = face_recognition.face_encodings(downscaled_image, known_face_locations=downscaled_locations, model="large")
-                if down_encodings:
-                    retry_match, retry_distance = find_best_match(down_encodings[0])
-                    if retry_distance < best_distance:
-                        best_distance = retry_distance
-                        best_match = retry_match
-
-        # Construct final structured response
+        return [
+            DetectionService._build_match_response(match, distance, threshold, counts)
+            if match is not None else DetectionService._no_candidates_response()
+            for match, distance in matches
+        ]
+
+    @staticmethod
+    def _live_pipeline():
+        """
+        Pipeline that produced the gallery _search() will use, so captures
+        stay comparable across a re-embedding switch.
+        """
+        if Config.MATCH_SHARDS > 0:
+            coordinator = ShardCoordinator.instance()
+            coordinator.refresh()
+            return get_pipeline(coordinator.pipeline_spec)
+        return get_pipeline(GalleryService.get_gallery().pipeline_spec)
+
+    @staticmethod
+    def _search(encodings, department=None, section=None):
+        """
+        Nearest (student, distance) per encoding, from the sharded matcher
+        tier when MATCH_SHARDS is set, else from this worker's gallery.
+        Student is None when there are no candidates.
+        """
+        if Config.MATCH_SHARDS > 0:
+            coordinator = ShardCoordinator.instance()
+            coordinator.refresh()
+            return [
+                hits[0] if hits else (None, float("inf"))
+                for hits in coordinator.search(encodings, department, section, k=1)
+            ]
+        return GalleryService.get_gallery().search(encodings, department, section)
+
+    @staticmethod
+    def _no_candidates_response():
+        return {
+            "success": True, "matched": False, "error": "No candidates",
+            "reason": "No registered students in chosen area"
+        }
+
+    @staticmethod
+    def _build_match_response(best_match, best_distance, threshold, violation_counts=None):
+        """
+        Construct final structured response
+        """
         if best_match is not None:
             confidence = round((1 - best_distance) * 100, 2)
             matched = bool(best_distance < threshold)
@@ -154,12 +289,15 @@ class DetectionService:
                 "reason": "Match successful" if matched else "Distance above strict threshold"
             }
             if matched:
+                roll_no = best_match["roll_no"]
+                if violation_counts is None:
+                    violation_counts = StudentService.get_violation_counts([roll_no])
                 response["student"] = {
-                    "roll_no": best_match["roll_no"],
+                    "roll_no": roll_no,
                     "name": best_match["name"],
                     "department": best_match.get("department", "CSE"),
                     "section": best_match.get("section", "A"),
-                    "violations_count": best_match.get("violations_count", 0)
+                    "violations_count": violation_counts.get(roll_no, 0)
                 }
             return response
             
@@ -0,0 +1,274 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from db import get_db
+from config import Config
+from services.face_pipeline import get_pipeline
+from services.gallery_service import EMBEDDING_DIM, Gallery, GalleryService
+
+BUNDLE_FORMAT = 1
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def _token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def export_bundle(department, out_dir, token=None):
+    """
+    Package one department's gallery for an offline checkpoint.
+
+    The bundle is a directory holding a raw float32 embeddings.npy (loaded
+    with mmap_mode='r' on the device) and a manifest.json with roll_nos,
+    names, thresholds, the gallery version it was cut from and the pipeline
+    the device must encode captures with.
+
+    Clients of the bundle's HTTP server must present token (a random one
+    if not given). Only its SHA-256 is stored in the manifest; the token
+    itself is returned once, here.
+    """
+    token = token or secrets.token_urlsafe(32)
+    db = get_db()
+    department = department.upper()
+    gallery = GalleryService.load_partition(department)
+    version = gallery.version
+    pipeline = get_pipeline(gallery.pipeline_spec)
+    violations = {
+        doc["roll_no"]: doc.get("violations_count", 0)
+        for doc in db.students.find({"department": department}, {"_id": 0, "roll_no": 1, "violations_count": 1})
+    }
+
+    students = [
+        {
+            "roll_no": s["roll_no"],
+            "name": s.get("name"),
+            "section": s.get("section"),
+            "threshold": s.get("threshold"),
+            "violations_count": violations.get(s["roll_no"], 0),
+        }
+        for s in gallery.students
+    ]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    matrix = np.ascontiguousarray(gallery.matrix, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    np.save(out_dir / EMBEDDINGS_FILE, matrix)
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "department": department,
+        "gallery_version": version,
+        "model_version": pipeline.model_version,
+        "pipeline": pipeline.spec,
+        "threshold": getattr(Config, 'FACE_DISTANCE_THRESHOLD', 0.5),
+        "exported_at": datetime.utcnow().isoformat(),
+        "api_token_sha256": _token_digest(token),
+        "students": students,
+    }
+    tmp_path = out_dir / (MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp_path, out_dir / MANIFEST_FILE)
+    return {"department": department, "students": len(students), "gallery_version": version, "token": token}
+
+
+class ViolationQueue:
+    """
+    Durable on-disk queue of violations confirmed while offline.
+
+    Entries are appended to pending.jsonl with an fsync; synced.offset
+    records how far replay has got, so a crash mid-sync resumes at the last
+    acknowledged batch. Each entry has a client_event_id, so replaying a
+    batch twice cannot create duplicates on the server. A line torn by a
+    crash mid-append is cut off before the next append or replay.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = Path(queue_dir)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        self.pending_path = self.queue_dir / "pending.jsonl"
+        self.offset_path = self.queue_dir / "synced.offset"
+        self._lock = threading.Lock()
+
+    def enqueue(self, violation):
+        entry = dict(violation)
+        entry.setdefault("client_event_id", uuid.uuid4().hex)
+        entry.setdefault("captured_at", datetime.utcnow().isoformat())
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._truncate_torn_tail()
+            with open(self.pending_path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return entry["client_event_id"]
+
+    def _truncate_torn_tail(self):
+        """
+        Drop a trailing partial line left by a crash during enqueue(), so it
+        is neither replayed nor glued to the next entry.
+        """
+        try:
+            f = open(self.pending_path, "rb+")
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(end - 4096, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                print(f"Dropping {size - end} bytes of a torn entry from {self.pending_path}")
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read_offset(self):
+        try:
+            return int(self.offset_path.read_text().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset):
+        tmp_path = self.offset_path.with_suffix(".tmp")
+        tmp_path.write_text(str(offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def pending_count(self):
+        if not self.pending_path.exists():
+            return 0
+        with open(self.pending_path) as f:
+            f.seek(self._read_offset())
+            return sum(1 for line in f if line.strip())
+
+    def replay(self, submit_batch, batch_size=100):
+        """
+        Send queued entries to submit_batch(list) in order, batch by batch.
+        Stops at the first failing batch so it is retried on the next call.
+        """
+        totals = {"sent": 0, "inserted": 0, "duplicates": 0, "errors": []}
+        with self._lock:
+            self._truncate_torn_tail()
+            if not self.pending_path.exists():
+                return totals
+            offset = self._read_offset()
+            with open(self.pending_path) as f:
+                f.seek(offset)
+                while True:
+                    batch = []
+                    while len(batch) < batch_size:
+                        line = f.readline()
+                        if not line:
+                            break
+                        if not line.strip():
+                            continue
+                        try:
+                            batch.append(json.loads(line))
+                        except ValueError:
+                            totals["errors"].append({"error": "Unreadable queue entry", "entry": line[:200]})
+                    if not batch:
+                        break
+                    result = submit_batch(batch)
+                    offset = f.tell()
+                    self._write_offset(offset)
+                    totals["sent"] += len(batch)
+                    totals["inserted"] += result.get("inserted", 0)
+                    totals["duplicates"] += result.get("duplicates", 0)
+                    totals["errors"].extend(result.get("errors", []))
+
+            # Everything acknowledged: start a fresh file
+            if offset >= self.pending_path.stat().st_size:
+                self.pending_path.unlink()
+                self.offset_path.unlink(missing_ok=True)
+        return totals
+
+
+class EdgeMatcher:
+    """
+    Serves match_face-equivalent results from an exported bundle, without
+    MongoDB or the Flask backend.
+    """
+
+    def __init__(self, bundle_dir, queue_dir=None):
+        bundle_dir = Path(bundle_dir)
+        with open(bundle_dir / MANIFEST_FILE) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format {manifest.get('format')}")
+
+        self.manifest = manifest
+        self.department = manifest["department"]
+        self.threshold = manifest["threshold"]
+        students = [
+            {**s, "department": manifest["department"]}
+            for s in manifest["students"]
+        ]
+        matrix = np.load(bundle_dir / EMBEDDINGS_FILE, mmap_mode="r")
+        # Bundles cut before pipelines were recorded use the Config default
+        self.pipeline = get_pipeline(manifest.get("pipeline"))
+        self.gallery = Gallery(manifest["gallery_version"], matrix, students, manifest.get("pipeline"))
+        self.violation_counts = {s["roll_no"]: s.get("violations_count", 0) for s in students}
+        self.queue = ViolationQueue(queue_dir or bundle_dir / "queue")
+
+    def _search(self, encodings, department=None, section=None):
+        return self.gallery.search(encodings, None, section)
+
+    def match_face(self, image_path, section=None):
+        from services.detection_service import DetectionService
+        return DetectionService.match_face(
+            image_path, self.department, section,
+            search=self._search, threshold=self.threshold,
+            violation_counts=self.violation_counts, pipeline=self.pipeline
+        )
+
+    def match_encodings(self, encodings, section=None):
+        from services.detection_service import DetectionService
+        return [
+            DetectionService._build_match_response(match, distance, self.threshold, self.violation_counts)
+            if match is not None else DetectionService._no_candidates_response()
+            for match, distance in self._search(encodings, None, section)
+        ]
+
+    def check_token(self, token):
+        """
+        Whether token is the one the bundle was exported with. Bundles cut
+        before tokens existed accept none.
+        """
+        expected = self.manifest.get("api_token_sha256")
+        return bool(expected and token) and hmac.compare_digest(_token_digest(token), expected)
+
+    def record_violation(self, violation):
+        """
+        Queue a confirmed violation for later upload. Raises ValueError for
+        a roll_no that isn't one of the bundle's students.
+        """
+        violation = dict(violation)
+        roll_no = str(violation.get("roll_no") or "").strip().upper()
+        if roll_no not in self.violation_counts:
+            raise ValueError(f"Unknown roll_no for this bundle: {roll_no or '(missing)'}")
+        violation["roll_no"] = roll_no
+        violation.setdefault("department", self.department)
+        event_id = self.queue.enqueue(violation)
+        self.violation_counts[roll_no] += 1
+        return event_id
+
+    def sync(self, batch_size=100):
+        """
+        Replay queued violations into ViolationService once reconnected.
+        """
+        from services.violation_service import ViolationService
+        return self.queue.replay(ViolationService.create_violations_batch, batch_size)
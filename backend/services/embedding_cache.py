@@ -0,0 +1,325 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from config import Config
+from services.face_pipeline import PipelineResult, get_pipeline
+
+HASH_CHUNK_SIZE = 1 << 20
+COMMIT_EVERY = 200
+# A batch is also committed once its first write is this old, so a slow job
+# never holds the write lock for long
+COMMIT_INTERVAL_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS faces (
+    content_hash TEXT NOT NULL,
+    pipeline_version TEXT NOT NULL,
+    face_count INTEGER NOT NULL,
+    boxes BLOB NOT NULL,
+    landmarks BLOB NOT NULL,
+    landmark_points INTEGER NOT NULL,
+    encodings BLOB NOT NULL,
+    PRIMARY KEY (content_hash, pipeline_version)
+);
+CREATE TABLE IF NOT EXISTS chips (
+    content_hash TEXT NOT NULL,
+    detection_version TEXT NOT NULL,
+    face_count INTEGER NOT NULL,
+    boxes BLOB NOT NULL,
+    landmarks BLOB NOT NULL,
+    landmark_points INTEGER NOT NULL,
+    chips BLOB NOT NULL,
+    PRIMARY KEY (content_hash, detection_version)
+);
+"""
+
+
+def file_content_hash(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pack_chips(chips):
+    """
+    All of an image's aligned chips as one lossless PNG strip.
+    """
+    if not len(chips):
+        return b""
+    strip = cv2.cvtColor(np.vstack(chips), cv2.COLOR_RGB2BGR)
+    ok, png = cv2.imencode(".png", strip)
+    if not ok:
+        raise ValueError("Could not encode face chips")
+    return png.tobytes()
+
+
+def _unpack_chips(blob, count):
+    if not count:
+        return []
+    strip = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+    strip = cv2.cvtColor(strip, cv2.COLOR_BGR2RGB)
+    return [np.ascontiguousarray(chip) for chip in np.split(strip, count)]
+
+
+class EmbeddingCache:
+    """
+    Per-image cache of detection + encoding results in a sqlite file.
+
+    Entries are keyed by the image's content hash and the pipeline version,
+    so renamed or copied images are still hits and changing the detector or
+    model invalidates everything. Images with no face are cached too. The
+    files table remembers (size, mtime) per path so unchanged files are not
+    re-read just to be hashed.
+
+    Alongside, the chips table keeps each image's boxes, landmarks and
+    aligned face chips keyed by the detection version only. A pipeline that
+    changes just the encoder side (model version, jitters) encodes straight
+    from the chips, without decoding the photo or running detection again.
+
+    Several processes share the file, so writes are committed in small
+    batches (commit_every, request paths use 1). The cache is only a
+    shortcut: if the file can't be opened or stays locked past
+    EMBEDDING_CACHE_BUSY_TIMEOUT_SECONDS, lookups miss and writes are
+    dropped for the rest of this instance instead of failing the caller.
+    """
+
+    def __init__(self, path=None, pipeline=None, commit_every=COMMIT_EVERY):
+        self.path = Path(path or Config.EMBEDDING_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.pipeline = pipeline or get_pipeline()
+        self.version = self.pipeline.version
+        self.detection_version = self.pipeline.detection_version
+        self.hits = 0
+        self.misses = 0
+        self.chip_hits = 0
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._batch_started = None
+        self._lock = threading.Lock()
+        self._conn = None
+        try:
+            conn = sqlite3.connect(str(self.path), timeout=Config.EMBEDDING_CACHE_BUSY_TIMEOUT_SECONDS,
+                                   check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+                conn.commit()
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self._conn = conn
+        except sqlite3.Error as e:
+            print(f"Embedding cache {self.path} unavailable, continuing without it: {e}")
+
+    def _read(self, sql, params):
+        with self._lock:
+            if self._conn is None:
+                return None
+            try:
+                return self._conn.execute(sql, params).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None
+
+    def _write(self, sql, params):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(sql, params)
+                self._changed()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    def _disable(self, error):
+        """
+        Stop using the file after an error, releasing any write lock held.
+        Called with self._lock held.
+        """
+        print(f"Embedding cache {self.path} failed, continuing without it: {error}")
+        try:
+            self._conn.rollback()
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+        self._conn = None
+
+    def content_hash(self, image_path):
+        image_path = os.path.abspath(image_path)
+        st = os.stat(image_path)
+        row = self._read("SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (image_path,))
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        content_hash = file_content_hash(image_path)
+        self._write(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            (image_path, st.st_size, st.st_mtime_ns, content_hash)
+        )
+        return content_hash
+
+    def get(self, content_hash):
+        """
+        Cached PipelineResult (image=None) for a content hash, or None.
+        """
+        row = self._read(
+            "SELECT face_count, boxes, landmarks, landmark_points, encodings FROM faces "
+            "WHERE content_hash = ? AND pipeline_version = ?",
+            (content_hash, self.version)
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        count, boxes, landmarks, points, encodings = row
+        boxes = np.frombuffer(boxes, dtype="<i4").reshape(count, 4)
+        landmarks = np.frombuffer(landmarks, dtype="<i4").reshape(count, points, 2)
+        encodings = np.frombuffer(encodings, dtype="<f8").reshape(count, 128)
+        return PipelineResult(
+            None,
+            [tuple(int(v) for v in box) for box in boxes],
+            [encoding.copy() for encoding in encodings],
+            {"cache": "hit"},
+            None,
+            [[tuple(int(v) for v in p) for p in face] for face in landmarks],
+        )
+
+    def get_chips(self, content_hash):
+        """
+        Cached detection for a content hash as a PipelineResult with
+        locations, landmarks and chips but no encodings, or None.
+        """
+        row = self._read(
+            "SELECT face_count, boxes, landmarks, landmark_points, chips FROM chips "
+            "WHERE content_hash = ? AND detection_version = ?",
+            (content_hash, self.detection_version)
+        )
+        if row is None:
+            return None
+        self.chip_hits += 1
+
+        count, boxes, landmarks, points, chips = row
+        boxes = np.frombuffer(boxes, dtype="<i4").reshape(count, 4)
+        landmarks = np.frombuffer(landmarks, dtype="<i4").reshape(count, points, 2)
+        return PipelineResult(
+            None,
+            [tuple(int(v) for v in box) for box in boxes],
+            [],
+            {"cache": "chips"},
+            None,
+            [[tuple(int(v) for v in p) for p in face] for face in landmarks],
+            _unpack_chips(chips, count),
+        )
+
+    def put(self, content_hash, locations, landmarks, encodings, chips=None):
+        count = len(encodings)
+        points = len(landmarks[0]) if count else 0
+        if chips is not None:
+            self.put_chips(content_hash, locations, landmarks, chips)
+        self._write(
+            "INSERT OR REPLACE INTO faces (content_hash, pipeline_version, face_count, boxes, "
+            "landmarks, landmark_points, encodings) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                content_hash, self.version, count,
+                np.asarray(locations, dtype="<i4").reshape(count, 4).tobytes(),
+                np.asarray(landmarks, dtype="<i4").reshape(count, points, 2).tobytes(),
+                points,
+                np.asarray(encodings, dtype="<f8").reshape(count, 128).tobytes(),
+            )
+        )
+
+    def put_chips(self, content_hash, locations, landmarks, chips):
+        count = len(chips)
+        points = len(landmarks[0]) if count else 0
+        self._write(
+            "INSERT OR REPLACE INTO chips (content_hash, detection_version, face_count, boxes, "
+            "landmarks, landmark_points, chips) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                content_hash, self.detection_version, count,
+                np.asarray(locations, dtype="<i4").reshape(count, 4).tobytes(),
+                np.asarray(landmarks, dtype="<i4").reshape(count, points, 2).tobytes(),
+                points,
+                _pack_chips(chips),
+            )
+        )
+
+    def process(self, image_path):
+        """
+        FacePipeline.process() for a file, answered from the cache when the
+        same bytes were already processed with the same pipeline version,
+        or encoded from stored chips when only the encoder side changed.
+        """
+        content_hash = self.content_hash(image_path)
+        result = self.get(content_hash)
+        if result is not None:
+            return result
+        result = self.get_chips(content_hash)
+        if result is not None:
+            result.encodings = self.pipeline.encode_chips(result.chips)
+            self.put(content_hash, result.locations, result.landmarks, result.encodings)
+            return result
+        result = self.pipeline.process(image_path, with_chips=True)
+        self.put(content_hash, result.locations, result.landmarks, result.encodings, result.chips)
+        return result
+
+    def _changed(self):
+        self._uncommitted += 1
+        if self._batch_started is None:
+            self._batch_started = time.monotonic()
+        if (self._uncommitted >= self.commit_every
+                or time.monotonic() - self._batch_started >= COMMIT_INTERVAL_SECONDS):
+            self._commit()
+
+    def _commit(self):
+        self._conn.commit()
+        self._uncommitted = 0
+        self._batch_started = None
+
+    def flush(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    def prune(self):
+        """
+        Drop entries from other pipeline versions and paths that no longer exist.
+        """
+        with self._lock:
+            if self._conn is None:
+                raise RuntimeError(f"Embedding cache {self.path} is unavailable")
+            faces = self._conn.execute(
+                "DELETE FROM faces WHERE pipeline_version != ?", (self.version,)
+            ).rowcount
+            chips = self._conn.execute(
+                "DELETE FROM chips WHERE detection_version != ?", (self.detection_version,)
+            ).rowcount
+            stale = [p for (p,) in self._conn.execute("SELECT path FROM files") if not os.path.exists(p)]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in stale])
+            self._conn.commit()
+        return {"faces": faces, "chips": chips, "files": len(stale)}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,68 +1,316 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-import face_recognition
 from pathlib import Path
+from bson import ObjectId
+from pymongo import UpdateOne
 from db import get_db
 from config import Config
+from services.blob_store import LocalBlobStore, blob_key, get_blob_store
+from services.gallery_service import GalleryService
 from services.student_service import StudentService
+from services.embedding_cache import EmbeddingCache
+from services.face_pipeline import get_pipeline
+from utils.sync_storage import find_student_dir
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+_worker_spec = None
+
+
+def _init_worker(pipeline_spec=None):
+    global _worker_spec
+    _worker_spec = pipeline_spec
+
+
+def _encode_image(image_path):
+    """
+    Worker task: (locations, landmarks, encodings, chips) for one image, or
+    an error string.
+    """
+    try:
+        result = get_pipeline(_worker_spec).process(image_path, with_chips=True)
+        return (result.locations, result.landmarks, result.encodings, result.chips), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _encode_chips(locations, landmarks, chips):
+    """
+    Worker task for an image whose aligned chips are already stored: only
+    the encoder runs. chips is None in the result since they're cached.
+    """
+    try:
+        encodings = get_pipeline(_worker_spec).encode_chips(chips)
+        return (locations, landmarks, encodings, None), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _cached(result):
+    future = Future()
+    future.set_result(((result.locations, result.landmarks, result.encodings, None), None))
+    return future
+
+
+class _Progress:
+    """
+    Live images/sec and ETA line on stdout.
+    """
+
+    def __init__(self, total_students, interval=2.0):
+        self.total_students = total_students
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_print = 0.0
+        self.images = 0
+        self.students = 0
+
+    def update(self, images):
+        self.images += images
+        self.students += 1
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.report(now)
+
+    def report(self, now=None):
+        now = now or time.monotonic()
+        self.last_print = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.images / elapsed
+        remaining = max(self.total_students - self.students, 0)
+        eta = remaining * elapsed / self.students if self.students else 0
+        print(f"  {self.students}/{self.total_students} students, {self.images} images, "
+              f"{rate:.1f} img/s, ETA {int(eta // 60)}m{int(eta % 60):02d}s", flush=True)
+
 
 class FaceEmbeddingService:
     @staticmethod
-    def process_all_pending():
+    def _load_checkpoint():
+        try:
+            with open(Config.EMBEDDING_CHECKPOINT_PATH) as f:
+                return json.load(f).get("last_id")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_checkpoint(last_id):
+        path = Path(Config.EMBEDDING_CHECKPOINT_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"last_id": str(last_id), "updated_at": datetime.utcnow().isoformat()}, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _student_images(student):
+        roll_no = student.get("roll_no") or student.get("student_id")
+        dept = student.get("department", "CSE")
+        section = student.get("section", "A")
+        student_dir = Path(Config.STORAGE_TRAINING) / dept / section / roll_no
+        # Listed from the blob store and fetched into the local cache, so any
+        # node can encode any student
+        store = get_blob_store()
+        prefix = blob_key(student_dir) + "/"
+        keys = [
+            key for key, _ in store.list(prefix)
+            if "/" not in key[len(prefix):] and os.path.splitext(key)[1].lower() in IMAGE_EXTENSIONS
+        ]
+        if not keys and isinstance(store, LocalBlobStore) and not student_dir.is_dir():
+            # A folder dropped in with other casing (cse/a/21abc)
+            found = find_student_dir(Config.STORAGE_TRAINING, dept, section, roll_no)
+            if found is not None:
+                return roll_no, found, sorted(
+                    str(p) for p in found.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+                )
+        if not keys:
+            return roll_no, student_dir, None if not student_dir.is_dir() else []
+        images = sorted(str(store.local_path(key)) for key in keys)
+        return roll_no, student_dir, images
+
+    @staticmethod
+    def _centroid_update(student_id, filenames, encodings, version):
+        """
+        UpdateOne replacing a student's centroid (and the running sum/count
+        behind it) with one computed from these images. Bumps face.revision
+        so an in-flight incremental update doesn't write its older mean over it.
+        """
+        face = StudentService.face_document(filenames, encodings, version)
+        return UpdateOne(
+            {"_id": student_id},
+            {"$set": {
+                "face.embedding": face["embedding"],
+                "face.embedding_sum": face["embedding_sum"],
+                "face.embedding_count": face["embedding_count"],
+                "face.encodings": face["encodings"],
+                "face.embedding_version": version,
+                "face.status": "active",
+                "updated_at": datetime.utcnow()
+            }, "$inc": {"face.revision": 1}, "$unset": {"face.next": ""}}
+        )
+
+    @staticmethod
+    def process_all_pending(workers=None, batch_size=50, resume=True):
         """
         Scan students with pending_image status, locate their images in hierarchy,
         and generate averaged embeddings.
+
+        Pending students are streamed from a cursor in _id order, their images
+        are encoded on a process pool, and results are written with batched
+        bulk_write calls. The last written _id is checkpointed after every
+        batch, so an interrupted run resumes where it stopped. Images already
+        in the EmbeddingCache are not re-encoded, and images with stored
+        face chips skip detection.
         """
         db = get_db()
-        pending_students = list(db.students.find({"face.status": "pending_image"}))
-        
+        pipeline = GalleryService.live_pipeline()
+        cache = EmbeddingCache(pipeline=pipeline)
+        query = {"face.status": "pending_image"}
+        last_id = FaceEmbeddingService._load_checkpoint() if resume else None
+        if last_id:
+            query["_id"] = {"$gt": ObjectId(last_id)}
+            print(f"Resuming after checkpoint {last_id}")
+
+        total = db.students.count_documents(query)
+        cursor = db.students.find(
+            query, {"roll_no": 1, "student_id": 1, "department": 1, "section": 1}
+        ).sort("_id", 1).batch_size(500)
+
         results = {"success": 0, "failed": 0}
-        
-        for student in pending_students:
-            sid = student["student_id"]
-            dept = student.get("department", "CSE")
-            section = student.get("section", "A")
-            
-            student_dir = Path(Config.STORAGE_TRAINING) / dept / section / sid
-            if not student_dir.exists():
-                print(f"Warning: Directory not found for {sid} at {student_dir}")
-                results["failed"] += 1
-                continue
-            
-            # Load images and get encodings
+        progress = _Progress(total)
+        operations = []
+        workers = workers or os.cpu_count() or 1
+        max_in_flight = workers * 4
+
+        def flush(checkpoint_id):
+            cache.flush()
+            if operations:
+                db.students.bulk_write(operations, ordered=False)
+                operations.clear()
+                GalleryService.bump_version()
+            if checkpoint_id is not None:
+                FaceEmbeddingService._save_checkpoint(checkpoint_id)
+
+        def finish(student_id, roll_no, futures, student_dir):
+            filenames = []
             encodings = []
-            for img_path in student_dir.iterdir():
-                if img_path.is_file() and img_path.suffix.lower() in {'.jpg', '.jpeg', '.png'}:
-                    try:
-                        image = face_recognition.load_image_file(str(img_path))
-                        img_encodings = face_recognition.face_encodings(image)
-                        if img_encodings:
-                            encodings.append(img_encodings[0])
-                    except Exception as e:
-                        print(f"Error processing {img_path}: {e}")
+            for image_path, content_hash, future, cache_hit in futures:
+                faces, error = future.result()
+                if error:
+                    print(f"Error processing {image_path}: {error}")
+                    continue
+                if not cache_hit:
+                    cache.put(content_hash, *faces)
+                if faces[2]:
+                    filenames.append(os.path.basename(image_path))
+                    encodings.append(faces[2][0])
+            progress.update(len(futures))
 
             if not encodings:
-                print(f"No valid encodings found for {sid}")
+                print(f"No valid encodings found for {roll_no} in {student_dir}")
                 results["failed"] += 1
-                continue
-            
-            # Average encodings (Centroid)
-            import numpy as np
-            avg_encoding = np.mean(encodings, axis=0).tolist()
-            
-            # Update student
-            # We already have update_student_face in StudentService
-            # but it appends the filename. Here we might want something cleaner.
-            db.students.update_one(
-                {"student_id": sid},
-                {
-                    "$set": {
-                        "face.embedding": avg_encoding,
-                        "face.status": "active",
-                        "updated_at": datetime.utcnow() if 'datetime' in globals() else None
-                    }
-                }
-            )
-            results["success"] += 1
-            print(f"Generated embedding for {sid} ({len(encodings)} images)")
-            
+            else:
+                operations.append(FaceEmbeddingService._centroid_update(
+                    student_id, filenames, encodings, pipeline.version))
+                results["success"] += 1
+
+            if (results["success"] + results["failed"]) % batch_size == 0:
+                flush(student_id)
+
+        # Students are finished strictly in cursor order so the checkpoint
+        # never skips a student whose images are still being encoded.
+        in_flight = deque()
+        in_flight_images = 0
+        last_done = None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(pipeline.spec,)) as pool:
+            for student in cursor:
+                roll_no, student_dir, images = FaceEmbeddingService._student_images(student)
+                if images is None:
+                    print(f"Warning: Directory not found for {roll_no} at {student_dir}")
+                    futures = []
+                else:
+                    futures = []
+                    for path in images:
+                        content_hash = cache.content_hash(path)
+                        cached = cache.get(content_hash)
+                        if cached:
+                            future = _cached(cached)
+                        else:
+                            detected = cache.get_chips(content_hash)
+                            future = (pool.submit(_encode_chips, detected.locations, detected.landmarks, detected.chips)
+                                      if detected else pool.submit(_encode_image, path))
+                        futures.append((path, content_hash, future, cached is not None))
+                in_flight.append((student["_id"], roll_no, futures, student_dir))
+                in_flight_images += len(futures)
+
+                while in_flight and in_flight_images > max_in_flight:
+                    done = in_flight.popleft()
+                    in_flight_images -= len(done[2])
+                    finish(*done)
+                    last_done = done[0]
+
+            while in_flight:
+                done = in_flight.popleft()
+                finish(*done)
+                last_done = done[0]
+
+        flush(last_done)
+        if total:
+            progress.report()
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses "
+              f"({cache.chip_hits} encoded from stored face chips)")
+        cache.close()
+        # Clean finish: the next run starts from the beginning again
+        Path(Config.EMBEDDING_CHECKPOINT_PATH).unlink(missing_ok=True)
+        return results
+
+    @staticmethod
+    def refresh_students(roll_nos):
+        """
+        Recompute the centroid of just these students from the images
+        currently in their folders. Unchanged images come from the
+        EmbeddingCache, so this is cheap enough to run on every change.
+        """
+        db = get_db()
+        pipeline = GalleryService.live_pipeline()
+        cache = EmbeddingCache(pipeline=pipeline)
+        results = {"success": 0, "failed": 0}
+        operations = []
+        cursor = db.students.find(
+            {"roll_no": {"$in": list(roll_nos)}},
+            {"roll_no": 1, "department": 1, "section": 1}
+        )
+        try:
+            for student in cursor:
+                roll_no, student_dir, images = FaceEmbeddingService._student_images(student)
+                filenames = []
+                encodings = []
+                for image_path in images or []:
+                    try:
+                        result = cache.process(image_path)
+                    except Exception as e:
+                        print(f"Error processing {image_path}: {e}")
+                        continue
+                    if result.encodings:
+                        filenames.append(os.path.basename(image_path))
+                        encodings.append(result.encodings[0])
+
+                if not encodings:
+                    print(f"No valid encodings found for {roll_no} in {student_dir}")
+                    results["failed"] += 1
+                    continue
+                operations.append(FaceEmbeddingService._centroid_update(
+                    student["_id"], filenames, encodings, pipeline.version))
+                results["success"] += 1
+        finally:
+            cache.close()
+
+        if operations:
+            db.students.bulk_write(operations, ordered=False)
+            GalleryService.bump_version()
         return results
@@ -0,0 +1,306 @@
+import os
+import threading
+import time
+import cv2
+import dlib
+import numpy as np
+import face_recognition
+from face_recognition import api as face_recognition_api
+from config import Config
+from utils import tiled_detection
+
+# The dlib ResNet encoder aligns every face to a 150px chip with 25% padding;
+# chips cut with the same settings encode to identical descriptors.
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+
+class DetectorBackend:
+    """
+    Base class for face detectors. detect() returns face_recognition style
+    (top, right, bottom, left) boxes so every backend feeds the same encoder.
+
+    tiled asks for utils.tiled_detection on a large crowd frame. Only the
+    dlib backends tile; the OpenCV ones already scan large frames quickly.
+    """
+    name = None
+
+    def detect(self, image, tiled=False):
+        raise NotImplementedError
+
+
+class HogDetector(DetectorBackend):
+    name = "hog"
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, image, tiled=False):
+        if tiled:
+            return tiled_detection.face_locations(image, model="hog", upsample=self.upsample)
+        return face_recognition.face_locations(image, number_of_times_to_upsample=self.upsample, model="hog")
+
+
+class CnnDetector(DetectorBackend):
+    name = "cnn"
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, image, tiled=False):
+        if tiled:
+            return tiled_detection.face_locations(image, model="cnn", upsample=self.upsample)
+        return face_recognition.face_locations(image, number_of_times_to_upsample=self.upsample, model="cnn")
+
+
+class HaarDetector(DetectorBackend):
+    """
+    OpenCV's bundled frontal-face Haar cascade. Much faster than HOG on CPU,
+    with more false positives on cluttered backgrounds.
+    """
+    name = "haar"
+
+    def __init__(self, upsample=1):
+        cascade_path = Config.OPENCV_HAAR_CASCADE or os.path.join(
+            cv2.data.haarcascades, "haarcascade_frontalface_default.xml"
+        )
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise RuntimeError(f"Could not load Haar cascade from {cascade_path}")
+        # Smallest face HOG finds at this upsample level (80px window)
+        self.min_size = max(int(80 / (2 ** upsample)), 20)
+        self._lock = threading.Lock()
+
+    def detect(self, image, tiled=False):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
+        with self._lock:
+            boxes = self.cascade.detectMultiScale(
+                gray, scaleFactor=1.1, minNeighbors=5, minSize=(self.min_size, self.min_size)
+            )
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in boxes]
+
+
+class DnnDetector(DetectorBackend):
+    """
+    OpenCV's YuNet DNN face detector. The ONNX weights are not shipped in the
+    pip wheel, so OPENCV_DNN_FACE_MODEL must point at a downloaded copy.
+    """
+    name = "dnn"
+
+    def __init__(self, upsample=1, score_threshold=0.8):
+        model_path = Config.OPENCV_DNN_FACE_MODEL
+        if not model_path or not os.path.exists(model_path):
+            raise RuntimeError("DNN detector needs OPENCV_DNN_FACE_MODEL set to a YuNet .onnx file")
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold)
+        self._lock = threading.Lock()
+
+    def detect(self, image, tiled=False):
+        h, w = image.shape[:2]
+        bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if len(image.shape) == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        with self._lock:
+            self.detector.setInputSize((w, h))
+            _, faces = self.detector.detect(bgr)
+        if faces is None:
+            return []
+        locations = []
+        for face in faces:
+            x, y, fw, fh = (int(round(v)) for v in face[:4])
+            locations.append((max(y, 0), min(x + fw, w), min(y + fh, h), max(x, 0)))
+        return locations
+
+
+DETECTOR_BACKENDS = {
+    "hog": HogDetector,
+    "cnn": CnnDetector,
+    "haar": HaarDetector,
+    "dnn": DnnDetector,
+}
+
+
+class PipelineResult:
+    def __init__(self, image, locations, encodings, timings, detector, landmarks=None, chips=None):
+        self.image = image
+        self.locations = locations
+        self.encodings = encodings
+        self.timings = timings
+        self.detector = detector
+        self.landmarks = landmarks
+        self.chips = chips
+
+
+class FacePipeline:
+    """
+    Single load -> detect -> encode path shared by matching, registration and
+    the offline embedding scripts, so every stored and captured embedding is
+    produced with the same settings.
+    """
+
+    def __init__(self, detector=None, fallback=None, encoding_model=None, num_jitters=None, upsample=1,
+                 model_version=None):
+        self.model_version = model_version or Config.EMBEDDING_MODEL_VERSION
+        detector = detector or Config.FACE_DETECTOR
+        fallback = Config.FACE_DETECTOR_FALLBACK if fallback is None else fallback
+        if detector not in DETECTOR_BACKENDS:
+            raise ValueError(f"Unknown detector {detector!r}. Allowed: {list(DETECTOR_BACKENDS)}")
+        self.detector = DETECTOR_BACKENDS[detector](upsample=upsample)
+        self.fallback = DETECTOR_BACKENDS[fallback](upsample=upsample) if fallback and fallback != detector else None
+        self.encoding_model = encoding_model or Config.FACE_ENCODING_MODEL
+        self.num_jitters = Config.FACE_ENCODING_JITTERS if num_jitters is None else num_jitters
+
+    @property
+    def version(self):
+        """
+        Identifies everything that influences the produced encodings.
+        """
+        detector = self.detector.name
+        if self.fallback is not None:
+            detector += f"+{self.fallback.name}"
+        return f"{self.model_version}:{detector}:{self.encoding_model}:j{self.num_jitters}"
+
+    @property
+    def detection_version(self):
+        """
+        Identifies everything that influences boxes, landmarks and aligned
+        chips; pipelines sharing it can encode each other's chips.
+        """
+        detector = self.detector.name
+        if self.fallback is not None:
+            detector += f"+{self.fallback.name}"
+        return f"{detector}:{self.encoding_model}"
+
+    @property
+    def spec(self):
+        """
+        Plain-dict description of this pipeline, storable in Mongo and
+        accepted by from_spec()/get_pipeline(spec).
+        """
+        return {
+            "model_version": self.model_version,
+            "detector": self.detector.name,
+            "fallback": self.fallback.name if self.fallback is not None else "",
+            "encoding_model": self.encoding_model,
+            "num_jitters": self.num_jitters,
+        }
+
+    @staticmethod
+    def from_spec(spec):
+        return FacePipeline(
+            detector=spec.get("detector"), fallback=spec.get("fallback"),
+            encoding_model=spec.get("encoding_model"), num_jitters=spec.get("num_jitters"),
+            model_version=spec.get("model_version")
+        )
+
+    @staticmethod
+    def load(image_path, timings=None):
+        start = time.perf_counter()
+        image = face_recognition.load_image_file(image_path)
+        if timings is not None:
+            timings["load_ms"] = (time.perf_counter() - start) * 1000
+        return image
+
+    def detect(self, image, timings=None, tiled=False):
+        """
+        Face boxes in image. tiled is for high-resolution crowd and camera
+        frames; enrolment photos are always detected whole, so stored
+        embeddings never come from a box cut by a tile edge.
+        """
+        start = time.perf_counter()
+        locations = self.detector.detect(image, tiled)
+        detector = self.detector.name
+        if not locations and self.fallback is not None:
+            locations = self.fallback.detect(image, tiled)
+            detector = self.fallback.name
+        if timings is not None:
+            timings["detect_ms"] = (time.perf_counter() - start) * 1000
+            timings["detector"] = detector
+        return locations
+
+    def encode(self, image, locations, timings=None):
+        """
+        Encode already-detected faces; never re-runs detection.
+        """
+        return self.encode_with_landmarks(image, locations, timings)[0]
+
+    def encode_with_landmarks(self, image, locations, timings=None, with_chips=False):
+        """
+        Like encode(), but also returns the landmark points used to align
+        each face, as lists of (x, y). With with_chips, the aligned face
+        chips are cut once, encoded, and returned as a third list.
+        """
+        start = time.perf_counter()
+        encodings = []
+        landmarks = []
+        chips = []
+        if locations:
+            # Same steps as face_recognition.face_encodings, keeping the shapes
+            shapes = face_recognition_api._raw_face_landmarks(image, locations, self.encoding_model)
+            for shape in shapes:
+                landmarks.append([(p.x, p.y) for p in shape.parts()])
+                if with_chips:
+                    chips.append(dlib.get_face_chip(image, shape, size=CHIP_SIZE, padding=CHIP_PADDING))
+                else:
+                    encodings.append(np.array(
+                        face_recognition_api.face_encoder.compute_face_descriptor(image, shape, self.num_jitters)
+                    ))
+            if with_chips:
+                encodings = self.encode_chips(chips)
+        if timings is not None:
+            timings["encode_ms"] = (time.perf_counter() - start) * 1000
+        if with_chips:
+            return encodings, landmarks, chips
+        return encodings, landmarks
+
+    def encode_chips(self, chips):
+        """
+        Encode aligned face chips directly, skipping image decode, detection
+        and landmarking. Chips must come from a pipeline with the same
+        detection_version.
+        """
+        if not len(chips):
+            return []
+        descriptors = face_recognition_api.face_encoder.compute_face_descriptor(list(chips), self.num_jitters)
+        return [np.array(d) for d in descriptors]
+
+    def process(self, image_or_path, with_chips=False):
+        """
+        Full pipeline on a path or an RGB array, with per-stage timings.
+        """
+        timings = {}
+        if isinstance(image_or_path, (str, os.PathLike)):
+            image = self.load(str(image_or_path), timings)
+        else:
+            image = image_or_path
+        locations = self.detect(image, timings)
+        if with_chips:
+            encodings, landmarks, chips = self.encode_with_landmarks(image, locations, timings, with_chips=True)
+        else:
+            (encodings, landmarks), chips = self.encode_with_landmarks(image, locations, timings), None
+        return PipelineResult(image, locations, encodings, timings, timings.get("detector"), landmarks, chips)
+
+
+_default_pipeline = None
+_spec_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_pipeline(spec=None):
+    """
+    Process-wide pipeline built from Config, or from a stored spec (e.g. the
+    live pipeline recorded in the gallery meta document). Pipelines are
+    cached per spec.
+    """
+    global _default_pipeline
+    if spec is None:
+        if _default_pipeline is None:
+            _default_pipeline = FacePipeline()
+        return _default_pipeline
+
+    key = tuple(sorted(spec.items()))
+    pipeline = _spec_pipelines.get(key)
+    if pipeline is None:
+        with _pipelines_lock:
+            pipeline = _spec_pipelines.get(key)
+            if pipeline is None:
+                pipeline = FacePipeline.from_spec(spec)
+                _spec_pipelines[key] = pipeline
+    return pipeline
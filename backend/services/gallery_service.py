@@ -0,0 +1,294 @@
+import threading
+import time
+import numpy as np
+from db import get_db
+from config import Config
+from services.face_pipeline import get_pipeline
+
+EMBEDDING_DIM = 128
+GALLERY_PROJECTION = {
+    "_id": 0, "roll_no": 1, "name": 1, "department": 1, "section": 1,
+    "threshold": 1, "face.embedding": 1, "face.embedding_version": 1,
+    "face.next.version": 1, "face.next.embedding": 1
+}
+
+
+class Gallery:
+    """
+    Immutable in-memory snapshot of every matchable student embedding.
+
+    Embeddings live in one contiguous float32 matrix so a 1:N search is a
+    single vectorised distance computation instead of a Python loop.
+    """
+
+    def __init__(self, version, matrix, students, pipeline_spec=None):
+        self.version = version
+        self.matrix = matrix
+        self.students = students
+        # Pipeline that produced these vectors (None = the Config-built one);
+        # captures must be encoded with the same one to be comparable
+        self.pipeline_spec = pipeline_spec
+        # Snapshot generation whose shared mapping backs matrix; None for a
+        # private copy (a Mongo load, or a snapshot plus a delta)
+        self.generation = None
+        self.roll_index = {s["roll_no"]: i for i, s in enumerate(students)}
+        self._departments = np.array([s.get("department") or "" for s in students], dtype=object)
+        self._sections = np.array([s.get("section") or "" for s in students], dtype=object)
+        self._subsets = {}
+
+    def __len__(self):
+        return len(self.students)
+
+    def subset(self, department=None, section=None):
+        """
+        Row indices, candidate matrix and squared norms for a dept/section
+        filter, cached per gallery version.
+        """
+        key = ((department or "").upper(), (section or "").upper())
+        cached = self._subsets.get(key)
+        if cached is None:
+            mask = np.ones(len(self.students), dtype=bool)
+            if key[0]:
+                mask &= self._departments == key[0]
+            if key[1]:
+                mask &= self._sections == key[1]
+            indices = np.flatnonzero(mask)
+            # Unfiltered searches use the matrix as-is (no copy, keeps mmap-backed galleries lazy)
+            candidates = self.matrix if len(indices) == len(self.students) else self.matrix[indices]
+            sq_norms = np.einsum("ij,ij->i", candidates, candidates)
+            cached = (indices, candidates, sq_norms)
+            self._subsets[key] = cached
+        return cached
+
+    def search(self, encodings, department=None, section=None):
+        """
+        Nearest gallery row for each query encoding.
+
+        Returns a list of (student, distance) tuples; student is None when the
+        filtered gallery is empty.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        indices, candidates, sq_norms = self.subset(department, section)
+        if len(indices) == 0:
+            return [(None, float("inf"))] * len(queries)
+
+        # ||c - q||^2 = ||c||^2 - 2 c.q + ||q||^2, one BLAS call for the whole batch
+        sq_dist = sq_norms[:, None] - 2.0 * (candidates @ queries.T)
+        sq_dist += np.einsum("ij,ij->i", queries, queries)[None, :]
+        best = np.argmin(sq_dist, axis=0)
+        distances = np.sqrt(np.maximum(sq_dist[best, np.arange(len(queries))], 0.0))
+        return [
+            (self.students[indices[b]], float(d))
+            for b, d in zip(best, distances)
+        ]
+
+    def top_k(self, encodings, k=1, department=None, section=None):
+        """
+        Up to k nearest (student, distance) pairs per query encoding, closest first.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        indices, candidates, sq_norms = self.subset(department, section)
+        if len(indices) == 0:
+            return [[] for _ in range(len(queries))]
+
+        k = min(k, len(indices))
+        sq_dist = sq_norms[:, None] - 2.0 * (candidates @ queries.T)
+        sq_dist += np.einsum("ij,ij->i", queries, queries)[None, :]
+        results = []
+        for col in range(len(queries)):
+            column = sq_dist[:, col]
+            nearest = np.argpartition(column, k - 1)[:k] if k < len(column) else np.arange(len(column))
+            nearest = nearest[np.argsort(column[nearest])]
+            results.append([
+                (self.students[indices[i]], float(np.sqrt(max(column[i], 0.0))))
+                for i in nearest
+            ])
+        return results
+
+    def get(self, roll_no):
+        """
+        Point lookup of a single student's metadata and embedding.
+        """
+        idx = self.roll_index.get(roll_no)
+        if idx is None:
+            return None, None
+        return self.students[idx], self.matrix[idx]
+
+
+class GalleryService:
+    """
+    Process-wide cache of the match gallery.
+
+    Writers call bump_version() after changing any embedding; readers only
+    re-check the version every GALLERY_REFRESH_SECONDS so the hot path never
+    touches Mongo.
+
+    The same meta document names the live embedding pipeline. Changing it
+    and the version in one update is what switches every worker to a
+    re-embedded gallery at once (see ReembedService).
+    """
+    _gallery = None
+    _checked_at = 0.0
+    _lock = threading.Lock()
+    _spec = None
+    _version = None
+    _spec_checked_at = 0.0
+
+    @staticmethod
+    def _meta():
+        db = get_db()
+        doc = db.meta.find_one({"_id": "gallery"}, {"version": 1, "pipeline": 1}) or {}
+        return doc.get("version", 0), doc.get("pipeline")
+
+    @staticmethod
+    def current_version():
+        return GalleryService._meta()[0]
+
+    @staticmethod
+    def live_pipeline_spec():
+        """
+        Spec of the live embedding pipeline (None = built from Config),
+        re-read at most every GALLERY_REFRESH_SECONDS.
+        """
+        GalleryService._refresh_meta()
+        return GalleryService._spec
+
+    @staticmethod
+    def known_version():
+        """
+        Gallery version as last seen by this process, re-read at most every
+        GALLERY_REFRESH_SECONDS. Cheap enough for per-request cache checks.
+        """
+        GalleryService._refresh_meta()
+        return GalleryService._version
+
+    @staticmethod
+    def _refresh_meta():
+        now = time.monotonic()
+        if now - GalleryService._spec_checked_at >= Config.GALLERY_REFRESH_SECONDS:
+            GalleryService._version, GalleryService._spec = GalleryService._meta()
+            GalleryService._spec_checked_at = now
+
+    @staticmethod
+    def live_pipeline():
+        """
+        Pipeline every stored embedding is currently written with.
+        """
+        return get_pipeline(GalleryService.live_pipeline_spec())
+
+    @staticmethod
+    def bump_version():
+        db = get_db()
+        db.meta.update_one({"_id": "gallery"}, {"$inc": {"version": 1}}, upsert=True)
+        # This process sees its own write on the next known_version()
+        GalleryService._spec_checked_at = 0.0
+
+    @staticmethod
+    def invalidate():
+        with GalleryService._lock:
+            GalleryService._gallery = None
+            GalleryService._checked_at = 0.0
+            GalleryService._spec_checked_at = 0.0
+
+    @staticmethod
+    def get_gallery():
+        gallery = GalleryService._gallery
+        now = time.monotonic()
+        if gallery is not None and now - GalleryService._checked_at < Config.GALLERY_REFRESH_SECONDS:
+            return gallery
+
+        with GalleryService._lock:
+            gallery = GalleryService._gallery
+            if gallery is not None and now - GalleryService._checked_at < Config.GALLERY_REFRESH_SECONDS:
+                return gallery
+
+            version, spec = GalleryService._meta()
+            if gallery is None or gallery.version != version:
+                gallery = GalleryService._load_snapshot(version, spec) or GalleryService._load(version, pipeline_spec=spec)
+                GalleryService._gallery = gallery
+            elif gallery.generation is None and Config.GALLERY_SNAPSHOT_DIR:
+                # Built privately because the exporter hadn't published this
+                # version yet; switch to the shared mapping once it has
+                shared = GalleryService._load_snapshot(version, spec, shared_only=True)
+                if shared is not None:
+                    gallery = GalleryService._gallery = shared
+            GalleryService._checked_at = now
+        return gallery
+
+    @staticmethod
+    def _load_snapshot(version, spec, shared_only=False):
+        """
+        Attach to the gallery published by the snapshot exporter, if any, so
+        neither boot nor a version change waits on a full Mongo scan and all
+        workers share one copy of the matrix. With shared_only, only a
+        snapshot of exactly this version is used.
+        """
+        if not Config.GALLERY_SNAPSHOT_DIR:
+            return None
+        from services.gallery_snapshot import load_snapshot
+        try:
+            return load_snapshot(version, spec, shared_only=shared_only)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring gallery snapshot: {e}")
+            return None
+
+    @staticmethod
+    def load_partition(department, version=None):
+        """
+        Gallery restricted to one department, for shard processes.
+        """
+        current, spec = GalleryService._meta()
+        return GalleryService._load(current if version is None else version,
+                                    {"department": department.upper()}, spec)
+
+    @staticmethod
+    def list_departments():
+        db = get_db()
+        return sorted(d for d in db.students.distinct(
+            "department", {"face.embedding": {"$exists": True, "$ne": []}}
+        ) if d)
+
+    @staticmethod
+    def _row(doc, live_version):
+        """
+        Gallery metadata and embedding for one student document, or
+        (doc, None) if it has nothing matchable for the live pipeline.
+        During a migration a student may also carry a face.next vector; it
+        is used instead once its version is the live one.
+        """
+        face = doc.pop("face", {})
+        next_face = face.get("next") or {}
+        if next_face.get("version") == live_version and next_face.get("embedding"):
+            embedding = next_face["embedding"]
+        elif face.get("embedding_version") in (None, live_version):
+            # Untagged embeddings predate versioning and are whatever was live
+            embedding = face.get("embedding")
+        else:
+            return doc, None
+        if not embedding or len(embedding) != EMBEDDING_DIM or not doc.get("roll_no"):
+            return doc, None
+        return doc, embedding
+
+    @staticmethod
+    def _load(version, filters=None, pipeline_spec=None):
+        """
+        Build a Gallery from every student with an embedding produced by the
+        live pipeline.
+        """
+        db = get_db()
+        live_version = get_pipeline(pipeline_spec).version
+        query = {"face.embedding": {"$exists": True, "$ne": []}}
+        query.update(filters or {})
+        cursor = db.students.find(query, GALLERY_PROJECTION)
+
+        students = []
+        rows = []
+        for doc in cursor:
+            student, embedding = GalleryService._row(doc, live_version)
+            if embedding is None:
+                continue
+            rows.append(embedding)
+            students.append(student)
+
+        matrix = np.asarray(rows, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        return Gallery(version, matrix, students, pipeline_spec)
@@ -0,0 +1,175 @@
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+from db import get_db
+from config import Config
+from services.face_pipeline import get_pipeline
+from services.gallery_service import EMBEDDING_DIM, GALLERY_PROJECTION, Gallery, GalleryService
+
+SNAPSHOT_FORMAT = 1
+HEADER_FILE = "gallery.json"
+STUDENT_FIELDS = ("roll_no", "name", "department", "section", "threshold")
+# Re-read students changed slightly before the export started, in case a
+# writer's clock or its two-step centroid update straddled the export
+DELTA_OVERLAP = timedelta(seconds=60)
+# Generations kept on disk: the live one plus the one before it, for
+# readers that read the old header just before the swap
+KEEP_GENERATIONS = 2
+
+# (generation, Gallery) this process has mapped
+_mapped = (None, None)
+
+
+def _write_file(path, write):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_snapshot(snapshot_dir=None):
+    """
+    Publish the current gallery to snapshot_dir as a new generation.
+
+    A generation is a raw float32 gallery-<gen>.npy matrix plus a
+    gallery-<gen>.json sidecar with the student metadata as columns. The
+    small gallery.json header names the live generation along with its
+    gallery version, the pipeline it was encoded with and the export time.
+    The header is replaced last, so readers see either the old generation
+    or the complete new one, never a half-written matrix.
+    """
+    snapshot_dir = Path(snapshot_dir or Config.GALLERY_SNAPSHOT_DIR)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    exported_at = datetime.utcnow()
+    version, spec = GalleryService._meta()
+    gallery = GalleryService._load(version, pipeline_spec=spec)
+
+    generation = f"{version}-{uuid.uuid4().hex[:8]}"
+    matrix = np.ascontiguousarray(gallery.matrix, dtype=np.float32)
+    _write_file(snapshot_dir / f"gallery-{generation}.npy", lambda f: np.save(f, matrix))
+    columns = {field: [s.get(field) for s in gallery.students] for field in STUDENT_FIELDS}
+    _write_file(snapshot_dir / f"gallery-{generation}.json",
+                lambda f: f.write(json.dumps(columns, separators=(",", ":")).encode()))
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "generation": generation,
+        "version": version,
+        "pipeline": spec,
+        "pipeline_version": get_pipeline(spec).version,
+        "exported_at": exported_at.isoformat(),
+        "rows": len(gallery),
+    }
+    _write_file(snapshot_dir / HEADER_FILE, lambda f: f.write(json.dumps(header).encode()))
+
+    # Unlinking is safe for workers still mapping an old generation: the
+    # pages live until they unmap it
+    generations = sorted(snapshot_dir.glob("gallery-*.npy"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in generations[KEEP_GENERATIONS:]:
+        if old.stem != f"gallery-{generation}":
+            old.unlink(missing_ok=True)
+            old.with_suffix(".json").unlink(missing_ok=True)
+    return {"version": version, "rows": len(gallery), "generation": generation}
+
+
+def _apply_delta(base, docs, version, spec):
+    """
+    New Gallery from base with these re-read student documents replacing,
+    adding or dropping their rows.
+    """
+    live_version = get_pipeline(spec).version
+    changed = {}
+    for doc in docs:
+        student, embedding = GalleryService._row(doc, live_version)
+        if student.get("roll_no"):
+            changed[student["roll_no"]] = (student, embedding)
+    if not changed:
+        return Gallery(version, base.matrix, base.students, spec)
+
+    keep = [i for i, s in enumerate(base.students) if s["roll_no"] not in changed]
+    added = [(s, e) for s, e in changed.values() if e is not None]
+    matrix = np.concatenate([
+        base.matrix[keep],
+        np.asarray([e for _, e in added], dtype=np.float32).reshape(-1, EMBEDDING_DIM),
+    ])
+    students = [base.students[i] for i in keep] + [s for s, _ in added]
+    return Gallery(version, matrix, students, spec)
+
+
+def _read_header(snapshot_dir):
+    try:
+        with open(snapshot_dir / HEADER_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _map_generation(snapshot_dir, header, spec):
+    """
+    Gallery over a generation's matrix, mapped read-only. Every worker maps
+    the same file, so the kernel holds one copy of the matrix for all of
+    them. Reused while the generation doesn't change.
+    """
+    global _mapped
+    generation = header["generation"]
+    if _mapped[0] == generation:
+        return _mapped[1]
+    matrix = np.load(snapshot_dir / f"gallery-{generation}.npy", mmap_mode="r")
+    if matrix.shape != (header["rows"], EMBEDDING_DIM):
+        return None
+    with open(snapshot_dir / f"gallery-{generation}.json") as f:
+        columns = json.load(f)
+    students = [
+        {field: value for field, value in zip(STUDENT_FIELDS, values) if value is not None}
+        for values in zip(*(columns[field] for field in STUDENT_FIELDS))
+    ]
+    base = Gallery(header["version"], matrix, students, spec)
+    base.generation = generation
+    _mapped = (generation, base)
+    return base
+
+
+def load_snapshot(version, spec, snapshot_dir=None, shared_only=False):
+    """
+    Gallery for `version` built from the published snapshot plus the
+    students changed in Mongo since it was exported, or None if there is no
+    usable snapshot. When the snapshot is current the matrix is the shared
+    mapping itself; otherwise the delta is applied to a private copy
+    (generation None), which GalleryService swaps for the shared mapping
+    once the exporter publishes this version. shared_only returns None
+    instead of building a private copy.
+    """
+    snapshot_dir = Path(snapshot_dir or Config.GALLERY_SNAPSHOT_DIR)
+    base = None
+    # The exporter may swap generations between reading the header and
+    # mapping its files; the second read then sees the new one
+    for _ in range(2):
+        header = _read_header(snapshot_dir)
+        if header is None:
+            return None
+        if header.get("format") != SNAPSHOT_FORMAT or header.get("version", 0) > version:
+            return None
+        if header.get("pipeline_version") != get_pipeline(spec).version:
+            # Exported before a re-embedding switch
+            return None
+        if shared_only and header.get("version") != version:
+            return None
+        try:
+            base = _map_generation(snapshot_dir, header, spec)
+            break
+        except FileNotFoundError:
+            continue
+    if base is None:
+        return None
+    if header["version"] == version:
+        return base
+
+    since = datetime.fromisoformat(header["exported_at"]) - DELTA_OVERLAP
+    docs = get_db().students.find({"updated_at": {"$gte": since}}, GALLERY_PROJECTION)
+    return _apply_delta(base, docs, version, spec)
@@ -0,0 +1,263 @@
+import os
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+from db import get_db
+from config import Config
+from services.embedding_cache import EmbeddingCache
+from services.embedding_service import FaceEmbeddingService
+from services.face_pipeline import FacePipeline, get_pipeline
+from services.gallery_service import GalleryService
+from services.student_service import StudentService
+
+REEMBED_META_ID = "reembed"
+HAS_EMBEDDING = {"face.embedding": {"$exists": True, "$ne": []}}
+
+
+class ReembedService:
+    """
+    Moves the whole gallery to a new embedding pipeline (model, detector,
+    jitters) without taking matching offline.
+
+    start() records the target pipeline. run() re-encodes every student's
+    images with it at a throttled rate and stores the result beside the live
+    one as face.next, so matching keeps using the current vectors. Once every
+    student has a face.next, switch() changes the live pipeline and the
+    gallery version in a single meta update: every worker reloads a gallery
+    built from the new vectors and encodes captures with the new pipeline
+    from the same moment. face.next is then promoted into face.* in batches.
+
+    Enrolment writers always use the live pipeline and drop face.next, so a
+    student changed mid-run is simply picked up again.
+    """
+
+    @staticmethod
+    def _job():
+        return get_db().meta.find_one({"_id": REEMBED_META_ID})
+
+    @staticmethod
+    def start(target_spec):
+        """
+        Begin re-embedding towards target_spec (a FacePipeline.spec dict;
+        missing keys fall back to Config).
+        """
+        db = get_db()
+        target = FacePipeline.from_spec(target_spec)
+        live = GalleryService.live_pipeline()
+        if target.version == live.version:
+            raise ValueError(f"{target.version} is already the live pipeline")
+
+        # Untagged embeddings predate versioning; pin them to the current
+        # pipeline so they stop counting as live once the switch happens
+        db.students.update_many(
+            {**HAS_EMBEDDING, "face.embedding_version": {"$exists": False}},
+            {"$set": {"face.embedding_version": live.version}}
+        )
+        job = {
+            "target": target.spec,
+            "target_version": target.version,
+            "from_version": live.version,
+            "status": "running",
+            "processed": 0,
+            "failed": 0,
+            "started_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+        }
+        db.meta.replace_one({"_id": REEMBED_META_ID}, {"_id": REEMBED_META_ID, **job}, upsert=True)
+        return job
+
+    @staticmethod
+    def status():
+        db = get_db()
+        job = ReembedService._job()
+        live = GalleryService.live_pipeline()
+        total = db.students.count_documents(HAS_EMBEDDING)
+        report = {"live_version": live.version, "total": total}
+        if not job:
+            return {**report, "status": "idle"}
+
+        target_version = job["target_version"]
+        done = db.students.count_documents({**HAS_EMBEDDING, "face.next.version": target_version})
+        failed = db.students.count_documents({**HAS_EMBEDDING, "face.next.version": target_version,
+                                              "face.next.failed": True})
+        return {
+            **report,
+            "status": job["status"],
+            "target_version": target_version,
+            "done": done,
+            "failed": failed,
+            "coverage": round(done / total, 4) if total else 1.0,
+            "started_at": job["started_at"].isoformat(),
+            "updated_at": job["updated_at"].isoformat(),
+        }
+
+    @staticmethod
+    def _next_face(cache, student, version, throttle):
+        roll_no, student_dir, images = FaceEmbeddingService._student_images(student)
+        filenames = []
+        encodings = []
+        for image_path in images or []:
+            throttle()
+            try:
+                result = cache.process(image_path)
+            except Exception as e:
+                print(f"Error processing {image_path}: {e}")
+                continue
+            if result.encodings:
+                filenames.append(os.path.basename(image_path))
+                encodings.append(result.encodings[0])
+
+        if not encodings:
+            print(f"No valid encodings for {roll_no} with {version} in {student_dir}")
+            return {"version": version, "embedding": [], "failed": True}
+        face = StudentService.face_document(filenames, encodings, version)
+        return {
+            "version": version,
+            "embedding": face["embedding"],
+            "embedding_sum": face["embedding_sum"],
+            "embedding_count": face["embedding_count"],
+            "encodings": face["encodings"],
+        }
+
+    @staticmethod
+    def run(images_per_second=None, batch_size=50, auto_switch=True):
+        """
+        Re-encode every student without a face.next for the target pipeline,
+        at most images_per_second images per second. Switches over when
+        every student is covered and none failed (unless auto_switch=False).
+        """
+        db = get_db()
+        job = ReembedService._job()
+        if not job or job["status"] != "running":
+            raise ValueError("No re-embedding job is running; start one first")
+
+        target_version = job["target_version"]
+        rate = Config.REEMBED_IMAGES_PER_SECOND if images_per_second is None else images_per_second
+        cache = EmbeddingCache(pipeline=get_pipeline(job["target"]))
+        started = time.monotonic()
+        images = 0
+
+        def throttle():
+            nonlocal images
+            images += 1
+            if rate > 0:
+                delay = started + images / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+        query = {**HAS_EMBEDDING, "face.next.version": {"$ne": target_version}}
+        totals = {"processed": job.get("processed", 0), "failed": job.get("failed", 0)}
+        print(f"Re-embedding {db.students.count_documents(query)} student(s) with {target_version}"
+              + (f" at {rate:g} img/s" if rate > 0 else ""))
+        try:
+            # Students edited during a pass drop their face.next and are
+            # picked up by the next one
+            while True:
+                operations = []
+                cursor = db.students.find(
+                    query, {"roll_no": 1, "student_id": 1, "department": 1, "section": 1, "updated_at": 1}
+                ).sort("_id", 1).batch_size(batch_size)
+                for student in cursor:
+                    next_face = ReembedService._next_face(cache, student, target_version, throttle)
+                    # Only store it if nobody re-enrolled the student meanwhile
+                    operations.append(UpdateOne(
+                        {"_id": student["_id"], "updated_at": student.get("updated_at")},
+                        {"$set": {"face.next": next_face}}
+                    ))
+                    totals["processed"] += 1
+                    totals["failed"] += 1 if next_face.get("failed") else 0
+                    if len(operations) >= batch_size:
+                        ReembedService._flush(operations, totals, cache)
+                        print(f"  {totals['processed']} processed, {totals['failed']} failed, "
+                              f"{images / max(time.monotonic() - started, 1e-6):.1f} img/s", flush=True)
+                if operations:
+                    ReembedService._flush(operations, totals, cache)
+                elif not db.students.count_documents(query):
+                    break
+        finally:
+            cache.close()
+
+        status = ReembedService.status()
+        print(f"Coverage {status['coverage']:.1%} ({status['done']}/{status['total']}), {status['failed']} failed")
+        if auto_switch and status["done"] == status["total"] and not status["failed"]:
+            ReembedService.switch()
+        elif status["failed"]:
+            print("Not switching automatically: some students have no encoding with the new pipeline "
+                  "(fix their images, or switch with --force to re-enrol them afterwards)")
+        return ReembedService.status()
+
+    @staticmethod
+    def _flush(operations, totals, cache):
+        db = get_db()
+        cache.flush()
+        db.students.bulk_write(operations, ordered=False)
+        operations.clear()
+        db.meta.update_one(
+            {"_id": REEMBED_META_ID},
+            {"$set": {**totals, "updated_at": datetime.utcnow()}}
+        )
+
+    @staticmethod
+    def switch(force=False, batch_size=500):
+        """
+        Make the target pipeline live, then promote face.next into face.*.
+        Students still without a usable face.next are re-embedded afterwards
+        with the new pipeline (and are unmatchable until then).
+        """
+        db = get_db()
+        job = ReembedService._job()
+        if not job or job["status"] != "running":
+            raise ValueError("No re-embedding job is running")
+        status = ReembedService.status()
+        if not force and (status["done"] < status["total"] or status["failed"]):
+            raise ValueError(f"Only {status['done'] - status['failed']}/{status['total']} students re-embedded; "
+                             "finish the run or pass force=True")
+
+        target, target_version = job["target"], job["target_version"]
+        # The switch itself: one document, one write
+        db.meta.update_one({"_id": "gallery"}, {"$set": {"pipeline": target}, "$inc": {"version": 1}}, upsert=True)
+        GalleryService.invalidate()
+        print(f"Live pipeline is now {target_version}")
+
+        promoted = 0
+        operations = []
+        cursor = db.students.find(
+            {"face.next.version": target_version, "face.next.failed": {"$ne": True}},
+            {"face.next": 1}
+        ).batch_size(batch_size)
+        for student in cursor:
+            next_face = student["face"]["next"]
+            operations.append(UpdateOne(
+                {"_id": student["_id"], "face.next.version": target_version},
+                {"$set": {
+                    "face.embedding": next_face["embedding"],
+                    "face.embedding_sum": next_face["embedding_sum"],
+                    "face.embedding_count": next_face["embedding_count"],
+                    "face.encodings": next_face["encodings"],
+                    "face.embedding_version": target_version,
+                }, "$inc": {"face.revision": 1}, "$unset": {"face.next": ""}}
+            ))
+            if len(operations) >= batch_size:
+                promoted += db.students.bulk_write(operations, ordered=False).modified_count
+                operations.clear()
+        if operations:
+            promoted += db.students.bulk_write(operations, ordered=False).modified_count
+
+        stragglers = [
+            doc["roll_no"] for doc in db.students.find(
+                {**HAS_EMBEDDING, "face.embedding_version": {"$ne": target_version}}, {"roll_no": 1}
+            ) if doc.get("roll_no")
+        ]
+        refreshed = {"success": 0, "failed": 0}
+        for start in range(0, len(stragglers), batch_size):
+            result = FaceEmbeddingService.refresh_students(stragglers[start:start + batch_size])
+            refreshed = {k: refreshed[k] + result[k] for k in refreshed}
+
+        db.meta.update_one(
+            {"_id": REEMBED_META_ID},
+            {"$set": {"status": "switched", "switched_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+        )
+        GalleryService.bump_version()
+        print(f"Promoted {promoted} student(s); re-embedded {refreshed['success']} straggler(s), "
+              f"{refreshed['failed']} without a usable image")
+        return {"version": target_version, "promoted": promoted, "stragglers": refreshed}
@@ -0,0 +1,280 @@
+import hashlib
+import heapq
+import multiprocessing
+import threading
+import time
+import numpy as np
+from config import Config
+from services.gallery_service import EMBEDDING_DIM, Gallery, GalleryService
+
+
+def _shard_main(conn):
+    """
+    Matcher process loop. Holds one Gallery per assigned department and
+    answers commands sent by the coordinator over a Pipe. Every reply
+    echoes the sequence number of its request.
+    """
+    partitions = {}
+    while True:
+        try:
+            seq, command, payload = conn.recv()
+        except EOFError:
+            break
+
+        try:
+            if command == "load":
+                department, version, matrix, students = payload
+                partitions[department] = Gallery(version, matrix, students)
+                reply = len(students)
+            elif command == "drop":
+                reply = partitions.pop(payload, None) is not None
+            elif command == "export":
+                gallery = partitions[payload]
+                reply = (gallery.version, gallery.matrix, gallery.students)
+            elif command == "search":
+                encodings, departments, section, k = payload
+                merged = [[] for _ in range(len(encodings))]
+                for department in departments:
+                    gallery = partitions.get(department)
+                    if gallery is None:
+                        continue
+                    for i, hits in enumerate(gallery.top_k(encodings, k, section=section)):
+                        merged[i].extend(hits)
+                reply = [heapq.nsmallest(k, hits, key=lambda h: h[1]) for hits in merged]
+            elif command == "stats":
+                reply = {d: len(g) for d, g in partitions.items()}
+            elif command == "stop":
+                conn.send((seq, "ok", True))
+                break
+            else:
+                raise ValueError(f"Unknown shard command: {command}")
+            conn.send((seq, "ok", reply))
+        except Exception as e:
+            conn.send((seq, "error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class MatcherShard:
+    """
+    Coordinator-side handle for one matcher process.
+    """
+
+    def __init__(self, index, context):
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_shard_main, args=(child_conn,), daemon=True,
+                                       name=f"matcher-shard-{index}")
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self._seq = 0
+
+    def send(self, command, payload=None):
+        """
+        Send a request; returns its sequence number for receive().
+        """
+        self._seq += 1
+        self.conn.send((self._seq, command, payload))
+        return self._seq
+
+    def receive(self, seq):
+        """
+        Reply to request seq. Replies to older requests whose caller gave up
+        (e.g. a search interrupted mid-gather) are read and discarded, so the
+        pipe never falls out of step.
+        """
+        while True:
+            reply_seq, status, reply = self.conn.recv()
+            if reply_seq == seq:
+                break
+        if status != "ok":
+            raise RuntimeError(f"Shard {self.index}: {reply}")
+        return reply
+
+    def call(self, command, payload=None):
+        with self.lock:
+            return self.receive(self.send(command, payload))
+
+
+class ShardCoordinator:
+    """
+    Scatter-gather matching tier.
+
+    Department partitions of the gallery are spread over local matcher
+    processes. A query is fanned out to every shard owning a relevant
+    department in parallel and the per-shard top-k lists are merged.
+
+    The coordinator lives in each web worker, so every gunicorn worker
+    starts its own MATCH_SHARDS processes holding a full copy of the
+    gallery: memory is roughly workers x (gallery + per-process overhead),
+    and each worker re-reads the gallery from Mongo on a version bump. Run
+    few workers with more threads when sharding is on. Only departments
+    whose contents changed are re-sent to their shard.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, num_shards, start_method=None):
+        context = multiprocessing.get_context(start_method or Config.MATCH_SHARD_START_METHOD)
+        self.shards = [MatcherShard(i, context) for i in range(num_shards)]
+        self.assignment = {}   # department -> shard index
+        self.sizes = {}        # department -> number of embeddings
+        self.digests = {}      # department -> digest of the loaded partition
+        self.version = None
+        self.pipeline_spec = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def instance():
+        """
+        Per-process coordinator when MATCH_SHARDS > 0, loaded from Mongo.
+        """
+        with ShardCoordinator._instance_lock:
+            if ShardCoordinator._instance is None:
+                coordinator = ShardCoordinator(Config.MATCH_SHARDS)
+                coordinator.load_from_db()
+                ShardCoordinator._instance = coordinator
+            return ShardCoordinator._instance
+
+    def load_partition(self, department, version, matrix, students, shard_index=None):
+        """
+        Place one department partition on a shard (least loaded by default).
+        """
+        department = department.upper()
+        with self._lock:
+            if shard_index is None:
+                shard_index = self.assignment.get(department)
+            if shard_index is None:
+                shard_index = min(range(len(self.shards)), key=self._shard_load)
+            self.shards[shard_index].call("load", (department, version, matrix, students))
+
+            previous = self.assignment.get(department)
+            self.assignment[department] = shard_index
+            self.sizes[department] = len(students)
+            self.digests[department] = self._digest(matrix, students)
+            if previous is not None and previous != shard_index:
+                self.shards[previous].call("drop", department)
+
+    def load_from_db(self):
+        with self._lock:
+            version, spec = GalleryService._meta()
+            departments = GalleryService.list_departments()
+            for department in departments:
+                gallery = GalleryService.load_partition(department, version)
+                if self.digests.get(department) == self._digest(gallery.matrix, gallery.students):
+                    continue
+                self.load_partition(department, version, gallery.matrix, gallery.students)
+            for department in set(self.assignment) - set(departments):
+                self.shards[self.assignment.pop(department)].call("drop", department)
+                self.sizes.pop(department, None)
+                self.digests.pop(department, None)
+            self.version = version
+            self.pipeline_spec = spec
+            self._checked_at = time.monotonic()
+
+    def refresh(self):
+        """
+        Reload partitions when the gallery version has moved on.
+        """
+        if time.monotonic() - self._checked_at < Config.GALLERY_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if GalleryService.current_version() != self.version:
+                self.load_from_db()
+            self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _digest(matrix, students):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        digest.update(repr(students).encode())
+        return digest.hexdigest()
+
+    def _shard_load(self, shard_index):
+        return sum(self.sizes[d] for d, s in self.assignment.items() if s == shard_index)
+
+    def search(self, encodings, department=None, section=None, k=1):
+        """
+        Fan a batch of encodings out to the relevant shards and merge their
+        top-k. Returns one list of (student, distance) per encoding.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        with self._lock:
+            if department:
+                departments = [department.upper()] if department.upper() in self.assignment else []
+            else:
+                departments = list(self.assignment)
+
+            by_shard = {}
+            for d in departments:
+                by_shard.setdefault(self.assignment[d], []).append(d)
+
+            # Shard locks are taken under the coordinator lock so a concurrent
+            # rebalance cannot drop a partition between planning and sending
+            shard_indices = sorted(by_shard)
+            locks = [self.shards[i].lock for i in shard_indices]
+            for lock in locks:
+                lock.acquire()
+
+        merged = [[] for _ in range(len(encodings))]
+        error = None
+        try:
+            # Scatter to every shard first so they search concurrently, then
+            # gather every reply, even after a failure, before raising
+            sent = []
+            for i in shard_indices:
+                try:
+                    sent.append((i, self.shards[i].send("search", (encodings, by_shard[i], section, k))))
+                except Exception as e:
+                    error = error or e
+            for i, seq in sent:
+                try:
+                    hits_per_query = self.shards[i].receive(seq)
+                except Exception as e:
+                    error = error or e
+                    continue
+                for j, hits in enumerate(hits_per_query):
+                    merged[j].extend(hits)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        if error is not None:
+            raise error
+
+        return [heapq.nsmallest(k, hits, key=lambda h: h[1]) for hits in merged]
+
+    def rebalance(self):
+        """
+        Greedy largest-first reassignment of departments to the least loaded
+        shard. Partitions are copied to their new shard before being dropped
+        from the old one, so searches keep working throughout.
+        """
+        with self._lock:
+            targets = {}
+            loads = [0] * len(self.shards)
+            for department in sorted(self.sizes, key=self.sizes.get, reverse=True):
+                shard_index = loads.index(min(loads))
+                targets[department] = shard_index
+                loads[shard_index] += self.sizes[department]
+
+            moved = []
+            for department, target in targets.items():
+                source = self.assignment[department]
+                if source == target:
+                    continue
+                version, matrix, students = self.shards[source].call("export", department)
+                self.load_partition(department, version, matrix, students, shard_index=target)
+                moved.append((department, source, target))
+            return moved
+
+    def stats(self):
+        return [shard.call("stats") for shard in self.shards]
+
+    def shutdown(self):
+        for shard in self.shards:
+            try:
+                shard.call("stop")
+            except Exception:
+                pass
+            shard.process.join(timeout=5)
@@ -1,11 +1,77 @@
+import os
+import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
+import numpy as np
+from pymongo import ReturnDocument
 from db import get_db
 from utils.normalization import to_plain_list
+from services.gallery_service import EMBEDDING_DIM, GALLERY_PROJECTION, GalleryService
+
+PROFILE_IMAGE_PROJECTION = {"_id": 0, "roll_no": 1, "department": 1, "section": 1, "face.image_filenames": 1}
+# Fields of a listed student unless ?fields= asks for others. Embeddings and
+# per-image encodings are never listed.
+LIST_FIELDS = ("roll_no", "name", "department", "section", "year", "contact_info", "threshold",
+               "violations_count", "late_count", "bunk_count", "dress_code_count",
+               "face.status", "created_at", "updated_at")
+LIST_EXTRA_FIELDS = ("face.image_filenames", "face.embedding_version", "face.embedding_count")
+
+# Violation counters summed over a filtered listing, see summarize_students()
+SUMMARY_FIELDS = ("violations_count", "late_count", "bunk_count", "dress_code_count")
 
 class StudentService:
+    # {filter key: (count or summary, monotonic time)}, see count_students()
+    _counts = {}
+    _counts_lock = threading.Lock()
+
+    # roll_no -> resolved profile photo, see profile_image()
+    _profile_images = OrderedDict()
+    _profile_images_version = None
+    _profile_images_lock = threading.Lock()
+
     @staticmethod
     def create_student(student_data):
         db = get_db()
+        student_data = StudentService.prepare_student(student_data)
+        result = db.students.insert_one(student_data)
+        if student_data["face"].get("embedding"):
+            GalleryService.bump_version()
+        return str(result.inserted_id)
+
+    @staticmethod
+    def create_students_bulk(students):
+        """
+        Insert many prepared student documents with one unordered insert_many.
+        Returns (inserted roll_nos, {roll_no: error}) - a duplicate roll_no
+        only fails its own row.
+        """
+        from pymongo.errors import BulkWriteError
+        db = get_db()
+        if not students:
+            return [], {}
+
+        errors = {}
+        try:
+            db.students.insert_many(students, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                roll_no = students[err["index"]]["roll_no"]
+                if err.get("code") == 11000:
+                    errors[roll_no] = f"Student with Roll Number {roll_no} is already registered."
+                else:
+                    errors[roll_no] = err.get("errmsg", "Insert failed")
+
+        inserted = [s["roll_no"] for s in students if s["roll_no"] not in errors]
+        if any(s["face"].get("embedding") for s in students if s["roll_no"] in inserted):
+            GalleryService.bump_version()
+        return inserted, errors
+
+    @staticmethod
+    def prepare_student(student_data):
+        """
+        Normalise a new student document and create its storage folder.
+        """
         from config import Config
         from pathlib import Path
         import os
@@ -55,12 +121,15 @@ class StudentService:
                     student_data["face"]["status"] = "active"
                 else:
                     student_data["face"]["status"] = "pending_image"
+            face = student_data["face"]
+            if "embedding_sum" not in face:
+                embedding = face.get("embedding") or []
+                face["embedding_count"] = 1 if embedding else 0
+                face["embedding_sum"] = list(embedding) if embedding else [0.0] * EMBEDDING_DIM
 
         student_data["created_at"] = datetime.utcnow()
         student_data["updated_at"] = datetime.utcnow()
-        
-        result = db.students.insert_one(student_data)
-        return str(result.inserted_id)
+        return student_data
 
     @staticmethod
     def get_students(filters=None):
@@ -70,6 +139,92 @@ class StudentService:
             student["_id"] = str(student["_id"])
         return students
 
+    @staticmethod
+    def list_filter(department=None, section=None, year=None, roll_prefixes=None):
+        """
+        Listing filter. roll_prefixes keeps roll numbers starting with any of
+        them (a batch, e.g. ["23BQ", "24BQ5A"]); anchored patterns use the
+        roll_no index.
+        """
+        query = {}
+        if department:
+            query["department"] = department.strip().upper()
+        if section:
+            query["section"] = section.strip().upper()
+        if year:
+            query["year"] = str(year).strip()
+        if roll_prefixes:
+            query["roll_no"] = {"$in": [re.compile("^" + re.escape(p.strip().upper())) for p in roll_prefixes]}
+        return query
+
+    @staticmethod
+    def list_students(query=None, after=None, limit=100, fields=None):
+        """
+        One page of students in roll_no order, starting after the roll_no
+        `after` (keyset pagination, so deep pages cost the same as the first).
+        Only `fields` (default LIST_FIELDS) are returned. Returns
+        (students, next cursor or None).
+        """
+        query = dict(query or {})
+        if after:
+            query["roll_no"] = {**query.get("roll_no", {}), "$gt": after}
+        projection = {"_id": 0, **{field: 1 for field in fields or LIST_FIELDS}, "roll_no": 1}
+        students = list(get_db().students.find(query, projection).sort("roll_no", 1).limit(limit + 1))
+        if len(students) > limit:
+            students = students[:limit]
+            return students, students[-1]["roll_no"]
+        return students, None
+
+    @staticmethod
+    def count_students(query=None, exact=False):
+        """
+        Number of students matching query. Unless exact, an unfiltered count
+        is the collection's metadata estimate and filtered counts are reused
+        for STUDENT_COUNT_CACHE_SECONDS.
+        """
+        db = get_db()
+        query = query or {}
+        if exact:
+            return db.students.count_documents(query)
+        if not query:
+            return db.students.estimated_document_count()
+        return StudentService._cached_count("count", query, lambda: db.students.count_documents(query))
+
+    @staticmethod
+    def summarize_students(query=None):
+        """
+        Sums of the SUMMARY_FIELDS counters over the students matching
+        query, reused for STUDENT_COUNT_CACHE_SECONDS like filtered counts.
+        """
+        query = query or {}
+
+        def summarize():
+            rows = list(get_db().students.aggregate([
+                {"$match": query},
+                {"$group": {"_id": None, **{field: {"$sum": f"${field}"} for field in SUMMARY_FIELDS}}},
+            ]))
+            return {field: rows[0][field] if rows else 0 for field in SUMMARY_FIELDS}
+
+        return StudentService._cached_count("summary", query, summarize)
+
+    @staticmethod
+    def _cached_count(kind, query, compute):
+        from config import Config
+        import time
+
+        # Filters can hold regexes and dicts, so key on their repr
+        key = repr((kind, sorted(query.items())))
+        now = time.monotonic()
+        cached = StudentService._counts.get(key)
+        if cached and now - cached[1] < Config.STUDENT_COUNT_CACHE_SECONDS:
+            return cached[0]
+        value = compute()
+        with StudentService._counts_lock:
+            if len(StudentService._counts) > 1024:
+                StudentService._counts.clear()
+            StudentService._counts[key] = (value, now)
+        return value
+
     @staticmethod
     def get_students_for_matching(department=None, section=None):
         """
@@ -84,37 +239,287 @@ class StudentService:
         return StudentService.get_students(query)
 
     @staticmethod
-    def update_student_face(roll_no, embedding, image_filename):
+    def get_student_for_matching(roll_no, live_version=None):
+        """
+        Indexed point lookup of one student's match metadata and embedding,
+        chosen for the live pipeline version as the gallery load does.
+        Returns (student, embedding) or (None, None).
+        """
         db = get_db()
+        doc = db.students.find_one(
+            {"roll_no": roll_no, "face.embedding": {"$exists": True, "$ne": []}},
+            GALLERY_PROJECTION
+        )
+        if not doc:
+            return None, None
+        live_version = live_version or GalleryService.live_pipeline().version
+        student, embedding = GalleryService._row(doc, live_version)
+        if embedding is None:
+            return None, None
+        return student, embedding
+
+    @staticmethod
+    def get_violation_counts(roll_nos):
+        """
+        Live violations_count for a handful of students in one indexed query.
+        """
+        db = get_db()
+        cursor = db.students.find(
+            {"roll_no": {"$in": list(roll_nos)}},
+            {"_id": 0, "roll_no": 1, "violations_count": 1}
+        )
+        return {doc["roll_no"]: doc.get("violations_count", 0) for doc in cursor}
+
+    @staticmethod
+    def profile_image_paths(roll_nos):
+        """
+        {roll_no: path of the profile photo (the last image)} for students
+        that have one, resolved in a single $in query.
+        """
+        db = get_db()
+        cursor = db.students.find({"roll_no": {"$in": list(roll_nos)}}, PROFILE_IMAGE_PROJECTION)
+        paths = {}
+        for doc in cursor:
+            path = StudentService._profile_image_path(doc)
+            if path is not None:
+                paths[doc["roll_no"]] = path
+        return paths
+
+    @staticmethod
+    def _profile_image_path(doc):
         from config import Config
         from pathlib import Path
-        
-        student = db.students.find_one({"roll_no": roll_no})
+
+        filenames = (doc.get("face") or {}).get("image_filenames") or []
+        if not doc.get("department") or not doc.get("section") or not filenames:
+            return None
+        return Path(Config.STORAGE_TRAINING) / doc["department"] / doc["section"] / doc["roll_no"] / filenames[-1]
+
+    @staticmethod
+    def profile_image(roll_no):
+        """
+        Resolved profile photo of a student: {"path": absolute path, "hash":
+        content hash for ETags, "variants": {}} or {"error": reason}.
+
+        Kept in an in-process LRU so a hot avatar costs neither a Mongo
+        lookup nor a stat. Every face write bumps the gallery version, which
+        empties it: at once in the writing process, and within
+        GALLERY_REFRESH_SECONDS in the others.
+        """
+        from config import Config
+        from services.blob_store import get_blob_store
+        from services.thumbnail_service import ThumbnailService
+
+        roll_no = roll_no.upper()
+        version = GalleryService.known_version()
+        cache = StudentService._profile_images
+        with StudentService._profile_images_lock:
+            if version != StudentService._profile_images_version:
+                cache.clear()
+                StudentService._profile_images_version = version
+            entry = cache.get(roll_no)
+            if entry is not None:
+                cache.move_to_end(roll_no)
+                return entry
+
+        student = get_db().students.find_one({"roll_no": roll_no}, PROFILE_IMAGE_PROJECTION)
+        path = StudentService._profile_image_path(student) if student else None
         if not student:
+            entry = {"error": "Student not found"}
+        elif path is None:
+            entry = {"error": "Image profile incomplete"}
+        else:
+            try:
+                path = get_blob_store().ensure_local(path)
+                entry = {"path": os.path.abspath(path), "hash": ThumbnailService.source_hash(path), "variants": {}}
+            except FileNotFoundError:
+                entry = {"error": "Image not found on server"}
+
+        with StudentService._profile_images_lock:
+            if StudentService._profile_images_version == version:
+                cache[roll_no] = entry
+                while len(cache) > Config.PROFILE_IMAGE_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def forget_profile_image(roll_no):
+        with StudentService._profile_images_lock:
+            StudentService._profile_images.pop(roll_no.upper(), None)
+
+    @staticmethod
+    def face_document(image_filenames, encodings, version=None):
+        """
+        face sub-document for a student enrolled from these images. The
+        centroid is kept as embedding_sum / embedding_count alongside the
+        per-image encodings, so images can later be added or removed without
+        re-encoding the others. version is the pipeline version that
+        produced the encodings.
+        """
+        encodings = [to_plain_list(e) for e in encodings]
+        if not encodings:
+            return {"image_filenames": list(image_filenames), "encodings": [], "embedding": [],
+                    "embedding_sum": [0.0] * EMBEDDING_DIM, "embedding_count": 0, "status": "pending_image"}
+        embedding_sum = np.sum(np.asarray(encodings, dtype=np.float64), axis=0)
+        face = {
+            "image_filenames": list(image_filenames),
+            "encodings": [{"filename": f, "encoding": e} for f, e in zip(image_filenames, encodings)],
+            "embedding": (embedding_sum / len(encodings)).tolist(),
+            "embedding_sum": embedding_sum.tolist(),
+            "embedding_count": len(encodings),
+            "status": "active"
+        }
+        if version is not None:
+            face["embedding_version"] = version
+        return face
+
+    @staticmethod
+    def _ensure_embedding_sum(student):
+        """
+        Seed embedding_sum/count for students enrolled before they existed,
+        weighting the stored centroid by its number of images.
+        """
+        face = student.get("face") or {}
+        if "embedding_sum" in face:
             return
-            
+        embedding = face.get("embedding") or []
+        count = max(len(face.get("image_filenames") or []), 1) if embedding else 0
+        seed = (np.asarray(embedding, dtype=np.float64) * count).tolist() if embedding else [0.0] * EMBEDDING_DIM
+        get_db().students.update_one(
+            {"_id": student["_id"], "face.embedding_sum": {"$exists": False}},
+            {"$set": {"face.embedding_sum": seed, "face.embedding_count": count}}
+        )
+
+    @staticmethod
+    def _apply_face_delta(query, delta, count_delta, update):
+        """
+        Atomically $inc the stored sum/count by one encoding, then write the
+        mean back. Every write to the sum bumps face.revision, and the mean
+        is only written if the revision is still the one this update
+        produced; otherwise a later update writes the newer mean itself. (The
+        count alone can't tell: an add and a remove in between restore it.)
+
+        Any re-embedded face.next is dropped, since it no longer covers the
+        same images; a running re-embedding job recomputes it.
+        """
+        db = get_db()
+        update = dict(update)
+        update["$inc"] = {f"face.embedding_sum.{i}": float(v) for i, v in enumerate(delta)}
+        update["$inc"]["face.embedding_count"] = count_delta
+        update["$inc"]["face.revision"] = 1
+        update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+        update["$unset"] = {"face.next": ""}
+
+        doc = db.students.find_one_and_update(
+            query, update,
+            projection={"face.embedding_sum": 1, "face.embedding_count": 1, "face.revision": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            return None
+
+        count = doc["face"]["embedding_count"]
+        if count > 0:
+            mean = (np.asarray(doc["face"]["embedding_sum"], dtype=np.float64) / count).tolist()
+            status = "active"
+        else:
+            mean, status = [], "pending_image"
+        db.students.update_one(
+            {"_id": doc["_id"], "face.revision": doc["face"]["revision"]},
+            {"$set": {"face.embedding": mean, "face.status": status}}
+        )
+        GalleryService.bump_version()
+        return count
+
+    @staticmethod
+    def add_face_image(roll_no, image_filename, encoding, version=None):
+        """
+        Fold one more image into a student's centroid. version is the
+        pipeline version that produced the encoding; if the stored centroid
+        came from another version, it is recomputed from all of the student's
+        images instead, since encodings from two pipelines can't be averaged.
+        Returns the new image count, or None if the student doesn't exist.
+        """
+        db = get_db()
+        student = db.students.find_one({"roll_no": roll_no}, {"face.embedding": 1, "face.embedding_sum": 1,
+                                                              "face.image_filenames": 1, "face.embedding_count": 1,
+                                                              "face.embedding_version": 1})
+        if not student:
+            return None
+        face = student.get("face") or {}
+        if version is not None and face.get("embedding") and face.get("embedding_version") != version:
+            from services.embedding_service import FaceEmbeddingService
+
+            added = db.students.update_one(
+                {"_id": student["_id"], "face.image_filenames": {"$ne": image_filename}},
+                {"$push": {"face.image_filenames": image_filename}}
+            )
+            if not added.matched_count:
+                return None
+            FaceEmbeddingService.refresh_students([roll_no])
+            student = db.students.find_one({"_id": student["_id"]}, {"face.embedding_count": 1})
+            return student["face"].get("embedding_count")
+        StudentService._ensure_embedding_sum(student)
+
+        encoding = to_plain_list(encoding)
+        update = {"$push": {"face.image_filenames": image_filename,
+                            "face.encodings": {"filename": image_filename, "encoding": encoding}}}
+        if version is not None:
+            update["$set"] = {"face.embedding_version": version}
+        return StudentService._apply_face_delta(
+            {"_id": student["_id"], "face.image_filenames": {"$ne": image_filename}},
+            encoding, 1, update
+        )
+
+    @staticmethod
+    def remove_face_image(roll_no, image_filename, encoding=None):
+        """
+        Take one image back out of a student's centroid. The encoding stored
+        when it was added is used; pass one for images enrolled before
+        per-image encodings were kept. Returns the remaining image count, or
+        None if the student or image isn't found.
+        """
+        db = get_db()
+        student = db.students.find_one(
+            {"roll_no": roll_no, "face.image_filenames": image_filename},
+            {"face.embedding": 1, "face.embedding_sum": 1, "face.image_filenames": 1, "face.encodings": 1}
+        )
+        if not student:
+            return None
+        stored = next((e["encoding"] for e in student["face"].get("encodings", [])
+                       if e.get("filename") == image_filename), None)
+        encoding = stored if stored is not None else to_plain_list(encoding)
+        if encoding is None:
+            raise ValueError(f"No stored encoding for {image_filename}")
+        StudentService._ensure_embedding_sum(student)
+
+        return StudentService._apply_face_delta(
+            {"_id": student["_id"], "face.image_filenames": image_filename},
+            [-v for v in encoding], -1,
+            {"$pull": {"face.image_filenames": image_filename,
+                       "face.encodings": {"filename": image_filename}}}
+        )
+
+    @staticmethod
+    def update_student_face(roll_no, embedding, image_filename):
+        """
+        Add an image's embedding to the student's running mean.
+        """
+        from config import Config
+        from pathlib import Path
+
+        student = get_db().students.find_one({"roll_no": roll_no}, {"department": 1, "section": 1})
+        if not student:
+            return
+
         dept = student.get("department", "CSE").upper()
         section = student.get("section", "A").upper()
-        
+
         # Ensure path exists (should already exist from create_student, but safety first)
         storage_path = Path(Config.STORAGE_TRAINING) / dept / section / roll_no
         storage_path.mkdir(parents=True, exist_ok=True)
-        
-        # Note: In a real system, we'd move the image from a temp location here
-        # or have the route pass the path. For now, we assume the filename is enough
-        # as it will be scanned by sync_storage later or handled by the route.
 
-        db.students.update_one(
-            {"roll_no": roll_no},
-            {
-                "$set": {
-                    "face.embedding": to_plain_list(embedding),
-                    "face.status": "active",
-                    "updated_at": datetime.utcnow()
-                },
-                "$addToSet": {"face.image_filenames": image_filename}
-            }
-        )
+        StudentService.add_face_image(roll_no, image_filename, embedding)
 
     @staticmethod
     def get_student_analytics(roll_no):
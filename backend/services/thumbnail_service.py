@@ -0,0 +1,149 @@
+import hashlib
+import math
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+import cv2
+import numpy as np
+from config import Config
+from services.embedding_cache import file_content_hash
+
+THUMBNAIL_FORMATS = {
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 82, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+}
+
+
+@lru_cache(maxsize=16384)
+def _source_hash(path, size, mtime_ns):
+    # Keyed by (size, mtime) so an unchanged original is hashed once per process
+    return file_content_hash(path)[:16]
+
+
+class ThumbnailService:
+    """
+    Sized derivatives of student photos for avatars and previews.
+
+    Variants are named <source content hash>-<size>.<ext>, so the name is
+    also a strong ETag. A replaced photo gets new names instead of stale
+    cache entries. They are generated lazily on first request, or eagerly
+    with generate_all() at registration.
+    """
+
+    @staticmethod
+    def pick_size(requested):
+        """
+        Smallest configured size covering the requested one (the largest if
+        none does).
+        """
+        sizes = sorted(Config.THUMBNAIL_SIZES)
+        return next((s for s in sizes if s >= requested), sizes[-1])
+
+    @staticmethod
+    def source_hash(source_path):
+        st = os.stat(source_path)
+        return _source_hash(str(source_path), st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def etag(source_path, size, fmt, source_hash=None):
+        return f"{source_hash or ThumbnailService.source_hash(source_path)}-{size}-{fmt}"
+
+    @staticmethod
+    def variant(source_path, size, fmt="jpeg", source_hash=None):
+        """
+        (path, etag, mimetype) of a derivative, generating it if missing.
+        Pass a known source_hash to skip stat-ing the original.
+        """
+        ext, mimetype, _ = THUMBNAIL_FORMATS[fmt]
+        etag = ThumbnailService.etag(source_path, size, fmt, source_hash)
+        name = etag.rsplit("-", 1)[0] + ext
+        path = Path(Config.STORAGE_THUMBNAILS) / name[:2] / name
+        if not path.exists():
+            ThumbnailService._render(source_path, {(size, fmt): path})
+        return path, etag, mimetype
+
+    @staticmethod
+    def generate_all(source_path):
+        """
+        Every configured size in every format, decoding the original once.
+        """
+        targets = {}
+        for size in Config.THUMBNAIL_SIZES:
+            for fmt, (ext, _, _) in THUMBNAIL_FORMATS.items():
+                name = ThumbnailService.etag(source_path, size, fmt).rsplit("-", 1)[0] + ext
+                path = Path(Config.STORAGE_THUMBNAILS) / name[:2] / name
+                if not path.exists():
+                    targets[(size, fmt)] = path
+        if targets:
+            ThumbnailService._render(source_path, targets)
+        return len(targets)
+
+    @staticmethod
+    def bundle_etag(etags, *options):
+        """
+        Strong ETag for a response built from several derivatives.
+        """
+        digest = hashlib.blake2b(digest_size=12)
+        for value in (*options, *etags):
+            digest.update(str(value).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def sprite(source_paths, tile, fmt="jpeg"):
+        """
+        One sprite sheet of square, centre-cropped avatars from a
+        {key: source photo} map. Tiles are cut from the next derivative up,
+        so they are never upscaled. Returns (image bytes, mimetype, columns,
+        {key: (x, y)}).
+        """
+        keys = list(source_paths)
+        columns = max(math.ceil(math.sqrt(len(keys))), 1)
+        rows = max(math.ceil(len(keys) / columns), 1)
+        sheet = np.full((rows * tile, columns * tile, 3), 255, dtype=np.uint8)
+        source_size = ThumbnailService.pick_size(tile * 2)
+
+        offsets = {}
+        for i, key in enumerate(keys):
+            path, _, _ = ThumbnailService.variant(source_paths[key], source_size, "jpeg")
+            image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            height, width = image.shape[:2]
+            side = min(height, width)
+            top, left = (height - side) // 2, (width - side) // 2
+            square = cv2.resize(image[top:top + side, left:left + side], (tile, tile), interpolation=cv2.INTER_AREA)
+            x, y = (i % columns) * tile, (i // columns) * tile
+            sheet[y:y + tile, x:x + tile] = square
+            offsets[key] = (x, y)
+
+        ext, mimetype, params = THUMBNAIL_FORMATS[fmt]
+        ok, data = cv2.imencode(ext, sheet, params)
+        if not ok:
+            raise ValueError(f"Could not encode {fmt} sprite")
+        return data.tobytes(), mimetype, columns, offsets
+
+    @staticmethod
+    def _render(source_path, targets):
+        # IMREAD_COLOR applies the EXIF orientation, so phone photos come out upright
+        image = cv2.imread(str(source_path), cv2.IMREAD_COLOR)
+        if image is None:
+            if not os.path.exists(source_path):
+                raise FileNotFoundError(str(source_path))
+            raise ValueError(f"Could not decode {source_path}")
+        height, width = image.shape[:2]
+        for (size, fmt), path in targets.items():
+            scale = min(size / max(height, width), 1.0)
+            resized = image if scale == 1.0 else cv2.resize(
+                image, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv2.INTER_AREA
+            )
+            ext, _, params = THUMBNAIL_FORMATS[fmt]
+            ok, data = cv2.imencode(ext, resized, params)
+            if not ok:
+                raise ValueError(f"Could not encode {fmt} thumbnail")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Concurrent workers may render the same variant; each writes its own temp file
+            tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data.tobytes())
+            os.replace(tmp_path, path)
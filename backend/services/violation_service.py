@@ -1,8 +1,31 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from db import get_db
 from utils.validators import validate_violation
 
+# Fields of a listed violation
+VIOLATION_PROJECTION = {"roll_no": 1, "type": 1, "location": 1, "status": 1, "department": 1,
+                        "section": 1, "remarks": 1, "created_at": 1}
+# Fields violation_stats() can count per value
+STATS_GROUPS = ("type", "location")
+
 class ViolationService:
+    @staticmethod
+    def _counter_field(v_type):
+        """
+        Student counter that tracks this violation type, None for generic ones.
+        """
+        v_type_lower = v_type.lower()
+        if "late" in v_type_lower:
+            return "late_count"
+        elif "bunk" in v_type_lower:
+            return "bunk_count"
+        elif "dress" in v_type_lower:
+            return "dress_code_count"
+        return None
+
     @staticmethod
     def create_violation(violation_data):
         db = get_db()
@@ -31,15 +54,7 @@ class ViolationService:
         result = db.violations.insert_one(violation_data)
         
         # Map violation type to counter field
-        v_type_lower = violation_data["type"].lower()
-        if "late" in v_type_lower:
-            specific_count_field = "late_count"
-        elif "bunk" in v_type_lower:
-            specific_count_field = "bunk_count"
-        elif "dress" in v_type_lower:
-            specific_count_field = "dress_code_count"
-        else:
-            specific_count_field = None  # Generic violation
+        specific_count_field = ViolationService._counter_field(violation_data["type"])
         
         # Build increment dict
         inc_data = {"violations_count": 1}
@@ -56,31 +71,138 @@ class ViolationService:
         
         return str(result.inserted_id)
 
+    @staticmethod
+    def create_violations_batch(violations):
+        """
+        Idempotent bulk insert for violations recorded offline.
+
+        Every entry must carry a client_event_id; entries whose id is already
+        stored (a replayed batch) are not inserted again. Violations are
+        stored with counted=False and the student counters are then applied
+        once per violation (see _apply_counters), so a replay also finishes
+        counting a batch whose earlier attempt died after the insert.
+        Returns {"inserted": n, "duplicates": n, "errors": [...]}; rejected
+        entries are reported by client_event_id (or batch index if it is missing).
+        """
+        db = get_db()
+        from utils.validators import ALLOWED_STATUSES
+
+        docs = []
+        errors = []
+        for index, data in enumerate(violations):
+            data = dict(data)
+            if not data.get("client_event_id"):
+                errors.append({"index": index, "error": "Missing client_event_id"})
+                continue
+            is_valid, error = validate_violation(data)
+            if not is_valid:
+                errors.append({"client_event_id": data["client_event_id"], "error": error})
+                continue
+
+            now = datetime.utcnow()
+            captured_at = data.pop("captured_at", None)
+            if isinstance(captured_at, str):
+                try:
+                    captured_at = datetime.fromisoformat(captured_at)
+                except ValueError:
+                    captured_at = None
+            data["created_at"] = captured_at or now
+            data["updated_at"] = now
+            data["status"] = data.get("status") if data.get("status") in ALLOWED_STATUSES else "Pending"
+            data.pop("student_id", None)
+            data["counted"] = False
+            docs.append(data)
+
+        if not docs:
+            return {"inserted": 0, "duplicates": 0, "errors": errors}
+
+        failed = set()
+        duplicates = 0
+        try:
+            db.violations.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed.add(write_error["index"])
+                if write_error.get("code") == 11000:
+                    duplicates += 1
+                else:
+                    errors.append({"client_event_id": docs[write_error["index"]]["client_event_id"],
+                                   "error": write_error.get("errmsg")})
+
+        ViolationService._apply_counters([doc["client_event_id"] for doc in docs])
+
+        return {"inserted": len(docs) - len(failed), "duplicates": duplicates, "errors": errors}
+
+    @staticmethod
+    def _apply_counters(client_event_ids):
+        """
+        Add every still uncounted violation among client_event_ids to its
+        student's counters, one update per student, and mark it counted.
+
+        On a replica set or mongos, both writes share a transaction, so
+        counters move exactly once per violation. A standalone server has
+        no transactions: each violation is claimed (counted=True) before
+        the counters move, so concurrent replays never double count, but a
+        crash between the two writes leaves that batch uncounted.
+        """
+        db = get_db()
+        client = db.client
+
+        def claim_and_count(session=None):
+            pending = list(db.violations.find(
+                {"client_event_id": {"$in": client_event_ids}, "counted": False},
+                {"roll_no": 1, "type": 1}, session=session
+            ))
+            if session is not None:
+                db.violations.update_many({"_id": {"$in": [doc["_id"] for doc in pending]}},
+                                          {"$set": {"counted": True}}, session=session)
+            else:
+                pending = [doc for doc in pending if db.violations.update_one(
+                    {"_id": doc["_id"], "counted": False}, {"$set": {"counted": True}}
+                ).modified_count]
+
+            increments = {}
+            for doc in pending:
+                inc = increments.setdefault(doc["roll_no"], {"violations_count": 0})
+                inc["violations_count"] += 1
+                field = ViolationService._counter_field(doc["type"])
+                if field:
+                    inc[field] = inc.get(field, 0) + 1
+            if increments:
+                db.students.bulk_write([
+                    UpdateOne({"roll_no": roll_no}, {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}})
+                    for roll_no, inc in increments.items()
+                ], ordered=False, session=session)
+            return len(pending)
+
+        if not ViolationService._supports_transactions(client):
+            return claim_and_count()
+        with client.start_session() as session:
+            # Retries the whole callback on transient errors and write conflicts
+            return session.with_transaction(claim_and_count)
+
+    @staticmethod
+    def _supports_transactions(client):
+        topology = getattr(client, "topology_description", None)
+        return topology is not None and topology.topology_type_name in ("ReplicaSetWithPrimary", "Sharded")
+
     @staticmethod
     def delete_violation(violation_id):
         db = get_db()
-        from bson import ObjectId
         
-        violation = db.violations.find_one({"_id": ObjectId(violation_id)})
+        # Deleted and read in one step, so "counted" is what it was at deletion
+        violation = db.violations.find_one_and_delete({"_id": ObjectId(violation_id)})
         if not violation:
             return False
-            
+        # Batch inserts whose counters were never applied have nothing to undo
+        if not violation.get("counted", True):
+            return True
+
         student_id = violation["roll_no"]
         v_type = violation["type"]
         
-        # Delete violation
-        db.violations.delete_one({"_id": ObjectId(violation_id)})
-        
         # Map violation type to counter field
-        v_type_lower = v_type.lower()
-        if "late" in v_type_lower:
-            specific_count_field = "late_count"
-        elif "bunk" in v_type_lower:
-            specific_count_field = "bunk_count"
-        elif "dress" in v_type_lower:
-            specific_count_field = "dress_code_count"
-        else:
-            specific_count_field = None  # Generic violation
+        specific_count_field = ViolationService._counter_field(v_type)
         
         # Build decrement dict
         inc_data = {"violations_count": -1}
@@ -97,48 +219,115 @@ class ViolationService:
         return True
 
     @staticmethod
-    def get_violations(filters=None):
+    def list_filter(date_from=None, date_to=None, v_type=None, location=None, status=None,
+                    department=None, section=None, roll_no=None):
+        """
+        $match for a violations listing. Dates are ISO dates or datetimes; a
+        bare date in date_to covers that whole day.
+        """
+        query = {}
+        if v_type:
+            query["type"] = v_type
+        if location:
+            query["location"] = location
+        if status:
+            query["status"] = status
+        if department:
+            query["department"] = department.strip().upper()
+        if section:
+            query["section"] = section.strip().upper()
+        if roll_no:
+            query["roll_no"] = roll_no.strip().upper()
+        created_at = {}
+        if date_from:
+            created_at["$gte"] = datetime.fromisoformat(date_from)
+        if date_to:
+            if len(date_to) == 10:
+                created_at["$lt"] = datetime.fromisoformat(date_to) + timedelta(days=1)
+            else:
+                created_at["$lte"] = datetime.fromisoformat(date_to)
+        if created_at:
+            query["created_at"] = created_at
+        return query
+
+    @staticmethod
+    def encode_cursor(violation):
+        return f"{violation['created_at'].isoformat()}_{violation['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        created_at, _, violation_id = cursor.partition("_")
+        return datetime.fromisoformat(created_at), ObjectId(violation_id)
+
+    @staticmethod
+    def list_violations(query=None, after=None, limit=50):
+        """
+        One page of violations, newest first, starting after the cursor
+        `after` (keyset on created_at, _id). The filter is matched first, on
+        the (field, created_at) indexes, and only the page is joined to
+        student names, so a page costs the same however long the history.
+        Returns (violations, next cursor or None).
+        """
         db = get_db()
-        pipeline = []
-        if filters:
-            pipeline.append({"$match": filters})
-            
-        pipeline.extend([
-            {
-                "$lookup": {
-                    "from": "students",
-                    "localField": "roll_no",
-                    "foreignField": "roll_no",
-                    "as": "student_info"
-                }
-            },
-            {
-                "$unwind": {
-                    "path": "$student_info",
-                    "preserveNullAndEmptyArrays": True
-                }
-            },
-            {
-                "$addFields": {
-                    "student_name": {"$ifNull": ["$student_info.name", "Unknown Student"]}
-                }
-            },
-            {
-                "$project": {
-                    "student_info": 0
-                }
-            },
-            {"$sort": {"created_at": -1}}
-        ])
-        
+        match = dict(query or {})
+        if after:
+            created_at, violation_id = ViolationService.decode_cursor(after)
+            match["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": violation_id}},
+            ]
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"created_at": -1, "_id": -1}},
+            {"$limit": limit + 1},
+            {"$project": VIOLATION_PROJECTION},
+            {"$lookup": {"from": "students", "localField": "roll_no", "foreignField": "roll_no", "as": "student_info"}},
+        ]
         violations = list(db.violations.aggregate(pipeline))
-        
+        next_cursor = None
+        if len(violations) > limit:
+            violations = violations[:limit]
+            next_cursor = ViolationService.encode_cursor(violations[-1])
+
         for v in violations:
+            student_info = v.pop("student_info", None) or [{}]
+            v["student_name"] = student_info[0].get("name") or "Unknown Student"
             v["_id"] = str(v["_id"])
             if "created_at" in v:
                 # Human readable date for display
                 v["date"] = v["created_at"].strftime("%b %d, %Y %I:%M %p")
                 # Strict ISO date for the HTML date picker filter
                 v["iso_date"] = v["created_at"].strftime("%Y-%m-%d")
-                
-        return violations
+        return violations, next_cursor
+
+    @staticmethod
+    def violation_stats(query=None, group_by=None):
+        """
+        Counts for a violations filter: in total, today and this month (UTC
+        days, as the dashboard), plus [{"name", "count"}] per value of
+        group_by ("type" or "location"), most frequent first. Served from
+        the created_at and (field, created_at) indexes instead of listing
+        the history.
+        """
+        db = get_db()
+        query = dict(query or {})
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+        def count_since(start):
+            created_at = dict(query.get("created_at", {}))
+            created_at["$gte"] = max(created_at.get("$gte", start), start)
+            return db.violations.count_documents({**query, "created_at": created_at})
+
+        stats = {
+            "total": db.violations.count_documents(query),
+            "today": count_since(today),
+            "this_month": count_since(today.replace(day=1)),
+        }
+        if group_by:
+            rows = db.violations.aggregate([
+                {"$match": query},
+                {"$group": {"_id": f"${group_by}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ])
+            stats["groups"] = [{"name": row["_id"], "count": row["count"]} for row in rows]
+        return stats
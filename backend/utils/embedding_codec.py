@@ -0,0 +1,36 @@
+import base64
+import binascii
+import numpy as np
+
+EMBEDDING_DIM = 128
+_ROW_BYTES = EMBEDDING_DIM * 4
+
+
+def decode_binary_encodings(raw):
+    """
+    Decode a packed little-endian float32 buffer into an (N, 128) array.
+    """
+    if not raw or len(raw) % _ROW_BYTES != 0:
+        raise ValueError(f"Encoding payload must be a multiple of {_ROW_BYTES} bytes (128 x float32)")
+    encodings = np.frombuffer(raw, dtype="<f4").reshape(-1, EMBEDDING_DIM)
+    if not np.isfinite(encodings).all():
+        raise ValueError("Encoding payload contains NaN or infinite values")
+    return encodings
+
+
+def decode_base64_encoding(value):
+    """
+    Decode one base64 string of packed float32 values into a (N, 128) array.
+    """
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Encoding is not valid base64")
+    return decode_binary_encodings(raw)
+
+
+def encode_base64(encoding):
+    """
+    Pack a 128-d encoding as base64 float32, the format edge clients send.
+    """
+    return base64.b64encode(np.asarray(encoding, dtype="<f4").tobytes()).decode("ascii")
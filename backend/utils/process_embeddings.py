@@ -1,3 +1,4 @@
+import argparse
 import os
 import sys
 
@@ -6,10 +7,15 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from services.embedding_service import FaceEmbeddingService
 
-def run_embedding():
+def run_embedding(workers=None, batch_size=50, resume=True):
     print("Starting embedding generation for pending students...")
-    results = FaceEmbeddingService.process_all_pending()
+    results = FaceEmbeddingService.process_all_pending(workers=workers, batch_size=batch_size, resume=resume)
     print(f"Results: {results}")
 
 if __name__ == "__main__":
-    run_embedding()
+    parser = argparse.ArgumentParser(description="Generate embeddings for students with pending_image status")
+    parser.add_argument("--workers", type=int, default=None, help="Encoder processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Students per bulk_write / checkpoint")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning")
+    args = parser.parse_args()
+    run_embedding(args.workers, args.batch_size, resume=not args.restart)
@@ -1,100 +1,330 @@
+import argparse
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 # Add parent directory to path to allow importing from backend root
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from pymongo import InsertOne, UpdateOne
 from db import get_db
 from config import Config
+from services.blob_store import LocalBlobStore, blob_key, get_blob_store
+from services.gallery_service import GalleryService
+from services.student_service import StudentService
 
-def sync_hierarchical_storage():
+# Allowed values for validation
+ALLOWED_DEPTS = {"CSE", "ECE", "MECH", "CIVIL"}
+ALLOWED_SECTIONS = {"A", "B", "C"}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+def _list_images(student_path):
+    with os.scandir(student_path) as files:
+        return sorted(
+            f.name for f in files
+            if f.is_file() and os.path.splitext(f.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def find_student_dir(training_root, dept, section, roll_no):
     """
-    Scan storage/training/<DEPT>/<SECTION>/<STUDENT_ID>/ structure
-    and sync with GuardDB.
+    On-disk folder of a student, matching each level case-insensitively so
+    folders not created in the upper-case layout (cse/a/21abc) are found.
+    None if there is none.
+    """
+    path = Path(training_root)
+    for name in (dept, section, roll_no):
+        if (path / name).is_dir():
+            path = path / name
+            continue
+        try:
+            with os.scandir(path) as entries:
+                path = next((Path(e.path) for e in entries if e.is_dir() and e.name.upper() == name.upper()), None)
+        except FileNotFoundError:
+            return None
+        if path is None:
+            return None
+    return path
+
+
+def _scan_section(dept, section, section_path):
+    """
+    List every student folder in one section with its image filenames.
+    Returns [(roll_no, dept, section, images)].
+    """
+    students = []
+    with os.scandir(section_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                students.append((entry.name.upper(), dept, section, _list_images(entry.path)))
+    return students
+
+
+def scan_training_tree(training_root, workers=8):
+    """
+    Walk storage/training/<DEPT>/<SECTION>/<ROLL_NO>/ with os.scandir,
+    one section per thread.
+    """
+    sections = []
+    with os.scandir(training_root) as depts:
+        for dept_entry in depts:
+            if not dept_entry.is_dir():
+                continue
+            dept = dept_entry.name.upper()
+            if dept not in ALLOWED_DEPTS:
+                print(f"Warning: Skipping invalid department folder: {dept}")
+                continue
+            with os.scandir(dept_entry.path) as section_entries:
+                for section_entry in section_entries:
+                    if not section_entry.is_dir():
+                        continue
+                    section = section_entry.name.upper()
+                    if section not in ALLOWED_SECTIONS:
+                        print(f"Warning: Skipping invalid section folder: {section} in {dept}")
+                        continue
+                    sections.append((dept, section, section_entry.path))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for students in pool.map(lambda s: _scan_section(*s), sections):
+            yield from students
+
+
+def scan_blob_store(store, training_root):
+    """
+    Same rows as scan_training_tree, from the keys of a remote blob store.
+    """
+    prefix = blob_key(training_root) + "/"
+    students = {}
+    skipped = set()
+    for key, _ in store.list(prefix):
+        parts = key[len(prefix):].split("/")
+        if len(parts) != 4 or os.path.splitext(parts[3])[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        dept, section, roll_no, name = parts[0].upper(), parts[1].upper(), parts[2].upper(), parts[3]
+        if dept not in ALLOWED_DEPTS or section not in ALLOWED_SECTIONS:
+            if (dept, section) not in skipped:
+                print(f"Warning: Skipping invalid folder: {dept}/{section}")
+                skipped.add((dept, section))
+            continue
+        students.setdefault((roll_no, dept, section), []).append(name)
+    for (roll_no, dept, section), images in students.items():
+        yield roll_no, dept, section, sorted(images)
+
+
+def push_local_tree(store, scanned, training_root, workers=8):
+    """
+    Upload the images of scanned local folders that the blob store doesn't
+    have yet, e.g. photos dropped into this node's storage/training.
+    Returns how many were uploaded.
+    """
+    stored = {key for key, _ in store.list(blob_key(training_root) + "/")}
+    missing = [
+        training_root / dept / section / roll_no / name
+        for roll_no, dept, section, images in scanned for name in images
+        if blob_key(training_root / dept / section / roll_no / name) not in stored
+    ]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        list(pool.map(store.put_file, missing))
+    return len(missing)
+
+
+def compute_diff(existing, scanned):
+    """
+    Compare the tree with the prefetched students. Returns
+    (inserts, updates, missing_on_disk) where updates are (roll_no, changes).
+    """
+    inserts = []
+    updates = []
+    seen = set()
+    for roll_no, dept, section, images in scanned:
+        if not images:
+            print(f"Warning: No images found for student {roll_no} in {dept}/{section}")
+            continue
+        if roll_no in seen:
+            print(f"Warning: {roll_no} found in more than one section, skipping {dept}/{section}")
+            continue
+        seen.add(roll_no)
+
+        current = existing.get(roll_no)
+        if current is None:
+            inserts.append((roll_no, dept, section, images))
+            continue
+
+        changes = {}
+        if current.get("department") != dept:
+            changes["department"] = dept
+        if current.get("section") != section:
+            changes["section"] = section
+        current_images = current.get("face", {}).get("image_filenames") or []
+        if set(current_images) != set(images):
+            # Keep the existing order (the last file is the profile photo), append new ones
+            on_disk = set(images)
+            kept = [name for name in current_images if name in on_disk]
+            kept_set = set(kept)
+            changes["face.image_filenames"] = kept + [name for name in images if name not in kept_set]
+        if changes:
+            updates.append((roll_no, changes))
+
+    missing = sorted(set(existing) - seen)
+    return inserts, updates, missing
+
+
+def _new_student(roll_no, dept, section, images, now):
+    return {
+        "roll_no": roll_no,
+        "department": dept,
+        "section": section,
+        "face": {
+            "image_filenames": images,
+            "embedding": [],
+            "status": "pending_image"
+        },
+        "violations_count": 0,
+        "late_count": 0,
+        "bunk_count": 0,
+        "dress_code_count": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def _prefetch(query):
+    return {
+        doc["roll_no"]: doc
+        for doc in get_db().students.find(
+            query, {"_id": 0, "roll_no": 1, "department": 1, "section": 1, "face.image_filenames": 1}
+        )
+    }
+
+
+def _apply_diff(inserts, updates, batch_size=1000, removals=()):
+    """
+    Write the diff. removals are roll_nos whose folder is gone or empty:
+    their photos and embedding are cleared so they stop matching.
     """
     db = get_db()
+    now = datetime.utcnow()
+    operations = [InsertOne(_new_student(*row, now)) for row in inserts]
+    operations += [
+        UpdateOne({"roll_no": roll_no}, {"$set": {**changes, "updated_at": now}})
+        for roll_no, changes in updates
+    ]
+    cleared = {f"face.{k}": v for k, v in StudentService.face_document([], []).items()}
+    operations += [
+        UpdateOne({"roll_no": roll_no}, {"$set": {**cleared, "updated_at": now}, "$inc": {"face.revision": 1},
+                                         "$unset": {"face.next": ""}})
+        for roll_no in removals
+    ]
+    for start in range(0, len(operations), batch_size):
+        db.students.bulk_write(operations[start:start + batch_size], ordered=False)
+    if updates or removals:
+        # Department/section moves change what the gallery partitions hold
+        GalleryService.bump_version()
+
+
+def sync_hierarchical_storage(dry_run=False, workers=8, batch_size=1000):
+    """
+    Scan storage/training/<DEPT>/<SECTION>/<ROLL_NO>/ structure
+    and sync with GuardDB.
+
+    Existing students are prefetched in one projected query and only real
+    differences are written, in batched bulk_write calls.
+    """
     training_root = Path(Config.STORAGE_TRAINING)
-    
-    if not training_root.exists():
+    store = get_blob_store()
+    remote = not isinstance(store, LocalBlobStore)
+
+    if not training_root.exists() and not remote:
         print(f"Error: Training root {training_root} does not exist.")
         return
 
-    print(f"Starting sync from: {training_root}")
-    
-    # Allowed values for validation
-    ALLOWED_DEPTS = {"CSE", "ECE", "MECH", "CIVIL"}
-    ALLOWED_SECTIONS = {"A", "B", "C"}
+    print(f"Starting sync from: {training_root}" + (f" ({Config.BLOB_BACKEND} blob store)" if remote else ""))
 
-    for dept_path in training_root.iterdir():
-        if not dept_path.is_dir():
-            continue
-            
-        dept = dept_path.name.upper()
-        if dept not in ALLOWED_DEPTS:
-            print(f"Warning: Skipping invalid department folder: {dept}")
+    if remote:
+        # The store is the source of truth; folders added on this node go there first
+        if training_root.exists() and not dry_run:
+            pushed = push_local_tree(store, list(scan_training_tree(training_root, workers)), training_root, workers)
+            print(f"Uploaded {pushed} local image(s) to the blob store")
+        scanned = scan_blob_store(store, training_root)
+    else:
+        scanned = scan_training_tree(training_root, workers)
+
+    existing = _prefetch({"roll_no": {"$exists": True}})
+    inserts, updates, missing = compute_diff(existing, scanned)
+
+    for roll_no, dept, section, images in inserts:
+        print(f"+ {roll_no} ({dept}/{section}) {len(images)} image(s)")
+    for roll_no, changes in updates:
+        print(f"~ {roll_no} " + ", ".join(f"{k}={v}" for k, v in changes.items()))
+    if missing:
+        print(f"Note: {len(missing)} student(s) in DB have no folder under {training_root}")
+
+    summary = {"registered": len(inserts), "updated": len(updates), "unchanged":
+               len(existing) - len(updates) - len(missing), "missing_on_disk": len(missing)}
+    if dry_run:
+        print(f"Dry run, nothing written: {summary}")
+        return summary
+
+    _apply_diff(inserts, updates, batch_size)
+    print(f"Sync complete: {summary}")
+    return summary
+
+
+def sync_student_dirs(student_dirs):
+    """
+    Sync only the given (dept, section, roll_no) folders, named as they are
+    on disk, e.g. the ones a watcher saw change. A folder that is gone or
+    holds no images clears that student's photos and embedding. Returns the
+    roll_nos that were registered, updated or cleared.
+    """
+    training_root = Path(Config.STORAGE_TRAINING)
+    store = get_blob_store()
+    scanned = []
+    for dept_dir, section_dir, roll_dir in student_dirs:
+        dept, section, roll_no = dept_dir.upper(), section_dir.upper(), roll_dir.upper()
+        if dept not in ALLOWED_DEPTS or section not in ALLOWED_SECTIONS:
             continue
+        student_path = training_root / dept_dir / section_dir / roll_dir
+        images = _list_images(student_path) if student_path.is_dir() else []
+        scanned.append((roll_no, dept, section, images, student_path))
 
-        for section_path in dept_path.iterdir():
-            if not section_path.is_dir():
-                continue
-                
-            section = section_path.name.upper()
-            if section not in ALLOWED_SECTIONS:
-                print(f"Warning: Skipping invalid section folder: {section} in {dept}")
-                continue
+    if not isinstance(store, LocalBlobStore):
+        prefix = blob_key(training_root) + "/"
+        for i, (roll_no, dept, section, images, student_path) in enumerate(scanned):
+            student_prefix = f"{prefix}{dept}/{section}/{roll_no}/"
+            # Other nodes may have added images to the same students
+            names = {key[len(student_prefix):] for key, _ in store.list(student_prefix)}
+            # Photos new on this node go to the store under the normalised key
+            for name in set(images) - names:
+                with open(student_path / name, "rb") as f:
+                    store.put(student_prefix + name, f)
+            scanned[i] = (roll_no, dept, section, sorted(
+                name for name in names | set(images)
+                if "/" not in name and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+            ), student_path)
+
+    scanned = [row[:4] for row in scanned]
+    existing = _prefetch({"roll_no": {"$in": [row[0] for row in scanned]}})
+    inserts, updates, _ = compute_diff(existing, [row for row in scanned if row[3]])
+    with_images = {row[0] for row in scanned if row[3]}
+    removals = sorted({
+        roll_no for roll_no, dept, section, images in scanned
+        if not images and roll_no not in with_images and roll_no in existing
+        # Not a folder the student has since moved away from
+        and (existing[roll_no].get("department"), existing[roll_no].get("section")) == (dept, section)
+        and (existing[roll_no].get("face") or {}).get("image_filenames")
+    })
+    _apply_diff(inserts, updates, removals=removals)
+    return [row[0] for row in inserts] + [roll_no for roll_no, _ in updates] + removals
 
-            for student_path in section_path.iterdir():
-                if not student_path.is_dir():
-                    continue
-                
-                student_id = student_path.name
-                
-                # Get image filenames
-                images = [f.name for f in student_path.iterdir() if f.is_file() and f.suffix.lower() in {'.jpg', '.jpeg', '.png'}]
-                
-                if not images:
-                    print(f"Warning: No images found for student {student_id} in {dept}/{section}")
-                    continue
-
-                # Prepare student document
-                existing = db.students.find_one({"student_id": student_id})
-                
-                if existing:
-                    # Update only if needed
-                    update_fields = {
-                        "department": dept,
-                        "section": section,
-                        "face.image_filenames": images,
-                        "updated_at": datetime.utcnow()
-                    }
-                    db.students.update_one({"student_id": student_id}, {"$set": update_fields})
-                    print(f"Updated: {student_id} ({dept}/{section})")
-                else:
-                    # Create new student
-                    new_student = {
-                        "student_id": student_id,
-                        "department": dept,
-                        "section": section,
-                        "face": {
-                            "image_filenames": images,
-                            "embedding": [],
-                            "status": "pending_image"
-                        },
-                        "stats": {
-                            "total": 0,
-                            "types": {
-                                "bunk": 0,
-                                "late_arrival": 0,
-                                "dress_code": 0
-                            }
-                        },
-                        "created_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                    db.students.insert_one(new_student)
-                    print(f"Registered: {student_id} ({dept}/{section})")
 
 if __name__ == "__main__":
-    sync_hierarchical_storage()
+    parser = argparse.ArgumentParser(description="Sync storage/training folders into the students collection")
+    parser.add_argument("--dry-run", action="store_true", help="Print the diff without writing")
+    parser.add_argument("--workers", type=int, default=8, help="Threads scanning section folders")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Operations per bulk_write")
+    args = parser.parse_args()
+    sync_hierarchical_storage(args.dry_run, args.workers, args.batch_size)
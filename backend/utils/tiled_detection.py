@@ -0,0 +1,141 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2
+import face_recognition
+from config import Config
+
+# A tile box this close to an edge shared with a neighbouring tile is a face
+# cut by the tile border; the neighbour or the overview pass has it whole
+TILE_EDGE_MARGIN = 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def tile_grid(height, width, tile_size, overlap):
+    """
+    Overlapping (top, left, bottom, right) tiles covering the whole image.
+
+    Neighbouring tiles share `overlap` pixels, so any face smaller than the
+    overlap lies entirely inside at least one tile. Larger faces are left to
+    the downscaled overview pass in face_locations().
+    """
+    stride = max(tile_size - overlap, 1)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (top, left, min(top + tile_size, height), min(left + tile_size, width))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def _detect_tile(args):
+    tile, top, left, scale, model, upsample = args
+    locations = face_recognition.face_locations(tile, number_of_times_to_upsample=upsample, model=model)
+    return [
+        (int(t * scale) + top, int(r * scale) + left, int(b * scale) + top, int(l * scale) + left)
+        for (t, r, b, l) in locations
+    ]
+
+
+def _cut_by_edge(box, tile, height, width):
+    """
+    True if box touches a side of tile that is not also a side of the image.
+    """
+    t, r, b, l = box
+    top, left, bottom, right = tile
+    return ((top > 0 and t - top <= TILE_EDGE_MARGIN)
+            or (left > 0 and l - left <= TILE_EDGE_MARGIN)
+            or (bottom < height and bottom - b <= TILE_EDGE_MARGIN)
+            or (right < width and right - r <= TILE_EDGE_MARGIN))
+
+
+def non_max_suppression(locations, iou_threshold=0.3, containment_threshold=0.7):
+    """
+    Merge duplicate boxes from overlapping tiles.
+
+    HOG gives no scores, so larger boxes win: a face cut by a tile edge
+    yields a truncated box that is either mostly contained in, or heavily
+    overlapping, the full detection from the neighbouring tile.
+    """
+    def area(box):
+        t, r, b, l = box
+        return max(r - l, 0) * max(b - t, 0)
+
+    kept = []
+    for box in sorted(set(locations), key=area, reverse=True):
+        t, r, b, l = box
+        suppressed = False
+        for kt, kr, kb, kl in kept:
+            iw = min(r, kr) - max(l, kl)
+            ih = min(b, kb) - max(t, kt)
+            if iw <= 0 or ih <= 0:
+                continue
+            inter = iw * ih
+            union = area(box) + (kr - kl) * (kb - kt) - inter
+            if inter / union > iou_threshold or inter / max(area(box), 1) > containment_threshold:
+                suppressed = True
+                break
+        if not suppressed:
+            kept.append(box)
+    return kept
+
+
+def _get_pool():
+    """
+    Lazily created worker pool, recreated after a fork (gunicorn workers).
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = Config.TILED_DETECTION_WORKERS or os.cpu_count() or 1
+            if Config.TILED_DETECTION_EXECUTOR == "thread":
+                _pool = ThreadPoolExecutor(max_workers=workers)
+            else:
+                _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def face_locations(image, model="hog", upsample=1):
+    """
+    Tiled replacement for face_recognition.face_locations, for crowd and
+    surveillance frames; callers decide when a frame is large enough
+    (TILED_DETECTION_MIN_SIDE).
+
+    The frame is split into overlapping tiles, and a copy downscaled to one
+    tile is detected alongside them, all in parallel. Tiles find small faces
+    at full resolution; the overview finds faces too large for the overlap,
+    which come back from the tiles cut off. Tile boxes touching an inner
+    tile edge are dropped, and the rest are merged with non-maximum
+    suppression, so the result keeps the (top, right, bottom, left)
+    format in full-image coordinates.
+    """
+    height, width = image.shape[:2]
+    tile_size = Config.TILED_DETECTION_TILE_SIZE
+    if max(height, width) <= tile_size:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model=model)
+
+    tiles = tile_grid(height, width, tile_size, min(Config.TILED_DETECTION_OVERLAP, tile_size // 2))
+    jobs = [
+        (image[top:bottom, left:right], top, left, 1.0, model, upsample)
+        for (top, left, bottom, right) in tiles
+    ]
+    scale = tile_size / max(height, width)
+    overview = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    jobs.append((overview, 0, 0, 1 / scale, model, upsample))
+
+    results = list(_get_pool().map(_detect_tile, jobs))
+    locations = list(results.pop())
+    for tile, tile_locations in zip(tiles, results):
+        locations.extend(box for box in tile_locations if not _cut_by_edge(box, tile, height, width))
+    return non_max_suppression(locations)
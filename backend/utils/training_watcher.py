@@ -0,0 +1,263 @@
+"""
+Watch storage/training and enrol changed students within seconds.
+
+New or replaced images under storage/training/<DEPT>/<SECTION>/<ROLL_NO>/
+are picked up without a full rescan: only the affected student folders are
+synced into MongoDB (utils/sync_storage.py) and re-embedded
+(FaceEmbeddingService.refresh_students), then the gallery version is bumped
+so matchers reload.
+
+Linux inotify is used through ctypes; elsewhere, or with --poll, the tree
+is rescanned every few seconds instead. Events are debounced so a burst of
+copies into one folder is processed once.
+
+Run:
+    python utils/training_watcher.py [--poll] [--debounce 2]
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path to allow importing from backend root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from config import Config
+from services.embedding_service import FaceEmbeddingService
+from utils.sync_storage import sync_student_dirs
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ATTRIB)
+EVENT_HEADER = struct.Struct("iIII")
+
+# storage/training/<DEPT>/<SECTION>/<ROLL_NO>
+STUDENT_DEPTH = 3
+
+
+def _student_key(relative_parts):
+    """
+    (dept, section, roll_no) folder names as they are on disk; sync_student_dirs
+    normalises them, but needs the real names to find the folder again.
+    """
+    return tuple(relative_parts[:STUDENT_DEPTH])
+
+
+def _walk_student_dirs(root):
+    """
+    Every (dept, section, roll_no) folder currently under root.
+    """
+    keys = []
+    for dirpath, dirnames, _ in os.walk(root):
+        parts = Path(dirpath).relative_to(root).parts
+        if len(parts) == STUDENT_DEPTH:
+            keys.append(_student_key(parts))
+            dirnames[:] = []
+    return keys
+
+
+class InotifyWatcher:
+    """
+    Recursive inotify watch over the training tree, one watch per folder
+    down to student level. poll() returns the student folders touched.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> relative parts
+        self._add_tree(self.root)
+
+    def _add_watch(self, path):
+        parts = path.relative_to(self.root).parts
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self.watches[wd] = parts
+
+    def _add_tree(self, path):
+        """
+        Watch path and every folder below it down to student level. Returns
+        the student folders found, since files may have landed in them
+        before their watch existed.
+        """
+        found = []
+        for dirpath, dirnames, _ in os.walk(path):
+            dirpath = Path(dirpath)
+            parts = dirpath.relative_to(self.root).parts
+            self._add_watch(dirpath)
+            if len(parts) >= STUDENT_DEPTH:
+                found.append(_student_key(parts))
+                dirnames[:] = []
+        return found
+
+    def poll(self, timeout):
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; fall back to looking at everything once
+                changed.update(_walk_student_dirs(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parts = self.watches.get(wd)
+            if parts is None:
+                continue
+
+            if len(parts) >= STUDENT_DEPTH:
+                changed.add(_student_key(parts))
+            elif name and mask & IN_ISDIR:
+                child_parts = parts + (name,)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._add_tree(self.root.joinpath(*child_parts)))
+                elif len(child_parts) == STUDENT_DEPTH:
+                    changed.add(_student_key(child_parts))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Portable fallback: rescans the tree every interval and compares each
+    student folder's (name, size, mtime) listing with the previous scan.
+    """
+
+    def __init__(self, root, interval=None):
+        self.root = Path(root)
+        self.interval = interval or Config.TRAINING_WATCH_POLL_SECONDS
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for key in _walk_student_dirs(self.root):
+            path = self.root.joinpath(*key)
+            try:
+                with os.scandir(path) as entries:
+                    snapshot[key] = frozenset(
+                        (e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in entries if e.is_file()
+                    )
+            except FileNotFoundError:
+                continue
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(max(timeout, self.interval))
+        current = self._scan()
+        changed = {key for key in current.keys() | self.snapshot.keys()
+                   if current.get(key) != self.snapshot.get(key)}
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def process_students(keys):
+    keys = sorted(keys)
+    print(f"Processing {len(keys)} changed student folder(s): {', '.join(k[2] for k in keys)}")
+    start = time.monotonic()
+    changed = sync_student_dirs(keys)
+    results = FaceEmbeddingService.refresh_students(sorted({roll_no.upper() for _, _, roll_no in keys}))
+    print(f"  synced {len(changed)} record(s), embeddings {results} in {time.monotonic() - start:.2f}s")
+
+
+def watch(root=None, debounce=None, use_polling=False):
+    """
+    Debounced event loop: a folder is processed once no event has arrived
+    for it in `debounce` seconds (or after 10x debounce under constant churn).
+    """
+    root = Path(root or Config.STORAGE_TRAINING)
+    debounce = Config.TRAINING_WATCH_DEBOUNCE_SECONDS if debounce is None else debounce
+    root.mkdir(parents=True, exist_ok=True)
+
+    watcher = None
+    if not use_polling:
+        try:
+            watcher = InotifyWatcher(root)
+            print(f"Watching {root} with inotify ({len(watcher.watches)} folders)")
+        except OSError as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    if watcher is None:
+        watcher = PollingWatcher(root)
+        print(f"Polling {root} every {watcher.interval}s")
+
+    first_seen = {}
+    last_seen = {}
+    try:
+        while True:
+            now = time.monotonic()
+            for key in watcher.poll(timeout=min(debounce, 1.0) if last_seen else 1.0):
+                first_seen.setdefault(key, now)
+                last_seen[key] = now
+
+            now = time.monotonic()
+            ready = {key for key, seen in last_seen.items()
+                     if now - seen >= debounce or now - first_seen[key] >= debounce * 10}
+            if not ready:
+                continue
+            for key in ready:
+                first_seen.pop(key)
+                last_seen.pop(key)
+            try:
+                process_students(ready)
+            except Exception as e:
+                print(f"Error processing {sorted(ready)}: {e}")
+    except KeyboardInterrupt:
+        print("Stopping watcher")
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrol students as images land in storage/training")
+    parser.add_argument("--poll", action="store_true", help="Use the polling watcher instead of inotify")
+    parser.add_argument("--debounce", type=float, default=None, help="Quiet seconds before a folder is processed")
+    args = parser.parse_args()
+    watch(debounce=args.debounce, use_polling=args.poll)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Round-trip check of the blob store backends (services/blob_store.py).
+
+For each backend, stores a training photo and a capture, reads them back
+through a second node's empty cache, lists, prunes the read-through cache
+and deletes. Captures are kept in a directory outside the training one, as
+a STORAGE_CAPTURES override does. Everything is written to scratch
+directories and a scratch bucket/prefix that are removed afterwards.
+
+    local   no services needed
+    gridfs  the MongoDB at MONGO_URI (bucket "verify_blobs")
+    s3      BLOB_S3_BUCKET, e.g. against a local MinIO:
+              docker run -p 9000:9000 minio/minio server /data
+              (create the bucket, then)
+              BLOB_S3_ENDPOINT_URL=http://localhost:9000 BLOB_S3_BUCKET=test \\
+              AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \\
+              python verify_blob_store.py s3
+
+Usage:
+    python verify_blob_store.py [local] [gridfs] [s3]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from config import Config
+from services.blob_store import BLOB_BACKENDS, LocalBlobStore, blob_key
+
+
+def make_store(backend, run_id, cache_root=None):
+    if backend == "gridfs":
+        return BLOB_BACKENDS[backend](bucket="verify_blobs", cache_root=cache_root)
+    if backend == "s3":
+        return BLOB_BACKENDS[backend](prefix=f"verify-blob-store/{run_id}/", cache_root=cache_root)
+    return BLOB_BACKENDS[backend]()
+
+
+def check_backend(backend, scratch):
+    failures = 0
+
+    def expect(label, ok):
+        nonlocal failures
+        failures += 0 if ok else 1
+        print(f"  {label:48s} {'✓' if ok else '✗'}")
+
+    Config.STORAGE_TRAINING = str(scratch / "node-a" / "training")
+    Config.STORAGE_CAPTURES = str(scratch / "elsewhere" / "captures")
+    photo = Path(Config.STORAGE_TRAINING) / "CSE" / "A" / "21CS001" / "photo.jpeg"
+    capture = Path(Config.STORAGE_CAPTURES) / "ab" / "cd" / f"abcd{'0' * 36}.jpg"
+    for path, size in ((photo, 3 << 20), (capture, 4096)):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+
+    run_id = uuid.uuid4().hex
+    store = make_store(backend, run_id)
+    keys = {photo: "training/CSE/A/21CS001/photo.jpeg", capture: f"captures/ab/cd/{capture.name}"}
+    try:
+        for path, key in keys.items():
+            expect(f"blob_key() of a {key.split('/')[0]} file", blob_key(path) == key)
+            store.put_file(path)
+            expect(f"exists {key[:40]}", store.exists(key))
+            with store.open(key) as f:
+                expect(f"open() returns the bytes of {path.name[:20]}", f.read() == path.read_bytes())
+
+        listed = {key for key, _ in store.list("training/CSE/A/")}
+        expect("list() of a folder", listed == {keys[photo]})
+        listed = {key for key, _ in store.list(blob_key(Config.STORAGE_CAPTURES) + "/")}
+        expect("list() of the captures prefix", listed == {keys[capture]})
+
+        if not isinstance(store, LocalBlobStore):
+            # Another node, with nothing cached yet
+            other = make_store(backend, run_id, cache_root=scratch / "node-b")
+            local = other.local_path(keys[photo])
+            expect("second node fetches into its cache", local.read_bytes() == photo.read_bytes())
+            expect("prune_cache() evicts cached copies", other.prune_cache(max_bytes=1) >= 1 and not local.exists())
+            expect("evicted blob is still in the store", other.exists(keys[photo]))
+
+        store.delete_file(photo)
+        expect("delete_file() removes the blob", not store.exists(keys[photo]))
+        try:
+            store.local_path(keys[photo])
+            expect("local_path() of a deleted blob raises", False)
+        except FileNotFoundError:
+            expect("local_path() of a deleted blob raises", True)
+    finally:
+        for key in keys.values():
+            store.delete(key)
+    return failures
+
+
+def main():
+    backends = sys.argv[1:] or ["local"]
+    unknown = [b for b in backends if b not in BLOB_BACKENDS]
+    if unknown:
+        print(f"Unknown backend(s) {unknown}, expected some of {list(BLOB_BACKENDS)}")
+        return 2
+
+    failures = 0
+    for backend in backends:
+        print(f"\n{backend}:")
+        scratch = Path(tempfile.mkdtemp(prefix="verify_blob_store_"))
+        try:
+            failures += check_backend(backend, scratch)
+        except Exception as e:
+            print(f"  ✗ {type(e).__name__}: {e}")
+            failures += 1
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print("\n✅ Blob store checks passed" if not failures else f"\n❌ {failures} failed check(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Conformance check for the FacePipeline detector backends.
+
+Runs every available backend (hog, cnn, haar, dnn) over the same images and
+compares them against the dlib HOG reference:
+  - recall: share of reference faces the backend also finds (IoU >= 0.3)
+  - mean IoU of matched boxes
+  - embedding drift: distance between the encoding from the backend's box
+    and the encoding from the reference box (same face, should be << 0.45)
+  - mean detect / encode time per image
+
+Usage:
+    python verify_detectors.py <image_or_dir> [more images...]
+
+Exit status is non-zero if any available backend falls below MIN_RECALL or
+drifts more than MAX_DRIFT on average.
+"""
+
+import sys
+import io
+from pathlib import Path
+
+# Suppress face_recognition setup warnings
+old_stderr = sys.stderr
+sys.stderr = io.StringIO()
+try:
+    import numpy as np
+    from services.face_pipeline import FacePipeline, DETECTOR_BACKENDS
+    from utils.tiled_detection import non_max_suppression
+finally:
+    sys.stderr = old_stderr
+
+MIN_RECALL = 0.8
+MAX_DRIFT = 0.2
+IOU_MATCH = 0.3
+ALLOWED_EXT = {'.png', '.jpg', '.jpeg'}
+
+
+def iou(a, b):
+    at, ar, ab, al = a
+    bt, br, bb, bl = b
+    iw = min(ar, br) - max(al, bl)
+    ih = min(ab, bb) - max(at, bt)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / ((ar - al) * (ab - at) + (br - bl) * (bb - bt) - inter)
+
+
+def collect_images(args):
+    images = []
+    for arg in args:
+        p = Path(arg)
+        if p.is_dir():
+            images.extend(sorted(f for f in p.rglob('*') if f.suffix.lower() in ALLOWED_EXT))
+        elif p.is_file():
+            images.append(p)
+    return images
+
+
+def main(args):
+    images = collect_images(args)
+    if not images:
+        print(__doc__)
+        return 1
+
+    reference = FacePipeline(detector="hog", fallback="")
+    pipelines = {}
+    for name in DETECTOR_BACKENDS:
+        try:
+            pipelines[name] = FacePipeline(detector=name, fallback="")
+        except Exception as e:
+            print(f"⚠ Skipping {name}: {e}")
+
+    stats = {name: {"found": 0, "ref": 0, "ious": [], "drift": [], "detect_ms": [], "encode_ms": []}
+             for name in pipelines}
+
+    for path in images:
+        image = FacePipeline.load(str(path))
+        ref_boxes = reference.detect(image)
+        ref_encodings = reference.encode(image, ref_boxes)
+        print(f"\n{path.name}: reference (hog) found {len(ref_boxes)} face(s)")
+
+        for name, pipeline in pipelines.items():
+            timings = {}
+            boxes = non_max_suppression(pipeline.detect(image, timings))
+            encodings = pipeline.encode(image, boxes, timings)
+            s = stats[name]
+            s["ref"] += len(ref_boxes)
+            s["detect_ms"].append(timings["detect_ms"])
+            s["encode_ms"].append(timings["encode_ms"])
+
+            for ref_box, ref_enc in zip(ref_boxes, ref_encodings):
+                scores = [iou(ref_box, b) for b in boxes]
+                if scores and max(scores) >= IOU_MATCH:
+                    best = int(np.argmax(scores))
+                    s["found"] += 1
+                    s["ious"].append(scores[best])
+                    s["drift"].append(float(np.linalg.norm(encodings[best] - ref_enc)))
+            print(f"  {name:5s} boxes={len(boxes):2d}  detect={timings['detect_ms']:8.1f} ms  encode={timings['encode_ms']:7.1f} ms")
+
+    print(f"\n{'='*70}")
+    print(f"{'backend':8s}{'recall':>8s}{'mean IoU':>10s}{'drift':>8s}{'detect ms':>12s}{'encode ms':>12s}")
+    failed = False
+    for name, s in stats.items():
+        recall = s["found"] / s["ref"] if s["ref"] else 1.0
+        drift = float(np.mean(s["drift"])) if s["drift"] else 0.0
+        mean_iou = float(np.mean(s["ious"])) if s["ious"] else 0.0
+        ok = recall >= MIN_RECALL and drift <= MAX_DRIFT
+        failed = failed or not ok
+        print(f"{name:8s}{recall:8.2f}{mean_iou:10.2f}{drift:8.3f}"
+              f"{np.mean(s['detect_ms']):12.1f}{np.mean(s['encode_ms']):12.1f}  {'✓' if ok else '✗'}")
+    print(f"{'='*70}\n")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
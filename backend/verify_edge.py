@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Local check of the offline edge matcher (services/edge_service.py,
+edge_matcher.py) against an in-memory MongoDB stand-in (mongomock).
+
+Enrols a few synthetic students, exports their department as a bundle and
+matches from it, checks the HTTP API's token, then records violations and
+syncs them twice: the replay must insert nothing and each counter must rise
+once. Finally a queue entry is cut mid-line, and the torn tail must be
+dropped rather than replayed. Nothing touches a real database.
+
+Usage:
+    pip install mongomock
+    python verify_edge.py [students]
+"""
+
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+import mongomock
+import numpy as np
+import db
+
+_client = mongomock.MongoClient()
+db.get_db_client = lambda *args, **kwargs: _client
+
+from edge_matcher import create_app
+from services.edge_service import EdgeMatcher, export_bundle
+from services.gallery_service import EMBEDDING_DIM, GalleryService
+from services.student_service import StudentService
+
+VIOLATION = {"section": "A", "type": "Late Arrival", "location": "A Block", "remarks": "verify_edge"}
+
+
+def enrol(count, rng):
+    version = GalleryService.live_pipeline().version
+    encodings = rng.normal(0, 0.1, (count, EMBEDDING_DIM))
+    students = [
+        StudentService.prepare_student({
+            "roll_no": f"23BQ1A{i:04d}", "name": f"Student {i}", "department": "CSE", "section": "A",
+            "year": "3rd Year", "face": StudentService.face_document([f"{i}.jpeg"], [encodings[i]], version),
+        })
+        for i in range(count)
+    ]
+    db.get_db().students.insert_many(students)
+    GalleryService.bump_version()
+    return students, encodings
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = np.random.default_rng(7)
+    failures = 0
+
+    def expect(label, ok):
+        nonlocal failures
+        failures += 0 if ok else 1
+        print(f"  {label:52s} {'✓' if ok else '✗'}")
+
+    db.init_db()
+    students, encodings = enrol(count, rng)
+    scratch = Path(tempfile.mkdtemp(prefix="verify_edge_"))
+    try:
+        print("Bundle:")
+        result = export_bundle("cse", scratch / "bundle")
+        expect(f"exports all {count} students", result["students"] == count)
+        matcher = EdgeMatcher(scratch / "bundle")
+        queries = encodings[:5] + rng.normal(0, 0.005, (5, EMBEDDING_DIM))
+        matches = matcher.match_encodings(queries)
+        expect("each capture matches its own student",
+               [m.get("student", {}).get("roll_no") for m in matches] == [s["roll_no"] for s in students[:5]])
+
+        print("HTTP API:")
+        client = create_app(matcher).test_client()
+        auth = {"Authorization": f"Bearer {result['token']}"}
+        first = students[0]["roll_no"]
+        expect("no token is refused", client.post("/sync").status_code == 401)
+        expect("a wrong token is refused", client.post(
+            "/api/violations/", json={**VIOLATION, "roll_no": first},
+            headers={"Authorization": "Bearer nope"}).status_code == 401)
+        expect("an unknown roll_no is refused", client.post(
+            "/api/violations/", json={**VIOLATION, "roll_no": "99XX0000"}, headers=auth).status_code == 400)
+        expect("a valid violation is queued", client.post(
+            "/api/violations/", json={**VIOLATION, "roll_no": first}, headers=auth).status_code == 202)
+
+        print("Sync:")
+        rolls = [s["roll_no"] for s in students[:3]]
+        for roll_no in rolls[1:]:
+            matcher.record_violation({**VIOLATION, "roll_no": roll_no})
+        queued = matcher.queue.pending_path.read_text()
+        synced = matcher.sync(batch_size=2)
+        expect("first sync inserts every queued violation", synced["inserted"] == 3 and not synced["errors"])
+
+        # As if the device crashed before recording the offset
+        matcher.queue.pending_path.write_text(queued)
+        replayed = matcher.sync(batch_size=2)
+        expect("replay inserts nothing", replayed["inserted"] == 0 and replayed["duplicates"] == 3)
+        violations = db.get_db().violations
+        expect("one violation stored per event", violations.count_documents({"remarks": "verify_edge"}) == 3)
+        counters = {
+            s["roll_no"]: (s.get("violations_count", 0), s.get("late_count", 0))
+            for s in db.get_db().students.find({"roll_no": {"$in": rolls}})
+        }
+        expect("each student's counters rose once", all(c == (1, 1) for c in counters.values()))
+
+        print("Queue file:")
+        queue = matcher.queue
+        queue.enqueue({**VIOLATION, "roll_no": first})
+        with open(queue.pending_path, "a") as f:
+            f.write('{"roll_no": "23BQ1A0001", "type": "Late')
+        sent = []
+        queue.replay(lambda batch: sent.extend(batch) or {"inserted": len(batch)})
+        expect("the torn tail is not replayed", len(sent) == 1)
+        expect("the queue is empty afterwards", queue.pending_count() == 0)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print("\n✅ Edge matcher checks passed" if not failures else f"\n❌ {failures} failed check(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
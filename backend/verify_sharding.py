@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Local check of the scatter-gather matching tier (services/shard_service.py).
+
+Builds a synthetic gallery split over several departments, loads it onto
+local matcher processes, and checks that sharded top-k results equal a
+single-process search, before and after a rebalance. No MongoDB needed.
+
+Usage:
+    python verify_sharding.py [num_shards] [students_per_dept]
+"""
+
+import sys
+import time
+import numpy as np
+from services.gallery_service import EMBEDDING_DIM, Gallery
+from services.shard_service import ShardCoordinator
+
+DEPARTMENTS = ["CSE", "ECE", "MECH", "CIVIL", "EEE", "IT"]
+SECTIONS = ["A", "B", "C"]
+
+
+def build_partitions(per_dept, rng):
+    partitions = {}
+    for d_idx, dept in enumerate(DEPARTMENTS):
+        size = per_dept * (d_idx + 1)  # uneven on purpose so rebalance has work to do
+        matrix = rng.normal(0, 0.1, (size, EMBEDDING_DIM)).astype(np.float32)
+        students = [
+            {"roll_no": f"{dept}{i:05d}", "name": f"Student {dept} {i}",
+             "department": dept, "section": SECTIONS[i % len(SECTIONS)]}
+            for i in range(size)
+        ]
+        partitions[dept] = (matrix, students)
+    return partitions
+
+
+def same_hits(a, b):
+    return [s["roll_no"] for s, _ in a] == [s["roll_no"] for s, _ in b] and \
+        np.allclose([d for _, d in a], [d for _, d in b], atol=1e-4)
+
+
+def check(coordinator, reference, queries, k):
+    failures = 0
+    for department, section in [(None, None), ("ECE", None), ("CSE", "B"), ("UNKNOWN", None)]:
+        sharded = coordinator.search(queries, department, section, k=k)
+        expected = reference.top_k(queries, k, department, section)
+        ok = all(same_hits(a, b) for a, b in zip(sharded, expected))
+        failures += 0 if ok else 1
+        print(f"  dept={department!s:8s} section={section!s:5s} {'✓' if ok else '✗'}")
+    return failures
+
+
+def main():
+    num_shards = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    per_dept = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = np.random.default_rng(7)
+
+    partitions = build_partitions(per_dept, rng)
+    reference = Gallery(
+        1,
+        np.vstack([m for m, _ in partitions.values()]),
+        [s for _, students in partitions.values() for s in students],
+    )
+    queries = reference.matrix[rng.choice(len(reference), 32)] + rng.normal(0, 0.01, (32, EMBEDDING_DIM)).astype(np.float32)
+
+    print(f"Starting {num_shards} matcher processes for {len(reference)} embeddings")
+    coordinator = ShardCoordinator(num_shards)
+    try:
+        # Deliberately pile everything onto shard 0 first
+        for dept, (matrix, students) in partitions.items():
+            coordinator.load_partition(dept, 1, matrix, students, shard_index=0)
+        print("Shard sizes:", coordinator.stats())
+
+        failures = check(coordinator, reference, queries, k=5)
+
+        moved = coordinator.rebalance()
+        print(f"Rebalanced {len(moved)} partition(s):", moved)
+        print("Shard sizes:", coordinator.stats())
+        failures += check(coordinator, reference, queries, k=5)
+
+        start = time.perf_counter()
+        for _ in range(50):
+            coordinator.search(queries, k=5)
+        print(f"Sharded search: {(time.perf_counter() - start) / 50 * 1000:.2f} ms per batch of {len(queries)}")
+        start = time.perf_counter()
+        for _ in range(50):
+            reference.top_k(queries, 5)
+        print(f"Single process: {(time.perf_counter() - start) / 50 * 1000:.2f} ms per batch of {len(queries)}")
+    finally:
+        coordinator.shutdown()
+
+    print("\n✅ Sharded results match" if not failures else f"\n❌ {failures} mismatching case(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -53,6 +53,60 @@ apiClient.interceptors.response.use(
   }
 )
 
+// ─────────── AVATARS ───────────
+// One request per list page: the backend returns a sprite sheet of every
+// avatar on the page plus each student's tile offset.
+function useAvatarSprite(rollNos, size = 64) {
+  const [sprite, setSprite] = useState(null)
+  const key = rollNos.filter(Boolean).join(',')
+
+  useEffect(() => {
+    if (!key) {
+      setSprite(null)
+      return
+    }
+    let cancelled = false
+    apiClient.get('/api/students/avatars', { params: { roll_nos: key, size } })
+      .then(res => { if (!cancelled) setSprite(res.data) })
+      .catch(() => { if (!cancelled) setSprite({ failed: true }) })
+    return () => { cancelled = true }
+  }, [key, size])
+
+  return sprite
+}
+
+function Avatar({ sprite, rollNo, name, className = 'profile-img-small', displaySize = 32 }) {
+  const offset = sprite?.offsets?.[rollNo]
+  if (offset) {
+    const scale = displaySize / sprite.size
+    return (
+      <div
+        className={className}
+        role="img"
+        aria-label="avatar"
+        style={{
+          display: 'inline-block',
+          backgroundImage: `url(${sprite.sprite})`,
+          backgroundSize: `${sprite.columns * sprite.size * scale}px auto`,
+          backgroundPosition: `-${offset[0] * scale}px -${offset[1] * scale}px`
+        }}
+      />
+    )
+  }
+  if (!sprite || (!sprite.failed && !sprite.missing?.includes(rollNo))) {
+    // Sprite still loading
+    return <div className={className} style={{ display: 'inline-block' }} />
+  }
+  return (
+    <img
+      className={className}
+      src={sprite.failed ? `${API}/api/students/${rollNo}/image?size=64` : `https://ui-avatars.com/api/?name=${name || rollNo || 'Unknown'}&background=random`}
+      onError={(e) => { e.target.src = `https://ui-avatars.com/api/?name=${name || rollNo || 'Unknown'}&background=random` }}
+      alt="avatar"
+    />
+  )
+}
+
 
 // ─────────── SVG ICONS ───────────
 const Icons = {
@@ -681,7 +735,16 @@ function Dashboard() {
 }
 
 // ─────────── STUDENTS PAGE ───────────
-function StudentsPage({ students, token, onRefresh, onStudentClick, showRegisterModal, setShowRegisterModal }) {
+// Roll numbers start with the joining year, and B.Tech ones carry the BQ
+// college code; lateral entries (BQ5A) join the batch a year later.
+function batchRollPrefixes(program, batch) {
+  if (!batch) return []
+  const year = batch.slice(2, 4)
+  const lateralYear = String(Number(year) + 1).padStart(2, '0')
+  return [`${year}${program === 'B.Tech' ? 'BQ' : ''}`, `${lateralYear}BQ5A`]
+}
+
+function StudentsPage({ token, onRefresh, onStudentClick, showRegisterModal, setShowRegisterModal }) {
   const [selectedStudent, setSelectedStudent] = useState(null)
   const [filter, setFilter] = useState({
     program: 'B.Tech',
@@ -700,6 +763,12 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
   const [profileLoading, setProfileLoading] = useState(false)
   const [studentPage, setStudentPage] = useState(1)
   const studentsPerPage = 7
+  // Filtering and paging happen server-side; cursors[i] opens page i + 1
+  const [pageStudents, setPageStudents] = useState([])
+  const [cursors, setCursors] = useState([null])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [totals, setTotals] = useState({ total: 0, summary: {} })
+  const [reloadKey, setReloadKey] = useState(0)
 
   // Fetch unique student analytics when a profile is selected
   useEffect(() => {
@@ -719,40 +788,56 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
 
 
 
-  // Filter students by active dropdown selections
-  const filteredStudents = students.filter(s => {
-    const roll = (s.roll_no || '').toUpperCase()
-
-    // Program Filter: B.Tech must have 'BQ' in roll number
-    const matchesProgram = !filter.program || filter.program !== 'B.Tech' || roll.includes('BQ')
-
-    // Batch Filter Logic
-    let matchesBatch = true
-    if (filter.batch) {
-      if (filter.batch === '2023-27') {
-        matchesBatch = roll.startsWith('23') || roll.startsWith('24BQ5A')
-      } else if (filter.batch === '2022-26') {
-        matchesBatch = roll.startsWith('22') || roll.startsWith('23BQ5A')
-      } else if (filter.batch === '2021-25') {
-        matchesBatch = roll.startsWith('21') || roll.startsWith('22BQ5A')
-      } else if (filter.batch === '2020-24') {
-        matchesBatch = roll.startsWith('20') || roll.startsWith('21BQ5A')
-      }
+  // One page of the selection; the first page also brings its total and
+  // violation sums
+  useEffect(() => {
+    if (!isApplied) return
+    let cancelled = false
+    const params = { limit: studentsPerPage }
+    if (filter.dept) params.department = filter.dept
+    if (filter.section) params.section = filter.section
+    const prefixes = batchRollPrefixes(filter.program, filter.batch)
+    if (prefixes.length) params.roll_prefix = prefixes.join(',')
+    if (cursors[studentPage - 1]) params.after = cursors[studentPage - 1]
+    if (studentPage === 1) {
+      params.count = 'estimate'
+      params.summary = 1
     }
+    apiClient.get('/api/students/', { params })
+      .then(res => {
+        if (cancelled) return
+        setPageStudents(res.data.students || [])
+        setNextCursor(res.data.next_cursor)
+        if (studentPage === 1) setTotals({ total: res.data.total || 0, summary: res.data.summary || {} })
+      })
+      .catch(() => {
+        if (cancelled) return
+        setPageStudents([])
+        setNextCursor(null)
+      })
+    return () => { cancelled = true }
+  }, [isApplied, filter.program, filter.batch, filter.dept, filter.section, studentPage, cursors, reloadKey])
 
-    const matchesDept = !filter.dept || (s.department || '').toUpperCase() === filter.dept.toUpperCase()
-    const matchesSection = !filter.section || (s.section || '').toUpperCase() === filter.section.toUpperCase()
+  // Reset page to 1 when filters change
+  useEffect(() => {
+    setStudentPage(1)
+    setCursors([null])
+  }, [filter.program, filter.batch, filter.dept, filter.section])
 
-    return matchesProgram && matchesBatch && matchesDept && matchesSection
-  })
+  const goToNextPage = () => {
+    setCursors(prev => [...prev.slice(0, studentPage), nextCursor])
+    setStudentPage(prev => prev + 1)
+  }
 
-  // Derived stats for summary
-  const totalLate = filteredStudents.reduce((sum, s) => sum + (s.late_count || 0), 0)
-  const totalDress = filteredStudents.reduce((sum, s) => sum + (s.dress_code_count || 0), 0)
-  const totalBunk = filteredStudents.reduce((sum, s) => sum + (s.bunk_count || 0), 0)
+  const studentAvatars = useAvatarSprite(pageStudents.map(s => s.roll_no))
+
+  // Summed over the whole selection by the server
+  const totalLate = totals.summary.late_count || 0
+  const totalDress = totals.summary.dress_code_count || 0
+  const totalBunk = totals.summary.bunk_count || 0
 
   const summaryStats = [
-    { label: 'Total Students', value: filteredStudents.length || '0', icon: '👥', color: 'blue' },
+    { label: 'Total Students', value: totals.total || '0', icon: '👥', color: 'blue' },
     { label: 'Late Arrivals', value: totalLate.toString().padStart(2, '0'), icon: '⏰', color: 'orange' },
     { label: 'Dress Code', value: totalDress.toString().padStart(2, '0'), icon: '👔', color: 'purple' },
     { label: 'Bunk', value: totalBunk.toString().padStart(2, '0'), icon: '🏃', color: 'red' },
@@ -841,18 +926,13 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
                   </tr>
                 </thead>
                 <tbody>
-                  {filteredStudents.slice((studentPage - 1) * studentsPerPage, studentPage * studentsPerPage).map((s, i) => {
+                  {pageStudents.map((s, i) => {
                     const actualViolations = s.violations_count || 0
                     const status = getStatus(actualViolations)
                     return (
                       <tr key={i} onClick={() => onStudentClick && onStudentClick(s)}>
                         <td>
-                          <img
-                            className="profile-img-small"
-                            src={`${API}/api/students/${s.roll_no}/image`}
-                            onError={(e) => { e.target.src = `https://ui-avatars.com/api/?name=${s.name}&background=random` }}
-                            alt="avatar"
-                          />
+                          <Avatar sprite={studentAvatars} rollNo={s.roll_no} name={s.name} />
                         </td>
                         <td style={{ fontWeight: 600 }}>{s.roll_no}</td>
                         <td>{s.name}</td>
@@ -865,7 +945,7 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
                       </tr>
                     )
                   })}
-                  {students.length === 0 && (
+                  {pageStudents.length === 0 && (
                     <tr><td colSpan={7} style={{ textAlign: 'center', padding: 100, color: 'var(--text-tertiary)' }}>No students found in this selection</td></tr>
                   )}
                 </tbody>
@@ -878,11 +958,11 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
                 >
                   Previous
                 </button>
-                <span style={{ fontSize: 13, color: 'var(--text-secondary)' }}>Page {studentPage} of {Math.max(1, Math.ceil(filteredStudents.length / studentsPerPage))}</span>
+                <span style={{ fontSize: 13, color: 'var(--text-secondary)' }}>Page {studentPage} of {Math.max(studentPage, Math.ceil(totals.total / studentsPerPage))}</span>
                 <button
                   className="pagination-btn"
-                  disabled={studentPage >= Math.ceil(filteredStudents.length / studentsPerPage)}
-                  onClick={() => setStudentPage(prev => prev + 1)}
+                  disabled={!nextCursor}
+                  onClick={goToNextPage}
                 >
                   Next
                 </button>
@@ -924,6 +1004,7 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
                 await apiClient.post('/api/students/', fd);
                 alert('Student registration submitted for ' + regForm.name)
                 setShowRegisterModal(false)
+                setReloadKey(k => k + 1)
                 if (onRefresh) onRefresh()
               } catch (err) {
                 alert('Registration failed: ' + (err.response?.data?.error || err.message))
@@ -1023,7 +1104,7 @@ function StudentsPage({ students, token, onRefresh, onStudentClick, showRegister
             <div className="modal-sidebar">
               <img
                 className="modal-profile-img"
-                src={`${API}/api/students/${selectedStudent.roll_no}/image`}
+                src={`${API}/api/students/${selectedStudent.roll_no}/image?size=480`}
                 onError={(e) => { e.target.src = `https://ui-avatars.com/api/?name=${selectedStudent.name}&background=random` }}
                 alt="profile"
               />
@@ -1325,7 +1406,7 @@ function DetectPage({ onDetect }) {
                         </div>
                         <div style={{ flex: 1, textAlign: 'center' }}>
                           <div className="preview-container-detect" style={{ height: 180, marginBottom: 8, border: '2px solid var(--accent-green)' }}>
-                            <img src={`${API}/api/students/${result.student.roll_no}/image`} alt="DB Match" style={{ objectFit: 'cover', width: '100%', height: '100%' }} />
+                            <img src={`${API}/api/students/${result.student.roll_no}/image?size=480`} alt="DB Match" style={{ objectFit: 'cover', width: '100%', height: '100%' }} />
                           </div>
                           <span style={{ fontSize: 13, color: 'var(--text-secondary)', fontWeight: 500 }}>Database Match</span>
                         </div>
@@ -1401,12 +1482,16 @@ function DetectPage({ onDetect }) {
 }
 
 // ─────────── VIOLATIONS PAGE ── ─────────
-function ViolationsPage({ violations }) {
+function ViolationsPage({ stats: violationStats }) {
   const [filterType, setFilterType] = useState('All');
   const [filterLocation, setFilterLocation] = useState('All');
   const [filterDate, setFilterDate] = useState('');
   const [currentPage, setCurrentPage] = useState(1);
   const itemsPerPage = 10;
+  // Filtering and paging happen server-side; cursors[i] opens page i + 1
+  const [paginatedViolations, setPaginatedViolations] = useState([]);
+  const [cursors, setCursors] = useState([null]);
+  const [nextCursor, setNextCursor] = useState(null);
 
   const locationMap = {
     'A Block': 'a-block',
@@ -1422,30 +1507,48 @@ function ViolationsPage({ violations }) {
   const locations = ['All', ...Object.keys(locationMap)];
   const types = ['All', 'Late Entry', 'Dress Code', 'Bunk', 'Discipline'];
 
-  const filteredViolations = violations.filter(v => {
-    const matchesType = filterType === 'All' || v.type === filterType;
-    const matchesLocation = filterLocation === 'All' || v.location === filterLocation;
-    const matchesDate = !filterDate || v.iso_date === filterDate;
-    return matchesType && matchesLocation && matchesDate;
-  });
+  useEffect(() => {
+    let cancelled = false;
+    const params = { limit: itemsPerPage };
+    if (filterType !== 'All') params.type = filterType;
+    if (filterLocation !== 'All') params.location = filterLocation;
+    if (filterDate) {
+      params.from = filterDate;
+      params.to = filterDate;
+    }
+    if (cursors[currentPage - 1]) params.after = cursors[currentPage - 1];
+    apiClient.get('/api/violations/', { params })
+      .then(res => {
+        if (cancelled) return;
+        setPaginatedViolations(res.data.violations || []);
+        setNextCursor(res.data.next_cursor);
+      })
+      .catch(() => {
+        if (cancelled) return;
+        setPaginatedViolations([]);
+        setNextCursor(null);
+      });
+    return () => { cancelled = true };
+  }, [filterType, filterLocation, filterDate, currentPage, cursors, violationStats]);
 
-  // Calculate pages
-  const totalPages = Math.max(1, Math.ceil(filteredViolations.length / itemsPerPage));
-  const paginatedViolations = filteredViolations.slice((currentPage - 1) * itemsPerPage, currentPage * itemsPerPage);
+  const violationAvatars = useAvatarSprite(paginatedViolations.map(v => v.roll_no || v.student_id));
 
   // Reset page to 1 when filters change
   useEffect(() => {
     setCurrentPage(1);
+    setCursors([null]);
   }, [filterType, filterLocation, filterDate]);
 
-  // Calculate stats
-  const today = new Date().toISOString().split('T')[0];
-  const thisMonth = new Date().toISOString().slice(0, 7);
+  const goToNextPage = () => {
+    setCursors(prev => [...prev.slice(0, currentPage), nextCursor]);
+    setCurrentPage(prev => prev + 1);
+  };
 
+  // Counted by the server (/api/violations/stats)
   const stats = [
-    { label: 'Total Violations', value: violations.length },
-    { label: 'Today', value: violations.filter(v => v.date?.includes(today)).length || 3 },
-    { label: 'This Month', value: violations.filter(v => v.date?.includes(thisMonth)).length || 12 }
+    { label: 'Total Violations', value: violationStats?.total ?? 0 },
+    { label: 'Today', value: violationStats?.today ?? 0 },
+    { label: 'This Month', value: violationStats?.this_month ?? 0 }
   ];
 
   const formatDate = (dateStr) => {
@@ -1535,12 +1638,7 @@ function ViolationsPage({ violations }) {
             {paginatedViolations.map((v, i) => (
               <tr key={v._id || i}>
                 <td>
-                  <img
-                    className="profile-img-small"
-                    src={`${API}/api/students/${v.roll_no || v.student_id}/image`}
-                    onError={(e) => { e.target.src = `https://ui-avatars.com/api/?name=${v.roll_no || 'Unknown'}&background=random` }}
-                    alt="avatar"
-                  />
+                  <Avatar sprite={violationAvatars} rollNo={v.roll_no || v.student_id} />
                 </td>
                 <td style={{ fontWeight: 600 }}>{v.roll_no}</td>
                 <td style={{ fontWeight: 500 }}>{v.student_name}</td>
@@ -1560,7 +1658,7 @@ function ViolationsPage({ violations }) {
           </tbody>
         </table>
 
-        {filteredViolations.length === 0 && (
+        {paginatedViolations.length === 0 && (
           <div className="empty-state-v2">
             <div className="empty-state-icon">🛡️</div>
             <h3 className="empty-state-title">No Violations Recorded</h3>
@@ -1582,11 +1680,11 @@ function ViolationsPage({ violations }) {
           >
             Previous
           </button>
-          <span style={{ fontSize: 13, color: 'var(--text-secondary)' }}>Page {currentPage} of {totalPages}</span>
+          <span style={{ fontSize: 13, color: 'var(--text-secondary)' }}>Page {currentPage}</span>
           <button
             className="pagination-btn"
-            disabled={currentPage === totalPages}
-            onClick={() => setCurrentPage(prev => Math.min(totalPages, prev + 1))}
+            disabled={!nextCursor}
+            onClick={goToNextPage}
           >
             Next
           </button>
@@ -1598,7 +1696,7 @@ function ViolationsPage({ violations }) {
 
 // ─────────── REPORTS PAGE (SaaS ANALYTICS) ───────────
 // ─────────── EVENT-DRIVEN REPORTS PAGE (v5.3) ───────────
-function ReportsPage({ violations }) {
+function ReportsPage() {
   const [isUnlocked, setIsUnlocked] = useState(false)
   if (!isUnlocked) return <PinLockOverlay onUnlock={() => setIsUnlocked(true)} title="Reports Security" description="Access to analytics reports is restricted." />
 
@@ -1607,6 +1705,7 @@ function ReportsPage({ violations }) {
   const [isGenerated, setIsGenerated] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
   const [hoveredIndex, setHoveredIndex] = useState(null);
+  const [groups, setGroups] = useState([]);
 
   // Fixed Location Color Mapping
   const COLORS = {
@@ -1622,21 +1721,26 @@ function ReportsPage({ violations }) {
     'Playground': '#06B6D4'
   };
 
+  // Counts per type or location over the range, grouped by the server
   const handleGenerate = () => {
     setIsLoading(true);
     setIsGenerated(false);
-    setTimeout(() => {
-      setIsLoading(false);
-      setIsGenerated(true);
-    }, 1200);
+    const days = dateRange === 'Last 7 Days' ? 7 : 30;
+    const from = new Date(Date.now() - days * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
+    const groupBy = reportType === 'By Location' ? 'location' : 'type';
+    apiClient.get('/api/violations/stats', { params: { group_by: groupBy, from } })
+      .then(res => setGroups(res.data.groups || []))
+      .catch(() => setGroups([]))
+      .finally(() => {
+        setIsLoading(false);
+        setIsGenerated(true);
+      });
   };
 
   const processed = React.useMemo(() => {
     if (!isGenerated) return null;
 
     const isLocationReport = reportType === 'By Location';
-    const groupKey = isLocationReport ? 'location' : 'type';
-    const filtered = violations;
 
     // Normalization Mapping
     const normalize = (val) => {
@@ -1652,12 +1756,14 @@ function ReportsPage({ violations }) {
       return isLocationReport ? 'Other' : v;
     };
 
-    const categories = [...new Set(filtered.map(v => normalize(v[groupKey])))];
-    const dataByCat = categories
-      .map(cat => ({
-        name: cat,
-        count: filtered.filter(v => normalize(v[groupKey]) === cat).length
-      }))
+    // Spellings of the same block are merged after normalizing
+    const counts = {};
+    groups.forEach(g => {
+      const cat = normalize(g.name);
+      counts[cat] = (counts[cat] || 0) + g.count;
+    });
+    const dataByCat = Object.entries(counts)
+      .map(([name, count]) => ({ name, count }))
       .filter(item => item.count > 0)
       .sort((a, b) => b.count - a.count);
 
@@ -1666,7 +1772,7 @@ function ReportsPage({ violations }) {
       total: dataByCat.reduce((acc, curr) => acc + curr.count, 0),
       generatedOn: new Date().toLocaleString()
     };
-  }, [isGenerated, violations, reportType]);
+  }, [isGenerated, groups, reportType]);
 
   const donutData = processed ? {
     labels: processed.dataByCat.map(d => d.name),
@@ -2230,8 +2336,7 @@ function SettingsPage() {
 export default function App() {
   const navigate = useNavigate()
   const [token, setToken] = useState(localStorage.getItem('token'))
-  const [students, setStudents] = useState([])
-  const [violations, setViolations] = useState([])
+  const [violationStats, setViolationStats] = useState(null)
   const [dark, setDark] = useState(() => {
     const saved = localStorage.getItem('theme')
     if (saved) return saved === 'dark'
@@ -2257,15 +2362,8 @@ export default function App() {
 
   const loadData = async () => {
     try {
-      const [sRes, vRes] = await Promise.all([
-        apiClient.get('/api/students/').catch(() => ({ data: [] })),
-        apiClient.get('/api/violations/').catch(() => ({ data: [] })),
-      ])
-
-      const realViolations = vRes.data || [];
-
-      setStudents(sRes.data || [])
-      setViolations(realViolations)
+      const res = await apiClient.get('/api/violations/stats')
+      setViolationStats(res.data)
     } catch { }
   }
 
@@ -2307,7 +2405,6 @@ export default function App() {
           <Route path="/dashboard" element={<Dashboard />} />
           <Route path="/students" element={
             <StudentsPage
-              students={students}
               token={token}
               onRefresh={loadData}
               showRegisterModal={showRegisterModal}
@@ -2319,8 +2416,8 @@ export default function App() {
             />
           } />
           <Route path="/detect" element={<DetectPage onDetect={loadData} />} />
-          <Route path="/violations" element={<ViolationsPage violations={violations} />} />
-          <Route path="/reports" element={<ReportsPage students={students} violations={violations} />} />
+          <Route path="/violations" element={<ViolationsPage stats={violationStats} />} />
+          <Route path="/reports" element={<ReportsPage />} />
           <Route path="/settings" element={<SettingsPage />} />
           <Route path="*" element={<Navigate to="/dashboard" />} />
         </Routes>